@@ -0,0 +1,108 @@
+"""
+Peak Python memory of get_email_attachment for a large binary attachment,
+measured with tracemalloc, against the fake Gmail API running in a child
+process (so its own copies of the file are not counted).
+
+Exits non-zero if a first download peaks above --max-ratio times the file
+size, or a ranged re-read of the stored file above --max-reread-mb, so it
+can be used as a regression check:
+
+    python benchmarks/bench_attachment_memory.py --size-mb 25
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import multiprocessing
+from datetime import datetime, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+sys.path.insert(0, HERE)
+
+from fake_gmail import FakeMailbox, start_fake_gmail
+from bench_search import install_fake_pool
+
+MESSAGE_ID = 'big0000000000001'
+
+
+def serve(size: int, port_queue):
+    mailbox = FakeMailbox(0)
+    attachments = [('archive.bin', 'application/octet-stream', os.urandom(size)),
+                   ('photo.png', 'image/png', os.urandom(size // 4))]
+    mailbox.add_message(MESSAGE_ID, 'Backup <backup@example.com>', 'Your backup', datetime.now(timezone.utc),
+                        '<p>Attached.</p>', attachments=attachments)
+    server = start_fake_gmail(mailbox)
+    port_queue.put(server.url)
+    time.sleep(3600)
+
+
+def measure(fn) -> tuple:
+    """
+    Returns (result, seconds, peak traced bytes).
+    """
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=float, default=25)
+    parser.add_argument('--max-ratio', type=float, default=3.0, help='Allowed first-download peak / file size')
+    parser.add_argument('--max-reread-mb', type=float, default=8.0, help='Allowed peak for a ranged re-read')
+    args = parser.parse_args()
+    size = int(args.size_mb * 1024 * 1024)
+
+    port_queue = multiprocessing.Queue()
+    child = multiprocessing.Process(target=serve, args=(size, port_queue), daemon=True)
+    child.start()
+    url = port_queue.get(timeout=60)
+
+    cache_dir = tempfile.mkdtemp(prefix='attachment-bench-')
+    os.environ['GMAIL_CACHE_DIR'] = cache_dir
+    install_fake_pool(url)
+    import server
+
+    mb = 1024 * 1024
+    calls = [
+        ('binary, first download', dict(attachment_id=f'att-{MESSAGE_ID}-1')),
+        ('binary, re-read at offset', dict(attachment_id=f'att-{MESSAGE_ID}-1', offset=size // 2)),
+        ('image, first download', dict(attachment_id=f'att-{MESSAGE_ID}-2')),
+    ]
+    print(f"attachment {size / mb:.1f} MB, image {size / 4 / mb:.1f} MB")
+    print(f"{'call':<28} {'time':>8} {'peak':>10} {'peak/size':>10} {'output':>10}")
+    failures = []
+    try:
+        # Load the Gmail client and credentials outside the measurement
+        server.get_gmail_service()
+        for name, arguments in calls:
+            output, seconds, peak = measure(lambda: server.get_email_attachment(MESSAGE_ID, **arguments))
+            if 'Error' in output[:200]:
+                failures.append(f"{name}: {output[:200]}")
+            file_size = size if 'binary' in name else size // 4
+            print(f"{name:<28} {seconds * 1000:>6.0f}ms {peak / mb:>8.1f}MB {peak / file_size:>9.2f}x "
+                  f"{len(output) / 1024:>8.0f}KB")
+            if 'first' in name and peak > args.max_ratio * file_size:
+                failures.append(f"{name}: peak {peak / mb:.1f} MB exceeds {args.max_ratio}x file size")
+            if 're-read' in name and peak > args.max_reread_mb * mb:
+                failures.append(f"{name}: peak {peak / mb:.1f} MB exceeds {args.max_reread_mb} MB")
+    finally:
+        child.terminate()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
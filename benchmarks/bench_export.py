@@ -0,0 +1,134 @@
+"""
+Bulk export (src/mail_export.py) against the local fake Gmail API:
+
+- throughput with 1 worker vs. EXPORT_WORKERS, JSONL and mbox
+- an export interrupted part-way (with a torn write after the last
+  checkpoint) and resumed must produce the same file as an uninterrupted one
+- peak traced memory exporting N and 4N messages must stay about the same
+
+The limiter's quota is raised (GMAIL_QUOTA_UNITS_PER_SECOND) so runs are
+bound by latency rather than by the 50 messages/s a real account allows.
+Exits non-zero if any check fails.
+
+    python benchmarks/bench_export.py --messages 500 --latency-ms 30
+"""
+import os
+import sys
+import time
+import shutil
+import mailbox
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+sys.path.insert(0, HERE)
+os.environ.setdefault('GMAIL_QUOTA_UNITS_PER_SECOND', '100000')
+os.environ.setdefault('GMAIL_QUOTA_BURST', '100000')
+
+from fake_gmail import FakeMailbox, start_fake_gmail, make_rich_html_receipt, make_pdf
+from bench_search import install_fake_pool
+
+
+def build_mailbox(messages: int) -> FakeMailbox:
+    """
+    Plain receipts, with every tenth one a rich HTML receipt carrying a PDF.
+    Some bodies contain "From " lines to exercise mbox quoting.
+    """
+    mailbox = FakeMailbox(messages - messages // 10)
+    start = datetime(2024, 6, 1, tzinfo=timezone.utc)
+    for n in range(messages // 10):
+        html = make_rich_html_receipt('Swiggy', n, items=10) + "\nFrom the kitchen: thanks!\n"
+        mailbox.add_message(f"rich{n:012d}", 'Swiggy <noreply@swiggy.in>', f"Your Swiggy order #{n}",
+                            start + timedelta(hours=n), html,
+                            attachments=[(f"invoice-{n}.pdf", 'application/pdf', make_pdf([f"Invoice {n}"]))])
+    return mailbox
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--latency-ms', type=float, default=30.0)
+    parser.add_argument('--max-memory-growth', type=float, default=1.5,
+                        help='Allowed peak memory at 4x messages / peak at 1x')
+    args = parser.parse_args()
+
+    large = build_mailbox(args.messages * 4)
+    small_ids = set(large.order[:args.messages])
+    fake = start_fake_gmail(large, latency_ms=args.latency_ms)
+    install_fake_pool(fake.url)
+    import mail_export
+
+    out_dir = tempfile.mkdtemp(prefix='export-bench-')
+    failures = []
+    mb = 1e6
+    try:
+        mail_export.get_service_pool().get_service()
+        print(f"{args.messages} messages, {args.latency_ms:.0f} ms per Gmail request")
+        print(f"{'run':<30} {'time':>8} {'msg/s':>7} {'size':>9}")
+        for output_format in mail_export.FORMATS:
+            for workers in (1, mail_export.EXPORT_WORKERS):
+                path = os.path.join(out_dir, f"w{workers}.{output_format}")
+                start = time.perf_counter()
+                state = None
+                for state in mail_export.export_messages(path, '', output_format, args.messages, workers=workers):
+                    pass
+                seconds = time.perf_counter() - start
+                print(f"{output_format + f', {workers} workers':<30} {seconds:>7.2f}s "
+                      f"{state['exported'] / seconds:>7.0f} {state['bytes'] / mb:>7.1f}MB")
+                if state['exported'] != args.messages:
+                    failures.append(f"{path}: exported {state['exported']} of {args.messages}")
+
+            # Same export, interrupted after a few batches with a torn write, then resumed
+            reference = os.path.join(out_dir, f"w{mail_export.EXPORT_WORKERS}.{output_format}")
+            path = os.path.join(out_dir, f"resumed.{output_format}")
+            first = None
+            for i, first in enumerate(mail_export.export_messages(path, '', output_format, args.messages)):
+                if i + 1 >= 3:
+                    break
+            with open(path, 'ab') as f:
+                f.write(b'{"torn": ')
+            for state in mail_export.export_messages(path, '', output_format, args.messages):
+                pass
+            same = open(path, 'rb').read() == open(reference, 'rb').read()
+            print(f"{output_format + ', interrupted + resumed':<30} stopped at {first['exported']}, "
+                  f"identical to uninterrupted: {same}")
+            if not same:
+                failures.append(f"{output_format}: resumed export differs from uninterrupted export")
+
+        # The mbox must read back as one message per export, and JSONL as one line each
+        box = mailbox.mbox(os.path.join(out_dir, "w1.mbox"), create=False)
+        ids = {m['X-GM-THRID'] for m in box}
+        if len(box) != args.messages or ids != small_ids:
+            failures.append(f"mbox reads back as {len(box)} messages")
+        box.close()
+        with open(os.path.join(out_dir, 'w1.jsonl'), 'rb') as f:
+            lines = sum(1 for _ in f)
+        if lines != args.messages:
+            failures.append(f"jsonl has {lines} lines")
+
+        peaks = {}
+        for count in (args.messages, args.messages * 4):
+            path = os.path.join(out_dir, f"memory-{count}.mbox")
+            tracemalloc.start()
+            for _ in mail_export.export_messages(path, '', 'mbox', count):
+                pass
+            peaks[count] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{f'peak memory, {count} messages':<30} {peaks[count] / mb:>7.1f}MB")
+        growth = peaks[args.messages * 4] / peaks[args.messages]
+        if growth > args.max_memory_growth:
+            failures.append(f"peak memory grew {growth:.2f}x for 4x the messages")
+    finally:
+        fake.shutdown()
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
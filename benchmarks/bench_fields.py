@@ -0,0 +1,98 @@
+"""
+Bytes downloaded from Gmail per tool, requesting whole resources
+(GMAIL_FIELDS=0) versus field-projected partial responses, against the
+local fake Gmail API. The mailbox mixes plain receipts, large HTML
+newsletters with a text alternative, and mails with several attachments.
+
+    python benchmarks/bench_fields.py --messages 50 --attachments 4
+"""
+import os
+import sys
+import argparse
+from datetime import datetime, timedelta, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+sys.path.insert(0, HERE)
+
+from fake_gmail import FakeMailbox, start_fake_gmail, make_rich_html_receipt, make_statement_pdf
+from bench_search import install_fake_pool
+
+
+def build_mailbox(messages: int, attachments: int) -> tuple:
+    """
+    Returns (mailbox, newsletter IDs, (message ID, attachment ID) pairs).
+    """
+    mailbox = FakeMailbox(messages)
+    start = datetime(2024, 6, 1, tzinfo=timezone.utc)
+    newsletters, files = [], []
+    for n in range(5):
+        message_id = f"news{n:012d}"
+        html = make_rich_html_receipt('Weekly Deals', n, items=60)
+        mailbox.add_message(message_id, 'Deals <news@deals.example.com>', f"This week's deals #{n}",
+                            start + timedelta(days=n), html, text=f"This week's deals #{n}\n" + "Deal line\n" * 400)
+        newsletters.append(message_id)
+    for n in range(5):
+        message_id = f"docs{n:012d}"
+        mailbox.add_message(message_id, 'Bank <statements@bank.example.com>', f"Statements #{n}",
+                            start + timedelta(days=10 + n), '<p>Your statements are attached.</p>',
+                            attachments=[(f"statement-{k}.pdf", 'application/pdf', make_statement_pdf(2, 10, k))
+                                         for k in range(attachments)])
+        files.append((message_id, f"att-{message_id}-1"))
+    return mailbox, newsletters, files
+
+
+def tool_bytes(metrics) -> dict:
+    return {key[0]: value for _, key, value in metrics.TOOL_GMAIL_BYTES.samples()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=50, help='Plain receipts in the mailbox')
+    parser.add_argument('--attachments', type=int, default=4, help='Attachments per multi-attachment mail')
+    args = parser.parse_args()
+
+    mailbox, newsletters, files = build_mailbox(args.messages, args.attachments)
+    fake = start_fake_gmail(mailbox)
+    os.environ['GMAIL_ATTACHMENT_STORE'] = '0'
+    os.environ['PDF_TEXT_CACHE'] = '0'
+    install_fake_pool(fake.url)
+    import gmail_client
+    import metrics
+    import server
+    import pdf_extract
+
+    calls = {
+        'search_emails': [dict(max_results=len(mailbox.order))],
+        'get_email_content (newsletters)': [dict(email_id=i) for i in newsletters],
+        'get_email_content (attachments)': [dict(email_id=i) for i, _ in files],
+        'get_email_attachment': [dict(email_id=i, attachment_id=a) for i, a in files],
+    }
+    functions = {
+        'search_emails': server.search_emails,
+        'get_email_content (newsletters)': server.get_email_content,
+        'get_email_content (attachments)': server.get_email_content,
+        'get_email_attachment': server.get_email_attachment,
+    }
+
+    results = {}
+    for projection in (False, True):
+        gmail_client.FIELD_PROJECTION = projection
+        for name, argument_list in calls.items():
+            before = tool_bytes(metrics).get(name, 0)
+            traced = metrics.traced(name, functions[name])
+            for arguments in argument_list:
+                traced(**arguments)
+            results[name, projection] = tool_bytes(metrics).get(name, 0) - before
+
+    print(f"{'tool':<34} {'calls':>6} {'whole':>12} {'projected':>12} {'saved':>7}")
+    for name, argument_list in calls.items():
+        whole, projected = results[name, False], results[name, True]
+        saved = 1 - projected / whole if whole else 0.0
+        print(f"{name:<34} {len(argument_list):>6} {whole:>11,}B {projected:>11,}B {saved:>7.1%}")
+    pdf_extract.shutdown_pdf_extractor()
+    fake.shutdown()
+
+
+if __name__ == '__main__':
+    main()
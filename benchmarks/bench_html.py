@@ -0,0 +1,93 @@
+"""
+Throughput and peak memory of the HTML-to-text backends over receipt-sized
+HTML fixtures (marketing-template markup from a few KB to a few hundred KB).
+
+First checks that the streaming extractor keeps the same words as bs4 on
+markup with hidden elements, where the bs4 side is given the markup with
+the hidden element already removed (bs4 itself does not hide anything).
+Exits non-zero on a mismatch.
+
+    python benchmarks/bench_html.py --items 5 50 200 --repeat 20
+"""
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+sys.path.insert(0, HERE)
+
+from fake_gmail import make_rich_html_receipt
+from html_text import BACKENDS, html_to_text, stream_to_text, bs4_to_text
+
+# (HTML with hidden elements, the same HTML with them removed)
+PARITY_CASES = [
+    ('<div style="display:none">preheader</div><p>Order total ₹500</p>', '<p>Order total ₹500</p>'),
+    # Hidden element whose end tag is optional and left out
+    ('<p style="display:none">hidden<p>visible para<p>another', '<p>visible para<p>another'),
+    ('<dl><dt hidden>x<dd>shown<dt>term</dl><p>after', '<dl><dd>shown<dt>term</dl><p>after'),
+    ('<ul><li hidden>old price<li>new price</ul>total', '<ul><li>new price</ul>total'),
+    # Hidden cell holding a whole table
+    ('<table><tr><td hidden>a<table><tr><td>inner</td></tr></table>more hidden</td><td>visible</td></tr></table>',
+     '<table><tr><td></td><td>visible</td></tr></table>'),
+    ('<div hidden>a<div>b</div>c</div>d', 'd'),
+]
+
+
+def throughput(convert, html: str, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        convert(html)
+    return repeat / (time.perf_counter() - start)
+
+
+def peak_memory(convert, html: str) -> int:
+    tracemalloc.start()
+    convert(html)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def words(text: str) -> list:
+    # The streaming extractor marks list items with "- "; bs4 does not
+    return [word for word in text.split() if word != '-']
+
+
+def check_parity() -> list:
+    return [html for html, visible in PARITY_CASES if words(stream_to_text(html)) != words(bs4_to_text(visible))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, nargs='+', default=[5, 50, 200], help='Line items per fixture')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    failures = check_parity()
+    print(f"hidden-element parity with bs4: {len(PARITY_CASES) - len(failures)}/{len(PARITY_CASES)} ok")
+    for html in failures:
+        print(f"  FAIL {html!r}: {stream_to_text(html)!r}")
+
+    print(f"{'items':>6} {'size':>8} {'backend':>8} {'docs/s':>9} {'MB/s':>7} {'peak mem':>10}")
+    for items in args.items:
+        html = make_rich_html_receipt('Swiggy', items, items=items)
+        for name, convert in BACKENDS.items():
+            rate = throughput(convert, html, args.repeat)
+            peak = peak_memory(convert, html)
+            print(f"{items:>6} {len(html) / 1024:>6.0f}KB {name:>8} {rate:>9.1f} "
+                  f"{rate * len(html) / 1e6:>7.2f} {peak / 1024:>8.0f}KB")
+
+    html = make_rich_html_receipt('Swiggy', 0, items=max(args.items))
+    html_to_text(html, key='bench')
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        html_to_text(html, key='bench')
+    print(f"memoized repeat: {(time.perf_counter() - start) / args.repeat * 1e6:.1f}us per call")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
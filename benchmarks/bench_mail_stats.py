@@ -0,0 +1,218 @@
+"""
+Group-by / top-N queries on the MailStats index (mail_stats.py).
+
+First the mailbox mirror is seeded from the local fake Gmail API. The
+index's answers are checked against a plain Python count over the
+mirror's table. They are checked again after History API deltas (new
+mail, deletions, a message moved to Trash), this time against an index
+freshly loaded from the table. Then --rows synthetic messages are loaded
+straight into an index, and each query's latency is compared with the
+same GROUP BY in SQLite.
+
+Exits non-zero if the index disagrees with the reference.
+
+    python benchmarks/bench_mail_stats.py --messages 1000 --rows 300000
+"""
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+sys.path.insert(0, HERE)
+
+from fake_gmail import make_fixture_mailbox, start_fake_gmail, make_html_receipt
+from bench_search import install_fake_pool
+
+QUERIES = [
+    ('top senders, all mail', dict(group_by='sender')),
+    ('top senders, one quarter', dict(group_by='sender', start=datetime(2024, 4, 1), end=datetime(2024, 7, 1))),
+    ('top domains with attachments', dict(group_by='domain', has_attachment=True)),
+    ('sender filter by month', dict(group_by='month', sender='amazon')),
+    ('labels', dict(group_by='label')),
+    ('one label by year', dict(group_by='year', label='CATEGORY_PURCHASES')),
+    ('senders by size', dict(group_by='sender', order_by='size')),
+]
+
+
+def check(condition: bool, message: str):
+    print(f"  [{'ok' if condition else 'FAIL'}] {message}")
+    if not condition:
+        sys.exit(1)
+
+
+def reference(conn, group_by, start=None, end=None, sender=None, label=None, has_attachment=None,
+              top=None) -> Counter:
+    """
+    The same count as MailStats.query(), one row at a time in Python.
+    """
+    from mail_stats import MailStats, HIDDEN_LABELS
+    names = MailStats()
+    counts = Counter()
+    for date, from_, label_ids, size, attachment in conn.execute(
+            "SELECT internal_date, sender, label_ids, size_estimate, has_attachment FROM messages"):
+        labels = label_ids.split(',') if label_ids else []
+        if any(hidden in labels for hidden in HIDDEN_LABELS) and label not in HIDDEN_LABELS:
+            continue
+        if start and date < start.timestamp() * 1000 or end and date >= end.timestamp() * 1000:
+            continue
+        name = names._sender_names[names._sender_code(from_)]
+        if sender and sender.lower() not in name.lower():
+            continue
+        if label and label not in labels or has_attachment is not None and bool(attachment) != has_attachment:
+            continue
+        when = datetime.fromtimestamp(date / 1000)
+        keys = {
+            'sender': [name],
+            'domain': [name.rstrip('>').rsplit('@', 1)[-1]],
+            'label': labels,
+            'month': [f"{when.year}-{when.month:02d}"],
+            'year': [f"{when.year}"],
+        }[group_by]
+        for key in keys:
+            counts[key] += 1
+    return counts
+
+
+def as_counts(result: dict) -> Counter:
+    return Counter({g['key']: g['messages'] for g in result['groups']})
+
+
+def synthetic_rows(count: int, seed: int = 0):
+    random.seed(seed)
+    senders = [f"Shop {n} <orders@shop{n}.example.com>" for n in range(3000)]
+    weights = [1 / (n + 1) for n in range(len(senders))]
+    label_sets = [['INBOX', 'CATEGORY_UPDATES'], ['INBOX', 'CATEGORY_PURCHASES'], ['CATEGORY_PROMOTIONS'],
+                  ['INBOX', 'Label_1', 'CATEGORY_PURCHASES'], ['TRASH', 'CATEGORY_PROMOTIONS'], ['SENT']]
+    start = datetime(2016, 1, 1, tzinfo=timezone.utc).timestamp() * 1000
+    span = (datetime(2025, 1, 1, tzinfo=timezone.utc).timestamp() * 1000) - start
+    picked = random.choices(senders, weights, k=count)
+    for n in range(count):
+        yield (f"{n:016x}", int(start + random.random() * span), picked[n], random.choice(label_sets),
+               random.randrange(2000, 400000), random.random() < 0.2)
+
+
+def sqlite_query(conn, query: dict):
+    """
+    The nearest SQLite equivalent of a query, for comparison.
+    """
+    clauses = ["(',' || label_ids || ',') NOT LIKE '%,TRASH,%'"]
+    params = []
+    if query.get('start'):
+        clauses.append("internal_date >= ?")
+        params.append(int(query['start'].timestamp() * 1000))
+    if query.get('end'):
+        clauses.append("internal_date < ?")
+        params.append(int(query['end'].timestamp() * 1000))
+    if query.get('sender'):
+        clauses.append("sender LIKE ?")
+        params.append(f"%{query['sender']}%")
+    if query.get('label'):
+        clauses.append("(',' || label_ids || ',') LIKE ?")
+        params.append(f"%,{query['label']},%")
+    if query.get('has_attachment') is not None:
+        clauses.append("has_attachment = ?")
+        params.append(int(query['has_attachment']))
+    key = {
+        'sender': "sender",
+        'domain': "substr(sender, instr(sender, '@') + 1)",
+        'label': "label_ids",
+        'month': "strftime('%Y-%m', internal_date / 1000, 'unixepoch')",
+        'year': "strftime('%Y', internal_date / 1000, 'unixepoch')",
+    }[query['group_by']]
+    order = "SUM(size_estimate)" if query.get('order_by') == 'size' else "COUNT(*)"
+    return conn.execute(f"SELECT {key}, COUNT(*), SUM(size_estimate), MAX(internal_date) FROM messages "
+                        f"WHERE {' AND '.join(clauses)} GROUP BY 1 ORDER BY {order} DESC LIMIT 20", params).fetchall()
+
+
+def timed(fn, repeat: int = 5) -> tuple:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return result, sorted(times)[len(times) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=1000, help='Messages in the fake Gmail mailbox')
+    parser.add_argument('--rows', type=int, default=300000, help='Synthetic messages for the latency run')
+    parser.add_argument('--latency-ms', type=float, default=5.0)
+    args = parser.parse_args()
+
+    mailbox = make_fixture_mailbox(args.messages)
+    fake = start_fake_gmail(mailbox, latency_ms=args.latency_ms)
+    install_fake_pool(fake.url)
+    import server
+    import mailbox_sync
+    from mail_stats import MailStats
+
+    with tempfile.TemporaryDirectory() as tmp:
+        mirror = mailbox_sync.MailboxMirror(os.path.join(tmp, 'mirror.sqlite3'), seed_max=args.messages)
+        service = server.get_gmail_service()
+        mirror.sync(service)
+        stats = mirror.stats()
+        print(f"seeded {len(stats)} messages")
+        check(len(stats) == args.messages, "every mirrored message indexed")
+        check(any(r[0] for r in mirror._conn.execute("SELECT has_attachment FROM messages")),
+              "attachments recognised from metadata")
+        queries = [q for _, q in QUERIES] + [dict(group_by='sender', label='TRASH'), dict(group_by='label', label='Label_12')]
+        for query in queries:
+            query = dict(query, top=10 ** 9)
+            order_by = query.pop('order_by', 'count')
+            expected = reference(mirror._conn, **query)
+            check(as_counts(stats.query(order_by=order_by, **query)) == expected,
+                  f"{query['group_by']} counts match ({', '.join(k for k in query if k not in ('group_by', 'top'))})")
+
+        with mailbox.lock:
+            now = datetime.now(timezone.utc)
+            for n in range(20):
+                mailbox.add_message(f'new{n:013d}', 'Amazon <orders@amazon.in>', f'Your order #{n}',
+                                    now - timedelta(days=n * 40), make_html_receipt('Amazon', 1000 + n))
+            for message_id in mailbox.order[-10:]:
+                mailbox.delete_message(message_id)
+            mailbox.modify_labels(mailbox.order[30], add=['TRASH'], remove=['INBOX'])
+            mailbox.modify_labels(mailbox.order[40], add=['Label_12'])
+        mirror.sync(service)
+        check(stats.query(label='Label_12')['messages'] == 1, "user label IDs matched as Gmail spells them")
+        check(stats.query(label='trash')['messages'] == stats.query(label='TRASH')['messages'] == 1,
+              "system labels matched in any case")
+        fresh = MailStats()
+        fresh.add((r[0], r[1], r[2], r[3].split(',') if r[3] else [], r[4], r[5]) for r in mirror._conn.execute(
+            "SELECT id, internal_date, sender, label_ids, size_estimate, has_attachment FROM messages"))
+        check(len(stats) == len(fresh) == args.messages + 10, "deltas applied to the index")
+        for query in queries:
+            query = dict(query, top=10 ** 9)
+            check(stats.query(**query)['groups'] == fresh.query(**query)['groups'],
+                  f"incremental index matches a rebuild ({query['group_by']})")
+    fake.shutdown()
+
+    print(f"\n{args.rows:,} messages")
+    rows = list(synthetic_rows(args.rows))
+    stats = MailStats()
+    start = time.perf_counter()
+    stats.add(rows)
+    stats.query(top=1)
+    print(f"  index load: {time.perf_counter() - start:.2f}s")
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE messages (id TEXT PRIMARY KEY, internal_date INTEGER, sender TEXT, label_ids TEXT, "
+                 "size_estimate INTEGER, has_attachment INTEGER)")
+    conn.execute("CREATE INDEX messages_internal_date ON messages (internal_date)")
+    conn.executemany("INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?)",
+                     ((r[0], r[1], r[2], ','.join(r[3]), r[4], int(r[5])) for r in rows))
+    print(f"  {'query':<30} {'index':>9} {'sqlite':>9} {'rows':>9}")
+    for name, query in QUERIES:
+        result, index_ms = timed(lambda: stats.query(**query))
+        _, sqlite_ms = timed(lambda: sqlite_query(conn, query), repeat=3)
+        print(f"  {name:<30} {index_ms:>7.1f}ms {sqlite_ms:>7.1f}ms {result['scanned']:>9,}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Exercise the History API mailbox mirror against the local fake Gmail API:
+seed, incremental deltas (adds, deletes, label changes), expired-history
+resync, mirror page tokens, and search latency served from Gmail vs. from
+the mirror.
+
+    python benchmarks/bench_mailbox_sync.py --messages 2000 --latency-ms 20
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+import tempfile
+from datetime import datetime, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+sys.path.insert(0, HERE)
+
+from fake_gmail import FakeMailbox, start_fake_gmail, make_html_receipt
+from bench_search import install_fake_pool
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def check(condition: bool, message: str):
+    print(f"  [{'ok' if condition else 'FAIL'}] {message}")
+    if not condition:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    args = parser.parse_args()
+
+    mailbox = FakeMailbox(args.messages)
+    fake = start_fake_gmail(mailbox, latency_ms=args.latency_ms)
+    install_fake_pool(fake.url)
+    import server
+    import mailbox_sync
+
+    with tempfile.TemporaryDirectory() as tmp:
+        mirror = mailbox_sync.MailboxMirror(os.path.join(tmp, 'mirror.sqlite3'))
+        service = server.get_gmail_service()
+
+        _, elapsed = timed(lambda: mirror.sync(service))
+        print(f"seed: {mirror.status()['messages']} messages in {elapsed:.0f}ms")
+        check(mirror.status()['messages'] == args.messages, "all messages mirrored")
+
+        with mailbox.lock:
+            mailbox.add_message('new0000000000001', 'Swiggy <noreply@swiggy.in>', 'Your Swiggy order #new',
+                                datetime.now(timezone.utc), make_html_receipt('Swiggy', 99999))
+            mailbox.delete_message(mailbox.order[-1])
+            mailbox.modify_labels(mailbox.order[5], add=['TRASH'], remove=['INBOX'])
+        changes, elapsed = timed(lambda: mirror.apply_history(service))
+        print(f"delta: {changes[0]} added, {changes[1]} deleted, {changes[2]} relabeled in {elapsed:.0f}ms")
+        check(changes == (1, 1, 1), "history deltas applied")
+
+        labelled = mailbox_sync.MailboxMirror(os.path.join(tmp, 'labelled.sqlite3'), label='Label_R')
+        with mailbox.lock:
+            mailbox.modify_labels(mailbox.order[7], add=['Label_R'])
+        labelled.sync(service)
+        with mailbox.lock:
+            mailbox.modify_labels(mailbox.order[8], add=['Label_R'])
+        labelled.apply_history(service)
+        check(labelled.status()['messages'] == 2, "message labelled after delivery enters a label mirror")
+
+        mailbox_sync._mirror = mirror
+        mailbox_sync.SYNC_INTERVAL_SECONDS = 1
+        local, local_ms = timed(lambda: server.search_emails(sender='swiggy', max_results=50))
+        check('Your Swiggy order #new' in local, "new message visible in local search")
+        check(mailbox.order[5] not in local, "trashed message hidden from local search")
+        first_page = server.search_emails(sender='swiggy', max_results=5)
+        token = first_page.rsplit('Next page token: ', 1)[-1]
+        check(token.startswith(server.MIRROR_PAGE_PREFIX), "mirror search pages with a mirror token")
+        check(server.search_emails(sender='swiggy', max_results=5, page_token='mirror:x').startswith('Error: Invalid'),
+              "malformed mirror token rejected")
+        mailbox_sync._mirror = None
+        mailbox_sync.SYNC_INTERVAL_SECONDS = 0
+        check(server.search_emails(sender='swiggy', max_results=5, page_token=token).startswith('Error: Page token expired'),
+              "mirror token not sent to Gmail once the mirror is off")
+        _, remote_ms = timed(lambda: server.search_emails(sender='swiggy', max_results=50))
+        print(f"search (50 results): gmail {remote_ms:.1f}ms, mirror {local_ms:.1f}ms")
+
+        with mailbox.lock:
+            mailbox.expire_history()
+        resync = threading.Thread(target=lambda: mirror.sync(service))
+        start = time.perf_counter()
+        resync.start()
+        # GET /stats reads the status on the event loop: it must not wait for the resync
+        status_ms = []
+        while resync.is_alive():
+            status_ms.append(timed(mirror.status)[1])
+            time.sleep(0.05)
+        resync.join()
+        print(f"expired history -> full resync in {(time.perf_counter() - start) * 1000:.0f}ms, "
+              f"status() during it: max {max(status_ms):.1f}ms over {len(status_ms)} calls")
+        check(mirror.status()['full_resyncs'] == 1, "fell back to full resync")
+        check(max(status_ms) < 50, "status() answers while the mirror is being rebuilt")
+
+    fake.shutdown()
+
+
+if __name__ == '__main__':
+    main()
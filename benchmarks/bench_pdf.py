@@ -0,0 +1,65 @@
+"""
+PDF text extraction over a corpus of synthetic multi-page statements,
+comparing the old serial pdfplumber loop with the process-pool extractor
+(cold cache) and a repeat read (warm cache).
+
+    python benchmarks/bench_pdf.py --documents 5 --pages 4 20 60 --workers 4
+"""
+import io
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+sys.path.insert(0, HERE)
+
+from fake_gmail import make_statement_pdf
+
+
+def serial_extract(data: bytes) -> int:
+    import pdfplumber
+    pages = 0
+    with pdfplumber.open(io.BytesIO(data)) as pdf:
+        for page in pdf.pages:
+            page.extract_text()
+            pages += 1
+    return pages
+
+
+def timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', type=int, default=5, help='Documents per size')
+    parser.add_argument('--pages', type=int, nargs='+', default=[4, 20, 60])
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    from pdf_extract import PdfExtractor, PdfTextCache, PDF_WORKERS
+    workers = args.workers or PDF_WORKERS
+    with tempfile.TemporaryDirectory() as cache_dir:
+        extractor = PdfExtractor(workers=workers, cache=PdfTextCache(os.path.join(cache_dir, 'pdf_text.sqlite3')))
+        # Start the worker processes outside the timed region
+        extractor._get_executor().submit(int).result()
+
+        print(f"{workers} workers, {args.documents} documents per size")
+        print(f"{'pages':>6} {'serial':>12} {'pool (cold)':>12} {'cached':>12} {'speedup':>8}")
+        for page_count in args.pages:
+            corpus = [make_statement_pdf(page_count, seed=seed) for seed in range(args.documents)]
+            serial = timed(lambda: [serial_extract(doc) for doc in corpus])
+            cold = timed(lambda: [extractor.extract(doc, max_pages=page_count) for doc in corpus])
+            warm = timed(lambda: [extractor.extract(doc, max_pages=page_count) for doc in corpus])
+            print(f"{page_count:>6} {serial:>10.1f}ms {cold:>10.1f}ms {warm:>10.1f}ms {serial / cold:>7.1f}x")
+        print(extractor.cache.stats())
+        extractor.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+A burst of concurrent search_emails calls against a fake Gmail API that
+enforces a per-user quota (and optionally injects random 429s), with the
+quota-aware limiter on and with it bypassed (no pacing, no retries).
+
+    python benchmarks/bench_rate_limit.py --clients 8 --max-results 100 --quota-units 250
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+sys.path.insert(0, HERE)
+
+from fake_gmail import FakeMailbox, start_fake_gmail
+from bench_search import install_fake_pool
+
+
+def run_burst(server, clients: int, max_results: int) -> tuple:
+    """
+    Returns (wall seconds, failed searches, entries with per-message errors).
+    """
+    def search(_):
+        try:
+            output = server.search_emails(max_results=max_results)
+        except Exception:
+            return 1, 0
+        if output.startswith('Error'):
+            return 1, 0
+        return 0, output.count('\nError: ')
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as executor:
+        outcomes = list(executor.map(search, range(clients)))
+    return time.perf_counter() - start, sum(o[0] for o in outcomes), sum(o[1] for o in outcomes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=8, help='Concurrent search_emails calls')
+    parser.add_argument('--max-results', type=int, default=100)
+    parser.add_argument('--quota-units', type=float, default=250, help='Fake per-second quota')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Extra random 429s')
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    args = parser.parse_args()
+
+    fake = start_fake_gmail(FakeMailbox(args.max_results), latency_ms=args.latency_ms,
+                            quota_units=args.quota_units, error_rate=args.error_rate)
+    install_fake_pool(fake.url)
+    import gmail_client
+    import rate_limit
+    import server
+
+    print(f"{args.clients} clients x search_emails(max_results={args.max_results}), "
+          f"fake quota {args.quota_units:.0f} units/s, error rate {args.error_rate:.0%}")
+    print(f"{'limiter':>8} {'wall':>8} {'failed':>7} {'msg errors':>11} {'429s seen':>10} {'retries':>8}")
+    modes = [
+        ('off', rate_limit.GmailRateLimiter(units_per_second=1e9, burst=1e9, max_concurrency=1000, max_retries=0)),
+        ('on', rate_limit.GmailRateLimiter()),
+    ]
+    original_retries = gmail_client.MAX_RETRIES
+    for name, limiter in modes:
+        rate_limit._limiters[None] = limiter
+        gmail_client.MAX_RETRIES = limiter.max_retries
+        # New services so their HTTP wrappers pick up this limiter (keeps the fake credentials)
+        gmail_client.get_service_pool()._local = threading.local()
+        # Start each mode with a full fake quota
+        time.sleep(1.0)
+        fake.stats.update(calls=0, rejected=0)
+        wall, failed, message_errors = run_burst(server, args.clients, args.max_results)
+        print(f"{name:>8} {wall:>7.2f}s {failed:>7} {message_errors:>11} {fake.stats['rejected']:>10} "
+              f"{limiter.stats()['retries']:>8}")
+    gmail_client.MAX_RETRIES = original_retries
+    print(rate_limit.get_rate_limiter().stats())
+    fake.shutdown()
+
+
+if __name__ == '__main__':
+    main()
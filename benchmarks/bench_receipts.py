@@ -0,0 +1,210 @@
+"""
+A year-end extract_receipts run against the local fake Gmail API: receipts
+with the total in the mail body, plus invoice mails whose total is only in
+a PDF attachment. Compares reading them one get_email_content call at a
+time (how a client would do it without the bulk tool) with the pipeline at
+one worker and at RECEIPT_WORKERS, then a warm re-run from the caches.
+
+Exits non-zero if the pipeline's totals do not match the mailbox, if
+find_total() or parse_receipt() misreads one of EXTRACTION_CASES or
+ORDER_ID_CASES, or if ReceiptTotals counts a guessed amount or the wrong
+mail of a repeated order.
+
+    python benchmarks/bench_receipts.py --receipts 1000 --invoices 50 --latency-ms 30
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+sys.path.insert(0, HERE)
+
+from fake_gmail import FakeMailbox, start_fake_gmail, make_pdf
+from bench_search import install_fake_pool
+
+# Every make_html_receipt() mail totals Rs. 1512.00
+RECEIPT_TOTAL = sum(i * 42 for i in range(1, 9))
+
+
+# find_total() on lines that trip up label matching: (text, total it must find by its label)
+EXTRACTION_CASES = [
+    ("Total (multiple items): ₹500", 500.0),
+    ("Subtotal ₹400\nDelivery ₹50\nGrand Total ₹450", 450.0),
+    ("Tip ₹20\nTotal ₹520", 520.0),
+    ("Rider tip: ₹30\nOrder total ₹330", 330.0),
+    ("Amount debited Rs. 1,200.00\nAvl balance Rs. 45,000.00", 1200.0),
+    ("Available limit ₹50,000\nTotal due ₹900", 900.0),
+    ("Total delimited by outstanding ₹75", 75.0),
+]
+
+
+# parse_receipt() order IDs: (subject, expected order ID)
+ORDER_ID_CASES = [
+    ("Your Swiggy order #41 is on its way", "41"),
+    ("Order ID: OD12345 confirmed", "OD12345"),
+    ("Invoice INV-0042", "INV-0042"),
+    ("Your order has been confirmed", None),
+]
+
+
+def check_extraction(receipts) -> list:
+    failures = []
+    for subject, expected in ORDER_ID_CASES:
+        order_id = receipts.parse_receipt('', 'Shop <orders@shop.example.com>', subject, 0)['order_id']
+        if order_id != expected:
+            failures.append(f"order ID in {subject!r} = {order_id!r} (expected {expected!r})")
+    for text, expected in EXTRACTION_CASES:
+        value, _, confidence = receipts.find_total(text)
+        if (value, confidence) != (expected, 'total'):
+            failures.append(f"find_total({text!r}) = {value} by {confidence} (expected {expected} by total)")
+    return failures
+
+
+def check_totals(receipts) -> list:
+    """
+    Guessed amounts stay out of the totals, and of two mails about one
+    order the one whose amount is labelled as the total is counted.
+    """
+    def row(message_id, amount, confidence, order_id=None):
+        return {'message_id': message_id, 'merchant': 'Shop', 'month': '2024-01', 'amount': amount,
+                'currency': 'INR' if amount is not None else None, 'confidence': confidence, 'order_id': order_id}
+
+    totals = receipts.ReceiptTotals()
+    rows = [row('newsletter', 250000.0, 'guess'), row('confirmed', None, None, '41'),
+            row('shipped', 90.0, 'guess', '41'), row('delivered', 120.0, 'total', '41'),
+            row('reminder', 5.0, 'guess', '41'), row('other', 80.0, 'total', '42')]
+    for r in rows:
+        totals.add(r)
+    failures = []
+    if totals.total != {'INR': {'amount': 200.0, 'count': 2}}:
+        failures.append(f"ReceiptTotals total {totals.total} (expected INR 200.00 from 2 receipts)")
+    if totals.guessed != {'INR': {'amount': 250000.0, 'count': 1}}:
+        failures.append(f"ReceiptTotals guessed {totals.guessed} (expected the newsletter only)")
+    if [r['message_id'] for r in rows if r['duplicate']] != ['confirmed', 'shipped', 'reminder']:
+        failures.append("ReceiptTotals kept the wrong mail of order 41")
+    if (totals.receipts, totals.duplicates, totals.without_amount) != (3, 3, 0):
+        failures.append(f"ReceiptTotals counts {totals.as_dict()}")
+    return failures
+
+
+def add_invoices(mailbox: FakeMailbox, count: int) -> float:
+    """
+    Add invoice mails with the amount only in a PDF; returns their total.
+    """
+    start = datetime(2024, 3, 1, tzinfo=timezone.utc)
+    total = 0.0
+    for n in range(count):
+        amount = 1000 + n * 10
+        total += amount
+        message_id = f"inv{n:013d}"
+        pdf = make_pdf([f"Tax Invoice INV-{n:05d}\nBroadband plan 1 month\nSubtotal Rs. {amount - 100}.00\n"
+                        f"GST Rs. 100.00\nGrand Total Rs. {amount}.00"])
+        mailbox.add_message(message_id, 'Airtel Billing <billing@airtel.in>', f"Your invoice INV-{n:05d}",
+                            start + timedelta(days=n), '<p>Your invoice is attached.</p>',
+                            attachments=[(f"invoice-{n}.pdf", 'application/pdf', pdf)])
+    return total
+
+
+def one_by_one(server, receipts, max_results: int) -> dict:
+    """
+    search_emails, then get_email_content per message, parsing each body.
+    """
+    totals = receipts.ReceiptTotals()
+    listing = server.search_emails(max_results=max_results)
+    for line in listing.splitlines():
+        if line.startswith('ID: '):
+            message_id = line[4:]
+            content = server.get_email_content(message_id)
+            sender = next(l[6:] for l in content.splitlines() if l.startswith('From: '))
+            body = content.split('--- Body ---', 1)[1]
+            totals.add(receipts.parse_receipt(body, sender, '', 0))
+    return totals.total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--receipts', type=int, default=1000)
+    parser.add_argument('--invoices', type=int, default=50, help='Mails with the total only in a PDF attachment')
+    parser.add_argument('--latency-ms', type=float, default=30.0, help='Fake Gmail latency per HTTP request')
+    parser.add_argument('--skip-one-by-one', action='store_true', help='Skip the slow per-message baseline')
+    args = parser.parse_args()
+
+    mailbox = FakeMailbox(args.receipts)
+    invoice_total = add_invoices(mailbox, args.invoices)
+    expected = round(args.receipts * RECEIPT_TOTAL + invoice_total, 2)
+    total_messages = args.receipts + args.invoices
+    fake = start_fake_gmail(mailbox, latency_ms=args.latency_ms)
+
+    cache_dir = tempfile.mkdtemp(prefix='receipts-bench-')
+    os.environ['GMAIL_CACHE_DIR'] = cache_dir
+    os.environ['GMAIL_CACHE'] = '1'
+    install_fake_pool(fake.url)
+    import server
+    import receipts
+    import html_text
+    import message_cache
+    import attachment_store
+    import pdf_extract
+
+    def clear_caches():
+        # Fresh cache directory and singletons, so the next run starts cold
+        pdf_extract.shutdown_pdf_extractor()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        os.makedirs(cache_dir)
+        message_cache._caches.clear()
+        attachment_store._stores.clear()
+        pdf_extract._extractor = None
+        html_text._memo = html_text.MemoryLRU(html_text.HTML_TEXT_MEMO_BYTES)
+
+    def pipeline(workers: int) -> tuple:
+        server.RECEIPT_WORKERS = workers
+        totals = receipts.ReceiptTotals()
+        for batch in server.iter_receipt_rows(max_results=total_messages):
+            for row in batch:
+                totals.add(row)
+        return totals
+
+    print(f"{args.receipts} receipts + {args.invoices} PDF invoices, {args.latency_ms:.0f} ms per Gmail request")
+    print(f"{'run':<34} {'time':>9} {'msg/s':>8} {'receipts':>9} {'INR total':>14}")
+    failures = check_extraction(receipts) + check_totals(receipts)
+    try:
+        server.get_gmail_service()
+        if not args.skip_one_by_one:
+            clear_caches()
+            start = time.perf_counter()
+            total = one_by_one(server, receipts, total_messages)
+            seconds = time.perf_counter() - start
+            inr = total.get('INR', {'amount': 0.0, 'count': 0})
+            print(f"{'one by one (body only)':<34} {seconds:>8.1f}s {total_messages / seconds:>8.0f} "
+                  f"{inr['count']:>9} {inr['amount']:>14,.2f}")
+        for name, workers, cold in (('pipeline, 1 worker', 1, True),
+                                    (f"pipeline, {receipts.RECEIPT_WORKERS} workers", receipts.RECEIPT_WORKERS, True),
+                                    ('pipeline, warm re-run', receipts.RECEIPT_WORKERS, False)):
+            if cold:
+                clear_caches()
+            start = time.perf_counter()
+            totals = pipeline(workers)
+            seconds = time.perf_counter() - start
+            inr = totals.total.get('INR', {'amount': 0.0, 'count': 0})
+            print(f"{name:<34} {seconds:>8.1f}s {totals.messages / seconds:>8.0f} "
+                  f"{totals.receipts:>9} {inr['amount']:>14,.2f}")
+            if inr['amount'] != expected or totals.errors:
+                failures.append(f"{name}: INR total {inr['amount']:,.2f} (expected {expected:,.2f}), "
+                                f"{totals.errors} errors")
+    finally:
+        pdf_extract.shutdown_pdf_extractor()
+        fake.shutdown()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+get_email_content for N messages over /mcp: one JSON-RPC request per
+message vs. a single JSON-RPC batch (coalesced into one Gmail batch call),
+against the local fake Gmail API. Then one batch holding more attachment
+and bulk tool calls than their pools can queue is sent; it exits non-zero
+if any of them is turned away as busy.
+
+    python benchmarks/bench_rpc_batch.py --latency-ms 20 --sizes 1 10 50
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+from datetime import datetime, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+sys.path.insert(0, HERE)
+
+from fake_gmail import FakeMailbox, start_fake_gmail, make_pdf, make_html_receipt
+from bench_search import install_fake_pool
+
+
+def tool_call(request_id, email_id: str) -> dict:
+    return {"jsonrpc": "2.0", "id": request_id, "method": "tools/call",
+            "params": {"name": "get_email_content", "arguments": {"email_id": email_id}}}
+
+
+def pool_call(request_id, name: str, arguments: dict) -> dict:
+    return {"jsonrpc": "2.0", "id": request_id, "method": "tools/call",
+            "params": {"name": name, "arguments": arguments}}
+
+
+def check_pool_fan_out(client, mailbox: FakeMailbox) -> list:
+    """
+    Send one batch with more get_email_attachment and bulk calls than the
+    attachments and bulk pools accept at once; returns the failed entries.
+    """
+    from tool_runner import ATTACHMENT_WORKERS, ATTACHMENT_QUEUE_DEPTH, BULK_WORKERS, BULK_QUEUE_DEPTH
+    calls = []
+    with mailbox.lock:
+        for n in range(ATTACHMENT_WORKERS + ATTACHMENT_QUEUE_DEPTH + 2):
+            message_id = f"pdf{n:013d}"
+            mailbox.add_message(message_id, 'Bank <statements@bank.example.com>', f'Statement {n}',
+                                datetime(2024, 6, 1, tzinfo=timezone.utc), make_html_receipt('Bank', n),
+                                attachments=[(f'statement-{n}.pdf', 'application/pdf',
+                                              make_pdf([f'Statement {n}', f'Total Rs. {n}00.00']))])
+            calls.append(('get_email_attachment', {'email_id': message_id, 'attachment_id': f'att-{message_id}-1'}))
+    for n in range(BULK_WORKERS + BULK_QUEUE_DEPTH + 1):
+        calls.append(('extract_receipts', {'max_results': 5}))
+        calls.append(('export_emails', {'filename': f'batch-{n}.jsonl', 'max_results': 5}))
+    response = client.post('/mcp', json=[pool_call(n, name, arguments) for n, (name, arguments) in enumerate(calls)])
+    response.raise_for_status()
+    return [f"{calls[entry['id']][0]}: {entry['error']['message']}" for entry in response.json() if 'error' in entry]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency-ms', type=float, default=20.0, help='Simulated round-trip latency per HTTP request')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 50])
+    args = parser.parse_args()
+
+    mailbox = FakeMailbox(2 * sum(args.sizes) + 1)
+    fake = start_fake_gmail(mailbox, latency_ms=args.latency_ms)
+    # Coalescing goes through the message cache; keep it out of the repo
+    os.environ['GMAIL_CACHE'] = '1'
+    os.environ['GMAIL_CACHE_DIR'] = tempfile.mkdtemp(prefix='bench-rpc-')
+    os.environ['GMAIL_EXPORT_DIR'] = tempfile.mkdtemp(prefix='bench-rpc-export-')
+    install_fake_pool(fake.url)
+    import server
+    from fastapi.testclient import TestClient
+
+    ids = iter(mailbox.order)
+    print(f"fake latency {args.latency_ms}ms per request")
+    print(f"{'messages':>9} {'one by one':>12} {'batch':>12} {'speedup':>8}")
+    with TestClient(server.app) as client:
+        # Build the Gmail service before timing anything
+        client.post('/mcp', json=tool_call(0, next(ids))).raise_for_status()
+        for size in args.sizes:
+            # Fresh message IDs for each run so neither side gets cache hits
+            single_ids = [next(ids) for _ in range(size)]
+            batch_ids = [next(ids) for _ in range(size)]
+
+            start = time.perf_counter()
+            for n, email_id in enumerate(single_ids):
+                client.post('/mcp', json=tool_call(n, email_id)).raise_for_status()
+            single = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            client.post('/mcp', json=[tool_call(n, email_id) for n, email_id in enumerate(batch_ids)]).raise_for_status()
+            batched = (time.perf_counter() - start) * 1000
+            print(f"{size:>9} {single:>10.1f}ms {batched:>10.1f}ms {single / batched:>7.1f}x")
+
+        failures = check_pool_fan_out(client, mailbox)
+        print(f"batch of attachment and bulk calls: {'ok' if not failures else 'FAIL'}")
+        for failure in failures:
+            print(f"  {failure}")
+
+    fake.shutdown()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
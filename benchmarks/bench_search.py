@@ -0,0 +1,77 @@
+"""
+Latency of search_emails against the local fake Gmail API, comparing the old
+one-get-per-message loop with the batched metadata fetch.
+
+    python benchmarks/bench_search.py --latency-ms 20 --sizes 10 100 500
+"""
+import os
+import sys
+import time
+import argparse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+sys.path.insert(0, HERE)
+
+from fake_gmail import FakeMailbox, start_fake_gmail
+
+
+def install_fake_pool(url: str):
+    """
+    Point gmail_client at the fake API with dummy credentials, with the
+    local caches off so every call reaches the API.
+    Must run before server is imported.
+    """
+    os.environ['GMAIL_API_ENDPOINT'] = url
+    os.environ.setdefault('GMAIL_CACHE', '0')
+    os.environ.setdefault('GMAIL_TEXT_INDEX', '0')
+    import gmail_client
+    from google.oauth2.credentials import Credentials
+    gmail_client.API_ENDPOINT = url
+    gmail_client._pools[None] = gmail_client.GmailServicePool(
+        credentials=Credentials(token='fake-access-token'), api_endpoint=url)
+
+
+def sequential_search(service, max_results: int) -> int:
+    results = service.users().messages().list(userId='me', q='', maxResults=max_results).execute()
+    count = 0
+    for message in results.get('messages', []):
+        service.users().messages().get(userId='me', id=message['id'], format='metadata',
+                                       metadataHeaders=['From', 'Subject', 'Date']).execute()
+        count += 1
+    return count
+
+
+def timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency-ms', type=float, default=20.0, help='Simulated round-trip latency per HTTP request')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 500])
+    parser.add_argument('--chunk-size', type=int, default=None)
+    args = parser.parse_args()
+
+    fake = start_fake_gmail(FakeMailbox(max(args.sizes)), latency_ms=args.latency_ms)
+    install_fake_pool(fake.url)
+    import gmail_client
+    import server
+    if args.chunk_size:
+        gmail_client.BATCH_CHUNK_SIZE = args.chunk_size
+
+    service = server.get_gmail_service()
+    print(f"fake latency {args.latency_ms}ms per request, batch chunk size {gmail_client.BATCH_CHUNK_SIZE}")
+    print(f"{'results':>8} {'sequential':>12} {'batched':>12} {'speedup':>8}")
+    for size in args.sizes:
+        sequential = timed(lambda: sequential_search(service, size))
+        batched = timed(lambda: server.search_emails(max_results=size))
+        print(f"{size:>8} {sequential:>10.1f}ms {batched:>10.1f}ms {sequential / batched:>7.1f}x")
+
+    fake.shutdown()
+
+
+if __name__ == '__main__':
+    main()
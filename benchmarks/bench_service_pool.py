@@ -0,0 +1,77 @@
+"""
+Compare per-call overhead of building a Gmail service from scratch (the old
+get_gmail_service() behaviour) against the pooled service from gmail_client.
+
+Uses a throwaway token file with a far-future expiry, so no network access or
+real account is needed:
+
+    python benchmarks/bench_service_pool.py --iterations 200
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+from gmail_client import GmailServicePool, SCOPES
+
+
+def write_fake_token(path: str):
+    expiry = (datetime.utcnow() + timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:%SZ')
+    with open(path, 'w') as f:
+        json.dump({
+            'token': 'fake-access-token',
+            'refresh_token': 'fake-refresh-token',
+            'token_uri': 'https://oauth2.googleapis.com/token',
+            'client_id': 'fake-client-id',
+            'client_secret': 'fake-client-secret',
+            'scopes': SCOPES,
+            'expiry': expiry,
+        }, f)
+
+
+def cold_call(token_file: str):
+    creds = Credentials.from_authorized_user_file(token_file, SCOPES)
+    return build('gmail', 'v1', credentials=creds, static_discovery=True)
+
+
+def measure(fn, iterations: int) -> list:
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(name: str, samples: list):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{name:<6} mean={statistics.mean(samples):8.3f}ms  p50={statistics.median(samples):8.3f}ms  p95={p95:8.3f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        token_file = os.path.join(tmp, 'token.json')
+        write_fake_token(token_file)
+
+        pool = GmailServicePool(token_file=token_file)
+        pool.get_service()  # first call pays the one-off build
+
+        report('cold', measure(lambda: cold_call(token_file), args.iterations))
+        report('warm', measure(pool.get_service, args.iterations))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Cold-start cost of the server: import time per heavy module, and
+wall-clock time from process start to the first successful /healthz,
+with deferred imports (LAZY_IMPORTS=1, default) and eager ones (LAZY_IMPORTS=0).
+
+    python benchmarks/bench_startup.py --runs 5
+
+Each deferred module's time is measured after the ones listed above it,
+so shared dependencies are counted once.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import statistics
+import subprocess
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.abspath(os.path.join(HERE, '..', 'src'))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+IMPORT_PROBE = """
+import json, time
+start = time.perf_counter()
+import server
+server_ms = (time.perf_counter() - start) * 1000
+from startup import preload_modules
+deferred = {name: seconds * 1000 for name, seconds in preload_modules().items()}
+print(json.dumps({'server': server_ms, 'deferred': deferred}))
+"""
+
+
+def import_times(lazy: bool) -> dict:
+    """
+    Time to import `server`, then the extra cost of each heavy module not
+    yet loaded (what the first tool call or the warm-up thread pays).
+    """
+    env = dict(os.environ, LAZY_IMPORTS='1' if lazy else '0')
+    result = subprocess.run([sys.executable, '-c', IMPORT_PROBE], cwd=SRC, env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def time_to_healthz(lazy: bool, timeout: float = 60.0) -> float:
+    port = free_port()
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ, PORT=str(port), LAZY_IMPORTS='1' if lazy else '0',
+                   GMAIL_CACHE_DIR=os.path.join(workdir, '.cache'))
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, os.path.join(SRC, 'server.py')], cwd=workdir, env=env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            while time.perf_counter() - start < timeout:
+                try:
+                    with urllib.request.urlopen(f"http://127.0.0.1:{port}/healthz", timeout=1) as response:
+                        if response.status == 200:
+                            return (time.perf_counter() - start) * 1000
+                except OSError:
+                    time.sleep(0.01)
+            raise TimeoutError("server did not answer /healthz")
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    eager, lazy = import_times(False), import_times(True)
+    print(f"import server: eager {eager['server']:.0f}ms, lazy {lazy['server']:.0f}ms")
+    print("deferred until first use (lazy mode):")
+    for name, ms in lazy['deferred'].items():
+        print(f"  {name:<32} {ms:>7.0f}ms")
+
+    print()
+    for lazy in (False, True):
+        samples = [time_to_healthz(lazy) for _ in range(args.runs)]
+        print(f"time to first /healthz, {'lazy ' if lazy else 'eager'}: "
+              f"median {statistics.median(samples):.0f}ms  min {min(samples):.0f}ms  max {max(samples):.0f}ms")
+
+
+if __name__ == '__main__':
+    main()
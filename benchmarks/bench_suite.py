@@ -0,0 +1,424 @@
+"""
+The main tools and the /mcp handler against the fake Gmail API, at several
+concurrencies, with results that can be compared across commits.
+
+The fake (fake_gmail.py) runs in its own process and serves a fixture
+mailbox: the reproducible make_fixture_mailbox() mix by default, or a
+file recorded with record_fixtures.py (--fixtures). Each scenario runs
+twice: calling the tool functions directly, and as JSON-RPC over HTTP to
+`python src/server.py` started in another process. For every scenario,
+mode and concurrency it reports p50/p95/p99 latency, throughput, errors
+and the peak RSS of the process running the tools (Linux only), and
+writes everything, with the git commit, to
+benchmarks/results/<commit>-<time>.json.
+
+    python benchmarks/bench_suite.py --concurrency 1 8 --requests 200
+    python benchmarks/bench_suite.py --compare benchmarks/results/1a2b3c4-20261017-101500.json
+
+--compare prints the change against an earlier run and exits non-zero if
+any p95 got worse by more than --max-regression. Local caches are off
+unless --cache is given, so every call reaches the fake, and Gmail's
+quota is raised so runs measure the server rather than the rate limiter.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import http.client
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(HERE, '..', 'src')
+sys.path.insert(0, SRC)
+sys.path.insert(0, HERE)
+
+from fake_gmail import FakeMailbox, make_fixture_mailbox, _walk_parts
+
+RESULTS_DIR = os.path.join(HERE, 'results')
+MODES = ('direct', 'http')
+# Messages whose HTML body is larger than this count as HTML-heavy
+HTML_HEAVY_BYTES = 20 * 1024
+BATCH_SIZE = 10
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(host: str, port: int, path: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection(host, port, timeout=5)
+            conn.request('GET', path)
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.1)
+    raise TimeoutError(f"Nothing answered http://{host}:{port}{path}")
+
+
+def write_fake_token(path: str):
+    from gmail_client import SCOPES
+    with open(path, 'w') as f:
+        json.dump({'token': 'fake-access-token', 'refresh_token': 'fake-refresh-token',
+                   'client_id': 'fake-client-id', 'client_secret': 'fake-client-secret', 'scopes': SCOPES,
+                   'expiry': (datetime.utcnow() + timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:%SZ')}, f)
+
+
+def git_commit() -> dict:
+    def git(*args):
+        return subprocess.run(['git', *args], cwd=HERE, capture_output=True, text=True).stdout.strip()
+    return {'commit': git('rev-parse', 'HEAD') or None,
+            'dirty': bool(git('status', '--porcelain', '--untracked-files=no'))}
+
+
+class Corpus:
+    """
+    Inputs for each scenario, picked from the fixture mailbox.
+    """
+
+    def __init__(self, mailbox: FakeMailbox):
+        self.ids = list(mailbox.order)
+        self.html_heavy = []
+        self.pdfs = []
+        self.senders = []
+        for message_id in self.ids:
+            msg = mailbox.messages[message_id]
+            parts = list(_walk_parts(msg['payload']))
+            if any(p.get('mimeType') == 'text/html' and p.get('body', {}).get('size', 0) > HTML_HEAVY_BYTES
+                   for p in parts):
+                self.html_heavy.append(message_id)
+            self.pdfs += [(message_id, p['body']['attachmentId']) for p in parts
+                          if p.get('filename', '').lower().endswith('.pdf') and p['body'].get('attachmentId') in
+                          mailbox.attachments]
+            sender = next((h['value'] for h in msg['payload'].get('headers', []) if h['name'].lower() == 'from'), '')
+            name = sender.rsplit('<', 1)[-1].rstrip('>').split('@')[-1].split('.')[0]
+            if name and name not in self.senders:
+                self.senders.append(name)
+
+    def scenarios(self) -> dict:
+        """
+        scenario name -> list of tool call lists ((tool, arguments) pairs;
+        more than one pair is sent as one JSON-RPC batch, over HTTP only).
+        """
+        scenarios = {
+            'search_emails': [[('search_emails', {'sender': s, 'max_results': 20})] for s in self.senders]
+                             or [[('search_emails', {'max_results': 20})]],
+            'get_email_content': [[('get_email_content', {'email_id': i})] for i in self.ids],
+            'get_email_content_html': [[('get_email_content', {'email_id': i})] for i in self.html_heavy],
+            'get_email_attachment_pdf': [[('get_email_attachment', {'email_id': i, 'attachment_id': a})]
+                                         for i, a in self.pdfs],
+            'mcp_batch': [[('get_email_content', {'email_id': i}) for i in self.ids[n:n + BATCH_SIZE]]
+                          for n in range(0, len(self.ids) - BATCH_SIZE + 1, BATCH_SIZE)],
+        }
+        return {name: calls for name, calls in scenarios.items() if calls}
+
+
+class PeakRss:
+    """
+    Samples a process's resident set size in the background (Linux /proc).
+    """
+
+    def __init__(self, pid: int, interval: float = 0.005):
+        self.path = f"/proc/{pid}/statm"
+        self.interval = interval
+        self.start_bytes = self.peak_bytes = self._read()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, AttributeError):
+            return None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            rss = self._read()
+            if rss is not None and rss > self.peak_bytes:
+                self.peak_bytes = rss
+
+    def __enter__(self):
+        if self.start_bytes is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+
+def percentile(ordered: list, p: float) -> float:
+    """
+    Nearest-rank percentile of an ascending list.
+    """
+    rank = -(-len(ordered) * p // 100)
+    return ordered[max(0, min(len(ordered) - 1, int(rank) - 1))]
+
+
+def run_load(call, inputs: list, concurrency: int, requests: int, pid: int) -> dict:
+    """
+    Make `requests` calls from `concurrency` threads, cycling through
+    `inputs`; call(item) returns None on success, else an error message.
+    """
+    latencies = []
+    errors = 0
+    first_error = None
+    lock = threading.Lock()
+    next_index = iter(range(requests))
+
+    def worker():
+        nonlocal errors, first_error
+        for i in next_index:
+            start = time.perf_counter()
+            try:
+                error = call(inputs[i % len(inputs)])
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if error:
+                    errors += 1
+                    first_error = first_error or error
+
+    with PeakRss(pid) as rss:
+        start = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - start
+    latencies.sort()
+    mb = 1024 * 1024
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(wall, 3),
+        'throughput_rps': round(len(latencies) / wall, 2),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'peak_rss_mb': round(rss.peak_bytes / mb, 1) if rss.peak_bytes is not None else None,
+        'rss_growth_mb': round((rss.peak_bytes - rss.start_bytes) / mb, 1) if rss.peak_bytes is not None else None,
+        'first_error': first_error,
+    }
+
+
+def direct_caller():
+    """
+    Calls the tool functions in this process.
+    """
+    import server
+
+    def call(calls: list) -> str:
+        (tool, arguments), = calls
+        text = server.TOOL_FUNCTIONS[tool](**arguments)
+        return text[:200] if text.startswith('Error') else None
+    return call, os.getpid(), server
+
+
+def http_caller(port: int):
+    """
+    Sends tools/call requests to the server process, one keep-alive
+    connection per client thread.
+    """
+    local = threading.local()
+
+    def call(calls: list) -> str:
+        messages = [{"jsonrpc": "2.0", "id": n, "method": "tools/call", "params": {"name": tool, "arguments": arguments}}
+                    for n, (tool, arguments) in enumerate(calls)]
+        body = json.dumps(messages if len(messages) > 1 else messages[0])
+        conn = getattr(local, 'conn', None) or http.client.HTTPConnection('127.0.0.1', port, timeout=600)
+        local.conn = conn
+        try:
+            conn.request('POST', '/mcp', body, {'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            payload = response.read()
+        except (OSError, http.client.HTTPException):
+            local.conn = None
+            conn.close()
+            raise
+        if response.status != 200:
+            return f"HTTP {response.status}"
+        replies = json.loads(payload)
+        for reply in replies if isinstance(replies, list) else [replies]:
+            if 'error' in reply:
+                return reply['error']['message']
+            text = reply['result']['content'][0]['text']
+            if text.startswith('Error'):
+                return text[:200]
+        return None
+    return call
+
+
+def compare(results: dict, baseline_path: str, max_regression: float) -> list:
+    """
+    Print p95 and throughput against an earlier run; returns the regressions.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    if baseline['config'] != results['config']:
+        print(f"note: {baseline_path} was run with different settings")
+    before = {(r['scenario'], r['mode'], r['concurrency']): r for r in baseline['results']}
+    print(f"\nvs. {(baseline['commit'] or '?')[:10]}{' (dirty)' if baseline['dirty'] else ''}")
+    print(f"{'scenario':<26} {'mode':<7} {'conc':>4} {'p95 before':>11} {'p95 now':>9} {'change':>8} {'rps change':>11}")
+    regressions = []
+    for row in results['results']:
+        key = (row['scenario'], row['mode'], row['concurrency'])
+        old = before.get(key)
+        if old is None:
+            continue
+        change = row['p95_ms'] / old['p95_ms'] - 1 if old['p95_ms'] else 0.0
+        rps_change = row['throughput_rps'] / old['throughput_rps'] - 1 if old['throughput_rps'] else 0.0
+        flag = ' REGRESSION' if change > max_regression else ''
+        print(f"{key[0]:<26} {key[1]:<7} {key[2]:>4} {old['p95_ms']:>9.1f}ms {row['p95_ms']:>7.1f}ms "
+              f"{change:>+8.0%} {rps_change:>+11.0%}{flag}")
+        if flag:
+            regressions.append(f"{key[0]} {key[1]} x{key[2]}: p95 {old['p95_ms']:.1f}ms -> {row['p95_ms']:.1f}ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fixtures', help='Fixture file to serve (default: the synthetic mix)')
+    parser.add_argument('--messages', type=int, default=300, help='Size of the synthetic mix')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scenarios', nargs='+', help='Run only these scenarios')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--requests', type=int, default=100, help='Calls per scenario, mode and concurrency')
+    parser.add_argument('--latency-ms', type=float, default=20.0, help='Fake Gmail latency per HTTP request')
+    parser.add_argument('--latency-jitter-ms', type=float, default=10.0, help='Extra random fake latency, up to this')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of Gmail calls failed on purpose')
+    parser.add_argument('--error-status', type=int, default=503, choices=(429, 500, 503))
+    parser.add_argument('--cache', action='store_true', help='Keep the local caches on')
+    parser.add_argument('--output', help='Results file (default: benchmarks/results/<commit>-<time>.json)')
+    parser.add_argument('--compare', help='Earlier results file to compare with')
+    parser.add_argument('--max-regression', type=float, default=0.25,
+                        help='Allowed p95 increase against --compare, as a fraction')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='bench-suite-')
+    fixtures = args.fixtures
+    if fixtures:
+        mailbox = FakeMailbox.load_fixtures(fixtures)
+    else:
+        mailbox = make_fixture_mailbox(args.messages, args.seed)
+        fixtures = os.path.join(work_dir, 'fixtures.jsonl')
+        mailbox.save_fixtures(fixtures)
+    scenarios = Corpus(mailbox).scenarios()
+    del mailbox
+    if args.scenarios:
+        scenarios = {name: calls for name, calls in scenarios.items() if name in args.scenarios}
+
+    fake_port = free_port()
+    fake = subprocess.Popen([sys.executable, os.path.join(HERE, 'fake_gmail.py'), '--port', str(fake_port),
+                             '--fixtures', fixtures, '--latency-ms', str(args.latency_ms),
+                             '--latency-jitter-ms', str(args.latency_jitter_ms), '--error-rate', str(args.error_rate),
+                             '--error-status', str(args.error_status)],
+                            stderr=subprocess.DEVNULL)
+    token_file = os.path.join(work_dir, 'token.json')
+    # Read by the server modules at import, here and in the server process
+    os.environ.update({
+        'GMAIL_API_ENDPOINT': f"http://127.0.0.1:{fake_port}/",
+        'GMAIL_TOKEN_FILE': token_file,
+        'GMAIL_CACHE_DIR': os.path.join(work_dir, 'cache'),
+        'GMAIL_QUOTA_UNITS_PER_SECOND': '100000',
+        'GMAIL_QUOTA_BURST': '100000',
+        'GMAIL_SYNC_INTERVAL': '0',
+    })
+    if not args.cache:
+        os.environ.update({'GMAIL_CACHE': '0', 'GMAIL_TEXT_INDEX': '0', 'GMAIL_ATTACHMENT_STORE': '0',
+                           'PDF_TEXT_CACHE': '0', 'HTML_TEXT_MEMO_BYTES': '0'})
+    write_fake_token(token_file)
+
+    results = {
+        **git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'config': {'fixtures': args.fixtures or f"synthetic:{args.messages}:{args.seed}",
+                   'concurrency': args.concurrency, 'requests': args.requests, 'latency_ms': args.latency_ms,
+                   'latency_jitter_ms': args.latency_jitter_ms, 'error_rate': args.error_rate,
+                   'error_status': args.error_status, 'cache': args.cache},
+        'results': [],
+    }
+    server_process = None
+    direct_server = None
+    try:
+        wait_for('127.0.0.1', fake_port, '/gmail/v1/users/me/profile')
+        print(f"{sum(len(c) for c in scenarios.values())} inputs from {results['config']['fixtures']}, "
+              f"{args.latency_ms:.0f}+{args.latency_jitter_ms:.0f} ms per Gmail request, "
+              f"caches {'on' if args.cache else 'off'}")
+        print(f"{'scenario':<26} {'mode':<7} {'conc':>4} {'p50':>8} {'p95':>8} {'p99':>8} {'req/s':>7} "
+              f"{'errors':>6} {'peak RSS':>9}")
+        for mode in args.modes:
+            if mode == 'direct':
+                call, pid, direct_server = direct_caller()
+            else:
+                port = free_port()
+                log = open(os.path.join(work_dir, 'server.log'), 'w')
+                server_process = subprocess.Popen([sys.executable, os.path.join(SRC, 'server.py')], cwd=work_dir,
+                                                  env=dict(os.environ, PORT=str(port)), stdout=log, stderr=log)
+                wait_for('127.0.0.1', port, '/healthz')
+                call, pid = http_caller(port), server_process.pid
+            for name, inputs in scenarios.items():
+                if mode == 'direct' and len(inputs[0]) > 1:
+                    continue
+                # Warm up imports, service objects and connections before measuring
+                run_load(call, inputs, max(args.concurrency), max(args.concurrency), pid)
+                for concurrency in args.concurrency:
+                    row = {'scenario': name, 'mode': mode, 'concurrency': concurrency,
+                           **run_load(call, inputs, concurrency, args.requests, pid)}
+                    results['results'].append(row)
+                    rss = f"{row['peak_rss_mb']:.0f}MB" if row['peak_rss_mb'] is not None else '-'
+                    print(f"{name:<26} {mode:<7} {concurrency:>4} {row['p50_ms']:>6.1f}ms {row['p95_ms']:>6.1f}ms "
+                          f"{row['p99_ms']:>6.1f}ms {row['throughput_rps']:>7.1f} {row['errors']:>6} {rss:>9}")
+                    if row['first_error']:
+                        print(f"    first error: {row['first_error']}")
+            if server_process:
+                server_process.terminate()
+                server_process.wait()
+                server_process = None
+    finally:
+        if server_process:
+            server_process.kill()
+        if direct_server:
+            direct_server.shutdown_pdf_extractor()
+        fake.kill()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        label = (results['commit'] or 'unknown')[:10] + ('-dirty' if results['dirty'] else '')
+        output = os.path.join(RESULTS_DIR, f"{label}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {output}")
+
+    regressions = compare(results, args.compare, args.max_regression) if args.compare else []
+    for regression in regressions:
+        print(f"FAIL {regression}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""
+Several server processes finding the same account's access token expired
+at once, against a local fake OAuth token endpoint.
+
+Each process refreshes the way the server used to (reading the token
+file and calling refresh() on its own) and then through
+GmailServicePool, which refreshes under a lock file shared by the
+processes. With the lock, exactly one refresh must reach the endpoint and
+every process must end up with the same access token.
+
+Exits non-zero if that does not hold.
+
+    python benchmarks/bench_token_refresh.py --processes 8 --latency-ms 300
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+
+ACCOUNT = 'bench'
+
+
+def start_token_endpoint(latency_ms: float) -> ThreadingHTTPServer:
+    """
+    A fake https://oauth2.googleapis.com/token that counts refreshes and
+    hands out a new access token for each.
+    """
+    class TokenHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            time.sleep(latency_ms / 1000)
+            with server.lock:
+                server.refreshes += 1
+                token = f"access-token-{server.refreshes}"
+            body = json.dumps({'access_token': token, 'expires_in': 3600, 'token_type': 'Bearer'}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), TokenHandler)
+    server.refreshes = 0
+    server.lock = threading.Lock()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/token"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def write_expired_token(path: str, token_uri: str):
+    from gmail_client import SCOPES
+    expiry = (datetime.utcnow() - timedelta(minutes=1)).strftime('%Y-%m-%dT%H:%M:%SZ')
+    with open(path, 'w') as f:
+        json.dump({
+            'token': 'expired-access-token',
+            'refresh_token': 'fake-refresh-token',
+            'token_uri': token_uri,
+            'client_id': 'fake-client-id',
+            'client_secret': 'fake-client-secret',
+            'scopes': SCOPES,
+            'expiry': expiry,
+        }, f)
+
+
+def worker(mode: str, token_uri: str, barrier, results):
+    from google.auth.transport.requests import Request
+    import google.oauth2.credentials
+    from google.oauth2.credentials import Credentials
+    import gmail_client
+    # google-auth ignores token_uri in token files and always uses Google's
+    google.oauth2.credentials._GOOGLE_OAUTH2_TOKEN_ENDPOINT = token_uri
+    barrier.wait()
+    if mode == 'unlocked':
+        creds = Credentials.from_authorized_user_file(gmail_client.token_path(ACCOUNT), gmail_client.SCOPES)
+        creds.refresh(Request())
+        with open(gmail_client.token_path(ACCOUNT), 'w') as f:
+            f.write(creds.to_json())
+    else:
+        creds = gmail_client.get_service_pool(ACCOUNT).get_credentials()
+    results.put(creds.token)
+
+
+def run(mode: str, token_uri: str, processes: int) -> list:
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(processes)
+    results = context.Queue()
+    workers = [context.Process(target=worker, args=(mode, token_uri, barrier, results)) for _ in range(processes)]
+    for process in workers:
+        process.start()
+    tokens = [results.get(timeout=60) for _ in workers]
+    for process in workers:
+        process.join()
+    return tokens
+
+
+def check_service_rebuilt(endpoint) -> list:
+    """
+    A pool that picks up a token another process refreshed must also give
+    its threads services on that token: a service left on the old object
+    would refresh it on its own, outside the lock, once it expires.
+    """
+    import gmail_client
+    from credential_store import token_path, write_token
+    pool = gmail_client.GmailServicePool(account=ACCOUNT, api_endpoint='http://127.0.0.1:1/')
+    before = pool.get_service()
+    old = pool.get_credentials()
+    old.expiry = datetime.utcnow() - timedelta(minutes=1)
+    stored = json.loads(old.to_json())
+    stored.update(token='token-from-another-process',
+                  expiry=(datetime.utcnow() + timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M:%SZ'))
+    write_token(token_path(ACCOUNT), json.dumps(stored))
+    refreshes = endpoint.refreshes
+    after = pool.get_service()
+    failures = []
+    if pool.get_credentials().token != 'token-from-another-process' or endpoint.refreshes != refreshes:
+        failures.append("pool refreshed instead of reusing the stored token")
+    if after is before:
+        failures.append("thread kept a service built on the replaced credentials")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--latency-ms', type=float, default=300.0, help='Fake token endpoint latency')
+    args = parser.parse_args()
+
+    accounts_dir = tempfile.mkdtemp(prefix='token-bench-')
+    # Inherited by the worker processes, which import credential_store afresh
+    os.environ['GMAIL_ACCOUNTS_DIR'] = accounts_dir
+    from credential_store import token_path
+    endpoint = start_token_endpoint(args.latency_ms)
+    failures = []
+    try:
+        print(f"{args.processes} processes, {args.latency_ms:.0f} ms per token refresh")
+        print(f"{'refresh':<10} {'time':>8} {'refreshes':>10} {'distinct tokens':>16}")
+        for mode in ('unlocked', 'locked'):
+            write_expired_token(token_path(ACCOUNT), endpoint.url)
+            endpoint.refreshes = 0
+            start = time.perf_counter()
+            tokens = run(mode, endpoint.url, args.processes)
+            seconds = time.perf_counter() - start
+            print(f"{mode:<10} {seconds:>7.2f}s {endpoint.refreshes:>10} {len(set(tokens)):>16}")
+        if endpoint.refreshes != 1 or len(set(tokens)) != 1:
+            failures.append(f"locked: {endpoint.refreshes} refreshes, {len(set(tokens))} distinct tokens")
+        with open(token_path(ACCOUNT)) as f:
+            if json.load(f)['token'] != tokens[0]:
+                failures.append("token file does not hold the refreshed token")
+        if os.name == 'posix' and os.stat(token_path(ACCOUNT)).st_mode & 0o077:
+            failures.append("token file is readable by other users")
+        failures += check_service_rebuilt(endpoint)
+    finally:
+        endpoint.shutdown()
+        shutil.rmtree(accounts_dir, ignore_errors=True)
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,750 @@
+"""
+A small stand-in for the Gmail REST API, for benchmarks and local experiments.
+
+Serves a synthetic mailbox over plain HTTP with optional per-request latency:
+
+    python benchmarks/fake_gmail.py --port 8099 --messages 1000 --latency-ms 20
+
+--mixed serves a corpus of varied mail instead (plain and HTML-heavy
+receipts, newsletters, multi-page PDF statements; see make_fixture_mailbox),
+and --fixtures serves messages recorded from a real mailbox with
+record_fixtures.py, or saved with FakeMailbox.save_fixtures().
+
+Partial responses (the `fields` parameter) are honoured. It can also play
+Gmail's per-user quota (--quota-units N rejects calls with
+429 rateLimitExceeded once more than N quota units per second are used),
+inject random errors (--error-rate, as 429s or --error-status 500/503) and
+vary the latency (--latency-jitter-ms adds up to that much per request).
+
+then point the server at it with GMAIL_API_ENDPOINT=http://127.0.0.1:8099/.
+Benchmarks can also start it in-process with start_fake_gmail().
+
+Supported endpoints:
+    GET  /gmail/v1/users/me/profile
+    GET  /gmail/v1/users/me/history
+    GET  /gmail/v1/users/me/messages
+    GET  /gmail/v1/users/me/messages/{id}
+    GET  /gmail/v1/users/me/messages/{id}/attachments/{attachmentId}
+    GET  /gmail/v1/users/me/threads/{id}
+    POST /batch/gmail/v1
+"""
+import re
+import sys
+import json
+import time
+import random
+import base64
+import argparse
+import threading
+from email.parser import Parser
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+SENDERS = [
+    ('Swiggy', 'noreply@swiggy.in'),
+    ('Uber Receipts', 'noreply@uber.com'),
+    ('Amazon.in', 'auto-confirm@amazon.in'),
+    ('Zomato', 'noreply@zomato.com'),
+    ('HDFC Bank', 'alerts@hdfcbank.net'),
+]
+
+
+def _b64(text: str) -> str:
+    return base64.urlsafe_b64encode(text.encode('utf-8')).decode('ascii')
+
+
+def make_html_receipt(merchant: str, order_no: int, items: int = 8) -> str:
+    rows = "".join(
+        f"<tr><td>Item {i}</td><td>{i}</td><td>Rs. {i * 42}.00</td></tr>"
+        for i in range(1, items + 1)
+    )
+    total = sum(i * 42 for i in range(1, items + 1))
+    return (
+        f"<html><head><style>td {{ padding: 4px; }}</style></head><body>"
+        f"<h1>{merchant} order #{order_no}</h1>"
+        f"<table>{rows}<tr><td>Total</td><td></td><td>Rs. {total}.00</td></tr></table>"
+        f"<script>track({order_no});</script></body></html>"
+    )
+
+
+def make_rich_html_receipt(merchant: str, order_no: int, items: int = 20) -> str:
+    """
+    A receipt shaped like real marketing-template mail: a large <style>
+    block, a hidden preheader, nested layout tables with inline styles on
+    every cell, the line-item table, and a long footer. About 2 KB per item
+    plus 20 KB of boilerplate.
+    """
+    cell = 'style="font-family:Helvetica,Arial,sans-serif;font-size:14px;line-height:20px;color:#3d4152;padding:8px 12px;border-bottom:1px solid #e9e9eb;"'
+    css = "".join(f".c{i} {{ margin:0; padding:{i % 9}px; color:#{i * 4111 % 0xffffff:06x}; }}\n" for i in range(300))
+    rows = "".join(
+        f'<tr><td {cell}><table role="presentation" width="100%"><tr><td {cell}>'
+        f'<img src="https://cdn.example.com/item/{order_no}/{i}.png" width="48" height="48" alt=""></td>'
+        f'<td {cell}><span class="c{i % 300}">{merchant} item {i} &ndash; regular</span><br>'
+        f'<span style="color:#93959f;font-size:12px">Customised: extra cheese, no onion</span></td></tr></table></td>'
+        f'<td {cell} align="center">{i % 4 + 1}</td><td {cell} align="right">&#8377;{i * 42}.00</td></tr>'
+        for i in range(1, items + 1)
+    )
+    total = sum(i * 42 for i in range(1, items + 1))
+    footer = "".join(
+        f'<p style="font-size:11px;color:#93959f">Link {i}: <a href="https://example.com/u/{i}?utm_source=email">'
+        f'Manage preferences</a> &middot; Terms &middot; Privacy</p>'
+        for i in range(40)
+    )
+    return (
+        f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{merchant} receipt</title>'
+        f'<style type="text/css">{css}</style><!--[if mso]><style>td {{ font-family: Arial; }}</style><![endif]--></head>'
+        f'<body style="margin:0;padding:0;background:#f1f1f6">'
+        f'<div style="display:none;max-height:0;overflow:hidden">Your {merchant} order #{order_no} is confirmed</div>'
+        f'<table role="presentation" width="100%" cellpadding="0" cellspacing="0"><tr><td align="center">'
+        f'<table role="presentation" width="600" style="background:#ffffff"><tr><td {cell}>'
+        f'<h1 style="font-size:22px">{merchant} order #{order_no}</h1><p>Thanks for your order!</p></td></tr>'
+        f'<tr><td><table width="100%" cellpadding="0" cellspacing="0">'
+        f'<tr><th {cell}>Item</th><th {cell}>Qty</th><th {cell}>Price</th></tr>{rows}'
+        f'<tr><td {cell}><b>Total</b></td><td {cell}></td><td {cell} align="right"><b>&#8377;{total}.00</b></td></tr>'
+        f'</table></td></tr><tr><td {cell}>{footer}</td></tr></table></td></tr></table>'
+        f'<script>track({order_no});</script></body></html>'
+    )
+
+
+def make_pdf(pages: list) -> bytes:
+    """
+    Build a minimal text PDF with one page per string in `pages`.
+    Lines are split on newlines; no external PDF library needed.
+    """
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        lines = []
+        for line in text.split('\n'):
+            escaped = line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+            lines.append(f"({escaped}) Tj T*")
+        stream = "BT /F1 10 Tf 12 TL 50 780 Td " + " ".join(lines) + " ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        content_ref = len(objects)
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_ref} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode('latin-1')
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode('latin-1')
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode('latin-1')
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode('latin-1')
+    return bytes(out)
+
+
+def make_statement_pdf(page_count: int, rows_per_page: int = 40, seed: int = 0) -> bytes:
+    """
+    A synthetic multi-page bank statement.
+    """
+    pages = []
+    for page in range(1, page_count + 1):
+        rows = [f"Statement page {page} of {page_count}  (account ending {seed:04d})"]
+        for row in range(rows_per_page):
+            n = page * rows_per_page + row
+            rows.append(f"2024-{(n % 12) + 1:02d}-{(n % 28) + 1:02d}  UPI/MERCHANT-{n % 97:03d}/REF{n:08d}  "
+                        f"{(n * 37) % 5000 + 0.5:10.2f}  DR")
+        pages.append("\n".join(rows))
+    return make_pdf(pages)
+
+
+def parse_fields(spec: str) -> dict:
+    """
+    Parse a partial-response mask such as "id,payload(headers,parts/body)"
+    into a tree of {name: subtree}, where None selects the whole value.
+    """
+    def parse_list(pos: int) -> tuple:
+        tree = {}
+        while pos < len(spec):
+            match = re.compile(r'[A-Za-z0-9_]+(?:/[A-Za-z0-9_]+)*').match(spec, pos)
+            if not match:
+                raise ValueError(f"Bad fields mask at {pos}: {spec!r}")
+            names = match.group(0).split('/')
+            pos = match.end()
+            sub = None
+            if pos < len(spec) and spec[pos] == '(':
+                sub, pos = parse_list(pos + 1)
+                pos += 1  # ')'
+            node = tree
+            for name in names[:-1]:
+                if node.get(name, {}) is None:
+                    break  # a parent is already selected whole
+                node = node.setdefault(name, {})
+            else:
+                last = names[-1]
+                node[last] = _merge_fields(node[last], sub) if last in node else sub
+            if pos < len(spec) and spec[pos] == ',':
+                pos += 1
+            elif pos < len(spec) and spec[pos] == ')':
+                break
+        return tree, pos
+
+    return parse_list(0)[0]
+
+
+def _merge_fields(a, b):
+    if a is None or b is None:
+        return None
+    merged = dict(a)
+    for name, sub in b.items():
+        merged[name] = _merge_fields(merged[name], sub) if name in merged else sub
+    return merged
+
+
+def apply_fields(value, tree):
+    """
+    Keep only the parts of a JSON value selected by a parse_fields() tree.
+    """
+    if tree is None:
+        return value
+    if isinstance(value, list):
+        return [apply_fields(item, tree) for item in value]
+    if isinstance(value, dict):
+        return {name: apply_fields(value[name], sub) for name, sub in tree.items() if name in value}
+    return value
+
+
+class FakeMailbox:
+    """
+    In-memory mailbox of synthetic receipt messages, newest first.
+
+    Messages are Gmail `format=full` resources; fixture files hold one per
+    line as {"message": ..., "attachments": {attachment ID: base64url data}}.
+    """
+
+    def __init__(self, count: int = 500, start: datetime = None):
+        start = start or datetime(2024, 1, 1, tzinfo=timezone.utc)
+        self.messages = {}
+        self.attachments = {}
+        self.order = []
+        # History records as (history_id, record); IDs below history_floor
+        # are treated as expired, like Gmail does after about a week.
+        self.history = []
+        self.history_id = 1000
+        self.history_floor = 0
+        self.lock = threading.Lock()
+        for n in range(count):
+            name, address = SENDERS[n % len(SENDERS)]
+            date = start + timedelta(hours=7 * n)
+            message_id = f"{n + 1:016x}"
+            self.add_message(message_id, f"{name} <{address}>", f"Your {name} order #{n}",
+                             date, make_html_receipt(name, n))
+
+    def add_message(self, message_id: str, sender: str, subject: str, date: datetime, html: str,
+                    to: str = 'me@example.com', label_ids: list = None, thread_id: str = None,
+                    attachments: list = None, text: str = None):
+        """
+        Add a message. `attachments` is a list of (filename, mime_type, bytes);
+        `text` adds a text/plain alternative to the HTML body.
+        """
+        address = sender.rsplit('<', 1)[-1].rstrip('>')
+        domain = address.rsplit('@', 1)[-1]
+        # Delivery headers as Gmail returns them; real mail carries a few KB of these
+        headers = [
+            {'name': 'Delivered-To', 'value': to},
+            *({'name': 'Received', 'value': f"from mail{hop}.{domain} (mail{hop}.{domain}. [203.0.113.{hop}]) "
+                                             f"by mx.google.com with ESMTPS id {message_id}{hop} for <{to}> "
+                                             f"(version=TLS1_3 cipher=TLS_AES_256_GCM_SHA384 bits=256/256); "
+                                             f"{format_datetime(date)}"} for hop in range(3)),
+            {'name': 'ARC-Seal', 'value': 'i=1; a=rsa-sha256; t=1700000000; cv=none; d=google.com; s=arc-20160816; '
+                                          'b=' + 'A' * 340},
+            {'name': 'DKIM-Signature', 'value': f'v=1; a=rsa-sha256; c=relaxed/relaxed; d={domain}; s=s1; '
+                                                f'h=from:to:subject:date:message-id; bh={"B" * 44}; b={"C" * 340}'},
+            {'name': 'Message-ID', 'value': f'<{message_id}@{domain}>'},
+            {'name': 'MIME-Version', 'value': '1.0'},
+            {'name': 'From', 'value': sender},
+            {'name': 'To', 'value': to},
+            {'name': 'Subject', 'value': subject},
+            {'name': 'Date', 'value': format_datetime(date)},
+        ]
+
+        def body_part(part_id: str, mime_type: str, content: str) -> dict:
+            return {
+                'partId': part_id,
+                'mimeType': mime_type,
+                'filename': '',
+                'headers': [{'name': 'Content-Type', 'value': f'{mime_type}; charset="UTF-8"'},
+                            {'name': 'Content-Transfer-Encoding', 'value': 'quoted-printable'}],
+                'body': {'size': len(content), 'data': _b64(content)},
+            }
+
+        if text is not None:
+            body = {'partId': '', 'mimeType': 'multipart/alternative', 'filename': '',
+                    'headers': [{'name': 'Content-Type', 'value': 'multipart/alternative; boundary="alt"'}],
+                    'body': {'size': 0}, 'parts': [body_part('0', 'text/plain', text),
+                                                   body_part('1', 'text/html', html)]}
+        else:
+            body = body_part('', 'text/html', html)
+        payload = dict(body, headers=headers + body['headers'][:1])
+        if attachments:
+            parts = [dict(body, partId='0')]
+            if 'parts' in body:
+                parts[0]['parts'] = [dict(p, partId=f"0.{n}") for n, p in enumerate(body['parts'])]
+            for n, (filename, mime_type, data) in enumerate(attachments, 1):
+                attachment_id = f"att-{message_id}-{n}"
+                self.attachments[attachment_id] = data
+                parts.append({
+                    'partId': str(n),
+                    'mimeType': mime_type,
+                    'filename': filename,
+                    'headers': [{'name': 'Content-Type', 'value': f'{mime_type}; name="{filename}"'},
+                                {'name': 'Content-Disposition', 'value': f'attachment; filename="{filename}"'},
+                                {'name': 'Content-Transfer-Encoding', 'value': 'base64'},
+                                {'name': 'X-Attachment-Id', 'value': f'f_{message_id}{n}'}],
+                    'body': {'size': len(data), 'attachmentId': attachment_id},
+                })
+            payload = {'partId': '', 'mimeType': 'multipart/mixed', 'filename': '',
+                       'headers': headers + [{'name': 'Content-Type', 'value': 'multipart/mixed; boundary="mix"'}],
+                       'body': {'size': 0}, 'parts': parts}
+        self.messages[message_id] = {
+            'id': message_id,
+            'threadId': thread_id or message_id,
+            'labelIds': label_ids or ['INBOX', 'CATEGORY_UPDATES'],
+            'snippet': re.sub(r'<[^>]+>', ' ', html)[:120].strip(),
+            'historyId': str(self.history_id + 1),
+            'internalDate': str(int(date.timestamp() * 1000)),
+            'sizeEstimate': len(html) + 400,
+            'payload': payload,
+        }
+        self.order.insert(0, message_id)
+        self._record({'messagesAdded': [{'message': self._ref(message_id)}]})
+
+    def add_resource(self, msg: dict, attachments: dict = None):
+        """
+        Add a message given as a Gmail format=full resource, with the data
+        of its attachments by attachment ID.
+        """
+        self.messages[msg['id']] = msg
+        self.attachments.update(attachments or {})
+        self.order.append(msg['id'])
+        self.order.sort(key=lambda i: int(self.messages[i].get('internalDate', 0)), reverse=True)
+        self._record({'messagesAdded': [{'message': self._ref(msg['id'])}]})
+
+    def save_fixtures(self, path: str):
+        with open(path, 'w') as f:
+            for message_id in self.order:
+                msg = self.messages[message_id]
+                attachments = {part['body']['attachmentId']: base64.urlsafe_b64encode(
+                                   self.attachments[part['body']['attachmentId']]).decode('ascii')
+                               for part in _walk_parts(msg['payload'])
+                               if part.get('body', {}).get('attachmentId') in self.attachments}
+                f.write(json.dumps({'message': msg, 'attachments': attachments}) + '\n')
+
+    @classmethod
+    def load_fixtures(cls, path: str) -> 'FakeMailbox':
+        mailbox = cls(0)
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    fixture = json.loads(line)
+                    mailbox.add_resource(fixture['message'], {
+                        attachment_id: base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+                        for attachment_id, data in fixture.get('attachments', {}).items()})
+        return mailbox
+
+    def _ref(self, message_id: str) -> dict:
+        msg = self.messages[message_id]
+        return {'id': message_id, 'threadId': msg['threadId'], 'labelIds': list(msg['labelIds'])}
+
+    def _record(self, record: dict):
+        self.history_id += 1
+        record['id'] = str(self.history_id)
+        self.history.append((self.history_id, record))
+
+    def delete_message(self, message_id: str):
+        ref = self._ref(message_id)
+        del self.messages[message_id]
+        self.order.remove(message_id)
+        self._record({'messagesDeleted': [{'message': ref}]})
+
+    def modify_labels(self, message_id: str, add: list = (), remove: list = ()):
+        labels = self.messages[message_id]['labelIds']
+        for label in remove:
+            if label in labels:
+                labels.remove(label)
+        labels.extend(label for label in add if label not in labels)
+        if add:
+            self._record({'labelsAdded': [{'message': self._ref(message_id), 'labelIds': list(add)}]})
+        if remove:
+            self._record({'labelsRemoved': [{'message': self._ref(message_id), 'labelIds': list(remove)}]})
+
+    def expire_history(self):
+        """
+        Forget all history so far; older start IDs will get a 404.
+        """
+        self.history_floor = self.history_id + 1
+
+    def profile(self) -> dict:
+        return {'emailAddress': 'me@example.com', 'messagesTotal': len(self.order),
+                'historyId': str(self.history_id)}
+
+    def list_history(self, start_history_id: int, max_results: int = 100, page_token: str = None):
+        """
+        Returns the history page, or None if start_history_id has expired.
+        """
+        if start_history_id < self.history_floor:
+            return None
+        records = [r for hid, r in self.history if hid > start_history_id]
+        offset = int(page_token or 0)
+        result = {'history': records[offset:offset + max_results], 'historyId': str(self.history_id)}
+        if offset + max_results < len(records):
+            result['nextPageToken'] = str(offset + max_results)
+        return result
+
+    def list(self, max_results: int, page_token: str = None, label_ids: list = None) -> dict:
+        """
+        List message IDs newest first. The q= search is not emulated.
+        """
+        order = self.order
+        if label_ids:
+            order = [i for i in order if set(label_ids) <= set(self.messages[i]['labelIds'])]
+        offset = int(page_token or 0)
+        ids = order[offset:offset + max_results]
+        result = {
+            'messages': [{'id': i, 'threadId': self.messages[i]['threadId']} for i in ids],
+            'resultSizeEstimate': len(order),
+        }
+        if offset + max_results < len(order):
+            result['nextPageToken'] = str(offset + max_results)
+        return result
+
+    def _render_part(self, part: dict) -> bytes:
+        """
+        RFC 822 source of a payload part; leaf bodies are base64-encoded.
+        """
+        headers = [h for h in part['headers'] if h['name'] != 'Content-Transfer-Encoding']
+        lines = [f"{h['name']}: {h['value']}" for h in headers]
+        if part.get('parts'):
+            content_type = next(h['value'] for h in headers if h['name'] == 'Content-Type')
+            boundary = re.search(r'boundary="([^"]+)"', content_type).group(1)
+            body = b''.join(b'--' + boundary.encode() + b'\r\n' + self._render_part(p) + b'\r\n'
+                            for p in part['parts']) + b'--' + boundary.encode() + b'--\r\n'
+        else:
+            if 'attachmentId' in part['body']:
+                data = self.attachments[part['body']['attachmentId']]
+            else:
+                data = base64.urlsafe_b64decode(part['body'].get('data', ''))
+            lines.append('Content-Transfer-Encoding: base64')
+            body = base64.encodebytes(data).replace(b'\n', b'\r\n')
+        return '\r\n'.join(lines).encode('utf-8') + b'\r\n\r\n' + body
+
+    def get(self, message_id: str, fmt: str = 'full', metadata_headers: list = None) -> dict:
+        msg = self.messages[message_id]
+        if fmt == 'minimal':
+            return {k: v for k, v in msg.items() if k != 'payload'}
+        if fmt == 'raw':
+            result = {k: v for k, v in msg.items() if k != 'payload'}
+            result['raw'] = base64.urlsafe_b64encode(self._render_part(msg['payload'])).decode('ascii')
+            return result
+        if fmt == 'metadata':
+            headers = msg['payload']['headers']
+            if metadata_headers:
+                wanted = {h.lower() for h in metadata_headers}
+                headers = [h for h in headers if h['name'].lower() in wanted]
+            result = dict(msg)
+            result['payload'] = {'mimeType': msg['payload']['mimeType'], 'headers': headers}
+            return result
+        return msg
+
+
+    def get_thread(self, thread_id: str, fmt: str = 'full') -> dict:
+        """
+        The thread's messages oldest first, or None if there is no such thread.
+        """
+        messages = sorted((m for m in self.messages.values() if m['threadId'] == thread_id),
+                          key=lambda m: int(m['internalDate']))
+        if not messages:
+            return None
+        return {'id': thread_id, 'historyId': str(self.history_id),
+                'messages': [self.get(m['id'], fmt) for m in messages]}
+
+
+def _walk_parts(part: dict):
+    yield part
+    for child in part.get('parts', []):
+        yield from _walk_parts(child)
+
+
+def make_fixture_mailbox(messages: int = 500, seed: int = 0) -> FakeMailbox:
+    """
+    A reproducible mix of the mail the server reads (the same for the same
+    messages and seed): small receipts, some with a text/plain part (50%),
+    HTML-heavy template receipts (30%), large newsletters (10%) and
+    statements with a multi-page PDF attached (10%).
+    """
+    rng = random.Random(seed)
+    mailbox = FakeMailbox(0)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for n in range(messages):
+        name, address = SENDERS[n % len(SENDERS)]
+        sender = f"{name} <{address}>"
+        date = start + timedelta(hours=3 * n)
+        message_id = f"{n + 1:016x}"
+        kind = rng.random()
+        if kind < 0.5:
+            items = rng.randint(2, 30)
+            html = make_html_receipt(name, n, items)
+            text = f"{name} order #{n}\n" + "\n".join(f"Item {i}  {i}  Rs. {i * 42}.00" for i in range(1, items + 1)) \
+                if rng.random() < 0.5 else None
+            mailbox.add_message(message_id, sender, f"Your {name} order #{n}", date, html, text=text)
+        elif kind < 0.8:
+            mailbox.add_message(message_id, sender, f"Your {name} order #{n}", date,
+                                make_rich_html_receipt(name, n, rng.randint(5, 60)))
+        elif kind < 0.9:
+            mailbox.add_message(message_id, f"{name} News <news@{address.split('@')[1]}>", f"{name} weekly #{n}",
+                                date, make_rich_html_receipt(name, n, rng.randint(100, 200)))
+        else:
+            pages = rng.randint(2, 12)
+            mailbox.add_message(message_id, 'HDFC Bank <alerts@hdfcbank.net>', f"Your account statement #{n}",
+                                date, '<p>Your statement is attached.</p>',
+                                attachments=[(f"statement-{n}.pdf", 'application/pdf',
+                                              make_statement_pdf(pages, seed=seed + n))])
+    return mailbox
+
+
+class FakeQuota:
+    """
+    Gmail-style per-user quota: `units_per_second` units, refilled continuously.
+    """
+
+    COSTS = [
+        (re.compile(r'/profile$'), 1),
+        (re.compile(r'/history$'), 2),
+        (re.compile(r'/threads/[^/]+$'), 10),
+    ]
+
+    def __init__(self, units_per_second: float):
+        self.rate = units_per_second
+        self.tokens = units_per_second
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def cost(self, path: str) -> int:
+        return next((units for pattern, units in self.COSTS if pattern.search(path)), 5)
+
+    def charge(self, path: str) -> bool:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            units = self.cost(path)
+            if self.tokens < units:
+                return False
+            self.tokens -= units
+            return True
+
+
+RATE_LIMITED = {'error': {'code': 429, 'message': 'User-rate limit exceeded.',
+                          'errors': [{'reason': 'rateLimitExceeded', 'domain': 'usageLimits'}]}}
+BACKEND_ERROR = {'error': {'code': 503, 'message': 'The service is currently unavailable.',
+                           'errors': [{'reason': 'backendError', 'domain': 'global'}]}}
+
+
+class FakeGmailHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    mailbox = None
+    latency = 0.0
+    latency_jitter = 0.0
+    quota = None
+    error_rate = 0.0
+    error_status = 429
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str = 'application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def route(self, method: str, target: str) -> tuple:
+        """
+        Resolve one API call. Returns (status, json-serialisable body).
+        """
+        status, body = self._route(method, target)
+        mask = parse_qs(urlsplit(target).query).get('fields')
+        if status == 200 and mask:
+            body = apply_fields(body, parse_fields(mask[0]))
+        return status, body
+
+    def _route(self, method: str, target: str) -> tuple:
+        parts = urlsplit(target)
+        query = parse_qs(parts.query)
+        path = parts.path
+        if path == '/gmail/v1/users/me/profile' and method == 'GET':
+            return 200, self.mailbox.profile()
+        if path == '/gmail/v1/users/me/history' and method == 'GET':
+            page = self.mailbox.list_history(int(query['startHistoryId'][0]),
+                                             int(query.get('maxResults', ['100'])[0]),
+                                             query.get('pageToken', [None])[0])
+            if page is None:
+                return 404, {'error': {'code': 404, 'message': 'Requested entity was not found.'}}
+            return 200, page
+        match = re.fullmatch(r'/gmail/v1/users/me/messages/?', path)
+        if match and method == 'GET':
+            return 200, self.mailbox.list(int(query.get('maxResults', ['100'])[0]),
+                                          query.get('pageToken', [None])[0],
+                                          query.get('labelIds'))
+        match = re.fullmatch(r'/gmail/v1/users/me/messages/([^/]+)/attachments/([^/]+)', path)
+        if match and method == 'GET':
+            data = self.mailbox.attachments.get(match.group(2))
+            if data is None:
+                return 404, {'error': {'code': 404, 'message': 'Invalid attachment token'}}
+            return 200, {'size': len(data), 'data': base64.urlsafe_b64encode(data).decode('ascii')}
+        match = re.fullmatch(r'/gmail/v1/users/me/messages/([^/]+)', path)
+        if match and method == 'GET':
+            message_id = match.group(1)
+            if message_id not in self.mailbox.messages:
+                return 404, {'error': {'code': 404, 'message': 'Requested entity was not found.'}}
+            return 200, self.mailbox.get(message_id, query.get('format', ['full'])[0],
+                                         query.get('metadataHeaders'))
+        match = re.fullmatch(r'/gmail/v1/users/me/threads/([^/]+)', path)
+        if match and method == 'GET':
+            thread = self.mailbox.get_thread(match.group(1), query.get('format', ['full'])[0])
+            if thread is None:
+                return 404, {'error': {'code': 404, 'message': 'Requested entity was not found.'}}
+            return 200, thread
+        return 404, {'error': {'code': 404, 'message': f'No fake route for {method} {path}'}}
+
+    def rejection(self, target: str) -> tuple:
+        """
+        (status, error body) if this call should fail, over quota or as an
+        injected error; None otherwise.
+        """
+        if self.error_rate and random.random() < self.error_rate:
+            rejected = (429, RATE_LIMITED) if self.error_status == 429 else \
+                (self.error_status, dict(BACKEND_ERROR, error=dict(BACKEND_ERROR['error'], code=self.error_status)))
+        elif self.quota is not None and not self.quota.charge(urlsplit(target).path):
+            rejected = (429, RATE_LIMITED)
+        else:
+            rejected = None
+        with self.stats_lock:
+            self.stats['calls'] += 1
+            if rejected:
+                self.stats['rejected'] += 1
+        return rejected
+
+    def delay(self):
+        time.sleep(self.latency + (random.uniform(0, self.latency_jitter) if self.latency_jitter else 0))
+
+    def do_GET(self):
+        self.delay()
+        rejected = self.rejection(self.path)
+        if rejected:
+            self._send(rejected[0], json.dumps(rejected[1]).encode('utf-8'))
+            return
+        with self.mailbox.lock:
+            status, body = self.route('GET', self.path)
+        self._send(status, json.dumps(body).encode('utf-8'))
+
+    def do_POST(self):
+        self.delay()
+        length = int(self.headers.get('Content-Length', 0))
+        raw = self.rfile.read(length).decode('utf-8')
+        if urlsplit(self.path).path != '/batch/gmail/v1':
+            self._send(404, b'{}')
+            return
+        self._send_batch(raw)
+
+    def _send_batch(self, raw: str):
+        message = Parser().parsestr(f"Content-Type: {self.headers['Content-Type']}\r\n\r\n{raw}")
+        boundary = 'fake_gmail_batch_boundary'
+        out = []
+        for part in message.get_payload():
+            request_line = part.get_payload().split('\n', 1)[0].strip()
+            method, target, _ = request_line.split(' ', 2)
+            # Gmail charges and rate-limits each sub-request on its own
+            rejected = self.rejection(target)
+            if rejected:
+                status, body = rejected
+            else:
+                with self.mailbox.lock:
+                    status, body = self.route(method, target)
+            content_id = part['Content-ID'].strip('<>')
+            out.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                f"Content-Type: application/json; charset=UTF-8\r\n\r\n"
+                f"{json.dumps(body)}\r\n"
+            )
+        out.append(f"--{boundary}--\r\n")
+        self._send(200, "".join(out).encode('utf-8'), f'multipart/mixed; boundary={boundary}')
+
+
+def start_fake_gmail(mailbox: FakeMailbox = None, port: int = 0, latency_ms: float = 0.0,
+                     quota_units: float = None, error_rate: float = 0.0, latency_jitter_ms: float = 0.0,
+                     error_status: int = 429) -> ThreadingHTTPServer:
+    """
+    Start the fake API on a background thread. The server's `url` attribute
+    holds the value to use for GMAIL_API_ENDPOINT; call shutdown() when done.
+
+    Each request takes latency_ms plus up to latency_jitter_ms (uniform).
+    quota_units enforces a per-second quota like Gmail's; error_rate is the
+    fraction of calls failed regardless, with error_status (429, or a 5xx).
+    `server.stats` counts calls and rejections (batch sub-requests count
+    individually).
+    """
+    stats = {'calls': 0, 'rejected': 0}
+    handler = type('Handler', (FakeGmailHandler,), {
+        'mailbox': mailbox or FakeMailbox(),
+        'latency': latency_ms / 1000.0,
+        'latency_jitter': latency_jitter_ms / 1000.0,
+        'quota': FakeQuota(quota_units) if quota_units else None,
+        'error_rate': error_rate,
+        'error_status': error_status,
+        'stats': stats,
+        'stats_lock': threading.Lock(),
+    })
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    server.stats = stats
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--mixed', action='store_true', help='Serve the make_fixture_mailbox() corpus')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for --mixed')
+    parser.add_argument('--fixtures', help='Serve the messages in this fixture file instead')
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--latency-jitter-ms', type=float, default=0.0, help='Extra random latency, up to this much')
+    parser.add_argument('--quota-units', type=float, default=None, help='Per-second quota units before 429s')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of calls failed on purpose')
+    parser.add_argument('--error-status', type=int, default=429, choices=(429, 500, 503),
+                        help='Status of the --error-rate failures')
+    args = parser.parse_args()
+
+    if args.fixtures:
+        mailbox = FakeMailbox.load_fixtures(args.fixtures)
+    elif args.mixed:
+        mailbox = make_fixture_mailbox(args.messages, args.seed)
+    else:
+        mailbox = FakeMailbox(args.messages)
+    server = start_fake_gmail(mailbox, args.port, args.latency_ms, args.quota_units, args.error_rate,
+                              args.latency_jitter_ms, args.error_status)
+    print(f"Fake Gmail API listening on {server.url}", file=sys.stderr)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Record messages from a real Gmail account as a fixture file for
+fake_gmail.py, so benchmarks can run against real-world mail offline:
+
+    python benchmarks/record_fixtures.py benchmarks/fixtures/receipts.jsonl --query "receipt" --max-results 200
+    python benchmarks/bench_suite.py --fixtures benchmarks/fixtures/receipts.jsonl
+
+Messages are stored as Gmail returns them with format=full, attachments
+included (up to --max-attachment-bytes each). Fixture files hold real
+mail: benchmarks/fixtures/ is excluded from version control.
+"""
+import os
+import sys
+import json
+import argparse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='Fixture file to write (JSON lines)')
+    parser.add_argument('--query', default='', help='Gmail search query')
+    parser.add_argument('--max-results', type=int, default=100)
+    parser.add_argument('--max-attachment-bytes', type=int, default=10 * 1024 * 1024)
+    parser.add_argument('--account', help='Named account to record from (see auth.py --account)')
+    args = parser.parse_args()
+
+    from gmail_client import get_service_pool, batch_get_messages, iter_message_ids
+    from fake_gmail import _walk_parts
+    service = get_service_pool(args.account).get_service()
+    os.makedirs(os.path.dirname(os.path.abspath(args.path)), exist_ok=True)
+    recorded = 0
+    with open(args.path, 'w') as out:
+        for ids, _ in iter_message_ids(service, args.query, args.max_results):
+            for message_id, (msg, error) in zip(ids, batch_get_messages(service, ids, format='full')):
+                if error is not None:
+                    print(f"skipped {message_id}: {error}", file=sys.stderr)
+                    continue
+                attachments = {}
+                for part in _walk_parts(msg['payload']):
+                    body = part.get('body', {})
+                    if body.get('attachmentId') and body.get('size', 0) <= args.max_attachment_bytes:
+                        attachments[body['attachmentId']] = service.users().messages().attachments().get(
+                            userId='me', messageId=message_id, id=body['attachmentId']).execute()['data']
+                out.write(json.dumps({'message': msg, 'attachments': attachments}) + '\n')
+                recorded += 1
+            print(f"\r{recorded} messages recorded", end='', file=sys.stderr, flush=True)
+    print(file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import os
+import re
+import base64
+import hashlib
+import tempfile
+import weakref
+
+# Attachments up to this size stay in memory once decoded; larger ones are
+# decoded chunk by chunk into a file on disk.
+SPOOL_MEMORY_BYTES = int(os.environ.get("ATTACHMENT_SPOOL_BYTES", 8 * 1024 * 1024))
+# Bytes returned by one read of a binary or image attachment, unless the call
+# asks for a different length (never more than ATTACHMENT_MAX_READ_BYTES).
+# Multiples of 3 so consecutive reads concatenate into valid base64.
+READ_BYTES = int(os.environ.get("ATTACHMENT_READ_BYTES", 192 * 1024))
+MAX_READ_BYTES = int(os.environ.get("ATTACHMENT_MAX_READ_BYTES", 4 * 1024 * 1024))
+# Base64 characters decoded per step (a multiple of 4).
+DECODE_CHUNK_CHARS = 1024 * 1024
+COPY_CHUNK_BYTES = 1024 * 1024
+# Start of the base64url string in a raw attachments.get response body
+DATA_FIELD = re.compile(rb'"data"\s*:\s*"')
+
+
+class AttachmentData:
+    """
+    Decoded attachment content, either held in memory (small files) or as a
+    file on disk (a spooled download or an attachment-store blob).
+
+    Readers use read(offset, length) or source, so a large attachment is
+    never loaded whole. A temporary spool file is removed once the last
+    reference to its AttachmentData is gone.
+    """
+
+    def __init__(self, size: int, sha256: str, data: bytearray = None, path: str = None, temporary: bool = False):
+        self.size = size
+        self.sha256 = sha256
+        self.data = data
+        self.path = path
+        self.temporary = temporary
+        if temporary:
+            weakref.finalize(self, _remove, path)
+
+    @classmethod
+    def from_file(cls, path: str, sha256: str = None) -> 'AttachmentData':
+        return cls(os.path.getsize(path), sha256 or file_sha256(path), path=path)
+
+    @property
+    def source(self):
+        """
+        The content in memory, or the path of the file holding it (pdfplumber takes either).
+        """
+        return self.data if self.data is not None else self.path
+
+    def read(self, offset: int = 0, length: int = None) -> bytes:
+        offset = max(0, offset)
+        end = self.size if length is None else min(self.size, offset + max(0, length))
+        if offset >= end:
+            return b''
+        if self.data is not None:
+            return self.data[offset:end]
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return f.read(end - offset)
+
+    def iter_base64(self, offset: int = 0, length: int = None, chunk_size: int = 48 * 1024):
+        """
+        Yield standard base64 for bytes [offset, offset + length) a chunk at a time.
+        """
+        end = self.size if length is None else min(self.size, offset + length)
+        chunk_size -= chunk_size % 3
+        for start in range(offset, end, chunk_size):
+            yield base64.b64encode(self.read(start, min(chunk_size, end - start))).decode('ascii')
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def response_data(content: bytes) -> memoryview:
+    """
+    The base64url `data` value of a raw attachments.get JSON body, as a view
+    into `content` (base64url never needs JSON escapes, so no parsing).
+    """
+    match = DATA_FIELD.search(content)
+    if match is None:
+        raise ValueError("attachments.get response has no data field")
+    end = content.index(b'"', match.end())
+    return memoryview(content)[match.end():end]
+
+
+def _decoded_chunks(data):
+    # Gmail omits padding; only the last chunk can be short
+    for start in range(0, len(data), DECODE_CHUNK_CHARS):
+        chunk = bytes(data[start:start + DECODE_CHUNK_CHARS])
+        yield base64.urlsafe_b64decode(chunk + b'=' * (-len(chunk) % 4))
+
+
+def decode_attachment(data, spool_dir: str = None) -> AttachmentData:
+    """
+    Decode base64url attachment data (str, bytes or a memoryview from
+    response_data()) in DECODE_CHUNK_CHARS steps, hashing as it goes.
+
+    Small attachments are kept in memory. Larger ones are written to a
+    temporary file in `spool_dir` (the system temp directory by default),
+    so the only full-size copy held in memory is the response body itself.
+    """
+    if isinstance(data, str):
+        data = data.encode('ascii')
+    digest = hashlib.sha256()
+    if len(data) * 3 // 4 <= SPOOL_MEMORY_BYTES:
+        decoded = bytearray()
+        for chunk in _decoded_chunks(data):
+            digest.update(chunk)
+            decoded += chunk
+        return AttachmentData(len(decoded), digest.hexdigest(), data=decoded)
+
+    if spool_dir:
+        os.makedirs(spool_dir, exist_ok=True)
+    size = 0
+    fd, path = tempfile.mkstemp(prefix='attachment-', suffix='.part', dir=spool_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in _decoded_chunks(data):
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        _remove(path)
+        raise
+    return AttachmentData(size, digest.hexdigest(), path=path, temporary=True)
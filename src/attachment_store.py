@@ -0,0 +1,208 @@
+import os
+import time
+import sqlite3
+import shutil
+import hashlib
+import threading
+from message_cache import CACHE_DIR, CACHE_ENABLED
+from credential_store import current_account, account_dir
+from attachment_data import AttachmentData
+
+ATTACHMENT_STORE_ENABLED = CACHE_ENABLED and os.environ.get("GMAIL_ATTACHMENT_STORE", "1") != "0"
+ATTACHMENT_STORE_BYTES = int(os.environ.get("GMAIL_ATTACHMENT_STORE_BYTES", 1024 * 1024 * 1024))
+
+
+class AttachmentStore:
+    """
+    Content-addressed on-disk store for decoded attachment bytes.
+
+    Blobs live at <root>/<sha256[:2]>/<sha256>, so the same file attached to
+    many messages is stored once. A SQLite index maps (message ID, part key)
+    to the blob hash and tracks last access for LRU eviction under a total
+    size cap.
+    """
+
+    def __init__(self, root: str, max_bytes: int = ATTACHMENT_STORE_BYTES):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        # Large downloads are spooled here so they can be moved into place
+        self.spool_dir = os.path.join(root, 'tmp')
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.deduplicated = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(root, 'index.sqlite3'), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                sha256 TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS refs (
+                message_id TEXT NOT NULL,
+                part_key TEXT NOT NULL,
+                sha256 TEXT NOT NULL,
+                PRIMARY KEY (message_id, part_key)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS blobs_last_access ON blobs (last_access)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS refs_sha256 ON refs (sha256)")
+        self._conn.commit()
+        self.bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    def lookup(self, message_id: str, part_key: str):
+        """
+        Return the blob hash stored for this attachment, or None.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT sha256 FROM refs WHERE message_id = ? AND part_key = ?", (message_id, part_key)).fetchone()
+            if row is None or not os.path.exists(self.blob_path(row[0])):
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE blobs SET last_access = ? WHERE sha256 = ?", (time.time(), row[0]))
+            self._conn.commit()
+            return row[0]
+
+    def get(self, message_id: str, part_key: str):
+        """
+        Return the stored bytes for this attachment, or None.
+        """
+        sha256 = self.lookup(message_id, part_key)
+        if sha256 is None:
+            return None
+        try:
+            with open(self.blob_path(sha256), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def open(self, message_id: str, part_key: str):
+        """
+        Return the stored attachment as an AttachmentData reading from its
+        blob file (nothing is loaded), or None.
+        """
+        sha256 = self.lookup(message_id, part_key)
+        if sha256 is None:
+            return None
+        try:
+            return AttachmentData.from_file(self.blob_path(sha256), sha256)
+        except FileNotFoundError:
+            return None
+
+    def put(self, message_id: str, part_key: str, data: bytes) -> str:
+        """
+        Store attachment bytes and return their SHA-256. Identical content is
+        written to disk only once.
+        """
+        sha256 = hashlib.sha256(data).hexdigest()
+
+        def write(tmp_path):
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+        self._put(message_id, part_key, sha256, len(data), write)
+        return sha256
+
+    def put_data(self, message_id: str, part_key: str, attachment: AttachmentData) -> AttachmentData:
+        """
+        Store decoded attachment content. A spooled temporary file is moved
+        into the store rather than copied. Returns the AttachmentData to read
+        from afterwards: the stored blob, or `attachment` itself if it is kept
+        in memory or too large to store.
+        """
+        if attachment.data is not None:
+            self.put(message_id, part_key, attachment.data)
+            return attachment
+
+        def write(tmp_path):
+            if attachment.temporary:
+                os.replace(attachment.path, tmp_path)
+            else:
+                shutil.copyfile(attachment.path, tmp_path)
+        if not self._put(message_id, part_key, attachment.sha256, attachment.size, write):
+            return attachment
+        return AttachmentData(attachment.size, attachment.sha256, path=self.blob_path(attachment.sha256))
+
+    def _put(self, message_id: str, part_key: str, sha256: str, size: int, write) -> bool:
+        # write(tmp_path) puts the content at tmp_path; returns False if too large to keep
+        path = self.blob_path(sha256)
+        with self._lock:
+            exists = self._conn.execute("SELECT 1 FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+            if exists and os.path.exists(path):
+                self.deduplicated += 1
+                self._conn.execute("UPDATE blobs SET last_access = ? WHERE sha256 = ?", (time.time(), sha256))
+            elif size <= self.max_bytes:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                write(tmp_path)
+                os.replace(tmp_path, path)
+                if not exists:
+                    self.bytes += size
+                self._conn.execute("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?)", (sha256, size, time.time()))
+            else:
+                return False
+            self._conn.execute("INSERT OR REPLACE INTO refs VALUES (?, ?, ?)", (message_id, part_key, sha256))
+            if self.bytes > self.max_bytes:
+                self._evict(keep=sha256)
+            self._conn.commit()
+        return True
+
+    def _evict(self, keep: str):
+        target = self.max_bytes * 0.9
+        rows = self._conn.execute("SELECT sha256, size FROM blobs ORDER BY last_access").fetchall()
+        for sha256, size in rows:
+            if self.bytes <= target:
+                break
+            if sha256 == keep:
+                continue
+            self._conn.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+            self._conn.execute("DELETE FROM refs WHERE sha256 = ?", (sha256,))
+            try:
+                os.remove(self.blob_path(sha256))
+            except FileNotFoundError:
+                pass
+            self.bytes -= size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'blobs': self._conn.execute("SELECT COUNT(*) FROM blobs").fetchone()[0],
+                'references': self._conn.execute("SELECT COUNT(*) FROM refs").fetchone()[0],
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'deduplicated': self.deduplicated,
+                'evictions': self.evictions,
+            }
+
+
+# account name -> AttachmentStore
+_stores = {}
+_store_lock = threading.Lock()
+
+
+def get_attachment_store():
+    """
+    Return the current account's attachment store, or None if GMAIL_ATTACHMENT_STORE or GMAIL_CACHE is 0.
+    """
+    if not ATTACHMENT_STORE_ENABLED:
+        return None
+    account = current_account()
+    store = _stores.get(account)
+    if store is None:
+        with _store_lock:
+            store = _stores.get(account)
+            if store is None:
+                store = _stores[account] = AttachmentStore(os.path.join(account_dir(CACHE_DIR, account), 'attachments'))
+    return store
@@ -1,37 +1,49 @@
 import os.path
+import argparse
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
+from credential_store import TOKEN_FILE, CREDENTIALS_FILE, LOCK_SUFFIX, FileLock, token_path, write_token
 
 # If modifying these scopes, delete the file token.json.
 SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
 
-def authenticate():
+def authenticate(account=None):
     """Shows basic usage of the Gmail API.
     Lists the user's Gmail labels.
+
+    With an account name the tokens go to accounts/<account>.json, so the
+    server can work on several Gmail accounts (see credential_store).
     """
+    token_file = token_path(account) if account else TOKEN_FILE
     creds = None
-    # The file token.json stores the user's access and refresh tokens, and is
+    # The token file stores the user's access and refresh tokens, and is
     # created automatically when the authorization flow completes for the first
     # time.
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
+    if os.path.exists(token_file):
+        creds = Credentials.from_authorized_user_file(token_file, SCOPES)
     # If there are no (valid) credentials available, let the user log in.
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
+            # Same lock file as the server, so a running server does not refresh at the same time
+            with FileLock(token_file + LOCK_SUFFIX):
+                stored = Credentials.from_authorized_user_file(token_file, SCOPES)
+                if stored.valid:
+                    creds = stored
+                else:
+                    creds.refresh(Request())
+                    write_token(token_file, creds.to_json())
         else:
-            if not os.path.exists('credentials.json'):
+            if not os.path.exists(CREDENTIALS_FILE):
                 raise FileNotFoundError("credentials.json not found. Please download it from Google Cloud Console.")
             
             flow = InstalledAppFlow.from_client_secrets_file(
-                'credentials.json', SCOPES)
+                CREDENTIALS_FILE, SCOPES)
             creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
-            print("Authentication successful! token.json created.")
+            # Save the credentials for the next run
+            write_token(token_file, creds.to_json())
+        print(f"Authentication successful! {token_file} created.")
 
     service = build('gmail', 'v1', credentials=creds)
     results = service.users().labels().list(userId='me').execute()
@@ -45,4 +57,6 @@ def authenticate():
             print(label['name'])
 
 if __name__ == '__main__':
-    authenticate()
+    parser = argparse.ArgumentParser(description="Authorize the server to read a Gmail account.")
+    parser.add_argument('--account', help="Name for this account (e.g. 'work'); tools select it with account=<name>")
+    authenticate(parser.parse_args().account)
@@ -0,0 +1,203 @@
+"""
+OAuth token files for one or more Gmail accounts, and the account the
+current request works on.
+
+Each named account keeps its tokens in ACCOUNTS_DIR/<name>.json (created
+with `python src/auth.py --account <name>`); requests without an account
+use GMAIL_ACCOUNT, or the single GMAIL_TOKEN_FILE if that is unset. Token
+files are shared by every server process, so refreshes are serialized
+with a lock file next to the token (see gmail_client.GmailServicePool).
+"""
+import os
+import re
+import time
+import threading
+from contextlib import contextmanager
+
+# Single-account setup: the token file used when no account is named.
+TOKEN_FILE = os.environ.get("GMAIL_TOKEN_FILE", "token.json")
+CREDENTIALS_FILE = os.environ.get("GMAIL_CREDENTIALS_FILE", "credentials.json")
+# One <account>.json token file per named account.
+ACCOUNTS_DIR = os.environ.get("GMAIL_ACCOUNTS_DIR", "accounts")
+# Account for requests that do not name one; unset means TOKEN_FILE.
+DEFAULT_ACCOUNT = os.environ.get("GMAIL_ACCOUNT") or None
+# Longest wait for another process to finish refreshing a token.
+LOCK_TIMEOUT_SECONDS = float(os.environ.get("GMAIL_TOKEN_LOCK_TIMEOUT", 60))
+
+# Account names become file and directory names
+ACCOUNT_NAME = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._@+-]{0,127}$')
+LOCK_SUFFIX = '.lock'
+
+_context = threading.local()
+
+
+class UnknownAccountError(ValueError):
+    """Raised for an account name that is malformed or has no token file."""
+
+
+def token_path(account: str = None) -> str:
+    """
+    Token file of a named account, or TOKEN_FILE for None.
+    """
+    if account is None:
+        return TOKEN_FILE
+    if not isinstance(account, str) or not ACCOUNT_NAME.match(account):
+        raise UnknownAccountError(f"Invalid account name {account!r}")
+    return os.path.join(ACCOUNTS_DIR, f"{account}.json")
+
+
+def check_account(account: str):
+    """
+    Raise UnknownAccountError unless `account` is None or has a token file.
+    Named accounts are never authorized interactively by the server.
+    """
+    if account is not None and not os.path.exists(token_path(account)):
+        raise UnknownAccountError(
+            f"Unknown account {account!r}; authorize it with: python src/auth.py --account {account}")
+
+
+def list_accounts() -> list:
+    """
+    Names of the accounts with a token file in ACCOUNTS_DIR.
+    """
+    try:
+        names = os.listdir(ACCOUNTS_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted(name[:-5] for name in names if name.endswith('.json') and ACCOUNT_NAME.match(name[:-5]))
+
+
+def account_dir(base: str, account: str = None) -> str:
+    """
+    Per-account subdirectory of a cache or export directory. The unnamed
+    account keeps the top level, where a single-account install already
+    has its files.
+    """
+    return os.path.join(base, 'accounts', account) if account else base
+
+
+def write_token(path: str, token_json: str):
+    """
+    Replace a token file atomically and readable only by its owner, so
+    another process never reads a half-written token.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(token_json)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class FileLock:
+    """
+    Exclusive lock on `path` shared by all processes on this machine
+    (flock on POSIX, msvcrt.locking on Windows), for the length of a
+    with block. Raises TimeoutError after `timeout` seconds.
+    """
+
+    def __init__(self, path: str, timeout: float = LOCK_TIMEOUT_SECONDS):
+        self.path = path
+        self.timeout = timeout
+        self._file = None
+
+    def _try_lock(self) -> bool:
+        try:
+            if os.name == 'nt':
+                import msvcrt
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def _unlock(self):
+        if os.name == 'nt':
+            import msvcrt
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._file = open(self.path, 'a+')
+        deadline = time.monotonic() + self.timeout
+        while not self._try_lock():
+            if time.monotonic() >= deadline:
+                self._file.close()
+                self._file = None
+                raise TimeoutError(f"Timed out waiting for {self.path}")
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            self._unlock()
+        finally:
+            self._file.close()
+            self._file = None
+
+
+def current_account() -> str:
+    """
+    Account the calling thread works on: the one its request named, else
+    DEFAULT_ACCOUNT (None meaning TOKEN_FILE).
+    """
+    return getattr(_context, 'account', None) or DEFAULT_ACCOUNT
+
+
+@contextmanager
+def account_context(account: str = None):
+    """
+    Work on `account` (None: the default) inside the with block.
+    """
+    check_account(account)
+    outer = getattr(_context, 'account', None)
+    _context.account = account
+    try:
+        yield
+    finally:
+        _context.account = outer
+
+
+def using_account(account: str, fn):
+    """
+    Wrap a tool function so it runs on `account`, on whatever thread calls it.
+    """
+    def call(**arguments):
+        with account_context(account):
+            return fn(**arguments)
+    return call
+
+
+def using_account_generator(account: str, gen_fn):
+    """
+    Like using_account(), for the generator functions behind streaming tools.
+    """
+    def generate(**arguments):
+        with account_context(account):
+            yield from gen_fn(**arguments)
+    return generate
+
+
+def propagate(fn):
+    """
+    Wrap fn so that, run on another thread (a worker pool inside a tool
+    call), it still works on the calling thread's account.
+    """
+    account = getattr(_context, 'account', None)
+
+    def call(*args, **kwargs):
+        outer = getattr(_context, 'account', None)
+        _context.account = account
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _context.account = outer
+    return call
@@ -0,0 +1,356 @@
+import os.path
+import json
+import time
+import threading
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING
+from rate_limit import RateLimitedHttp, get_rate_limiter, is_retryable, backoff_delay, MAX_RETRIES
+from credential_store import (CREDENTIALS_FILE, LOCK_SUFFIX, UnknownAccountError, FileLock, current_account,
+                              token_path, write_token)
+import metrics
+
+# The Google client libraries take a few hundred milliseconds to import, so
+# they are imported on first use rather than at server start.
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
+
+# If modifying these scopes, delete the file token.json.
+SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
+
+# Optional override of the Gmail API root (e.g. a local fake for benchmarks).
+API_ENDPOINT = os.environ.get("GMAIL_API_ENDPOINT")
+
+# Refresh the access token this many seconds before it actually expires so a
+# request never starts with a token that dies mid-flight.
+REFRESH_MARGIN_SECONDS = int(os.environ.get("GMAIL_REFRESH_MARGIN", 300))
+HTTP_TIMEOUT_SECONDS = int(os.environ.get("GMAIL_HTTP_TIMEOUT", 60))
+
+# Sub-requests per Gmail batch call. Gmail accepts up to 100 but recommends 50
+# to avoid rate limiting.
+BATCH_CHUNK_SIZE = int(os.environ.get("GMAIL_BATCH_SIZE", 50))
+MAX_BATCH_CHUNK_SIZE = 100
+# Gmail returns at most 500 IDs per messages.list page.
+MAX_LIST_PAGE_SIZE = 500
+
+# Ask Gmail for partial responses (the `fields` parameter) holding only what
+# each call path reads. GMAIL_FIELDS=0 requests whole resources, e.g. to
+# measure the difference.
+FIELD_PROJECTION = os.environ.get("GMAIL_FIELDS", "1") != "0"
+
+
+def message_fields(part: str, depth: int = 6) -> str:
+    """
+    Partial-response mask for a message whose MIME parts, nested up to
+    `depth` levels, keep only the `part` fields. Part headers are dropped;
+    the top-level headers are kept.
+    """
+    nested = part
+    for _ in range(depth):
+        nested = f"{part},parts({nested})"
+    return f"id,threadId,internalDate,snippet,payload(headers,{nested})"
+
+
+FIELD_MASKS = {
+    # messages.list: just the IDs to fetch next
+    'list': "messages/id,nextPageToken",
+    # format='metadata' for search results and the mailbox mirror
+    'metadata': "id,internalDate,snippet,payload/headers",
+    'mirror': "id,threadId,internalDate,snippet,labelIds,sizeEstimate,payload(mimeType,headers)",
+    # format='full' for get_email_content: body data, attachment metadata
+    'full': message_fields("partId,mimeType,filename,body(size,data,attachmentId)"),
+    # format='full' without any body data: the part tree for attachment lookups
+    'structure': message_fields("partId,mimeType,filename,body/size,body/attachmentId"),
+    # attachments.get
+    'attachment': "data",
+    # format='raw' for exports: the RFC 822 source and what an archive keeps beside it
+    'raw': "id,threadId,labelIds,internalDate,raw",
+    # format='minimal' lookup of the thread a message belongs to
+    'thread_id': "threadId",
+}
+# threads.get: every message as for 'full'
+FIELD_MASKS['thread'] = f"id,messages({FIELD_MASKS['full']})"
+
+
+def fields(kind: str) -> dict:
+    """
+    Keyword arguments selecting FIELD_MASKS[kind] on a get()/list() call,
+    or nothing when GMAIL_FIELDS=0.
+    """
+    return {'fields': FIELD_MASKS[kind]} if FIELD_PROJECTION else {}
+
+
+def load_discovery_document() -> dict:
+    """
+    Load the Gmail v1 discovery document bundled with google-api-python-client.
+    Never touches the network.
+    """
+    from googleapiclient import discovery_cache
+    return json.loads(discovery_cache.get_static_doc('gmail', 'v1'))
+
+
+class GmailServicePool:
+    """
+    Holder for one account's Gmail credentials and service objects.
+
+    Credentials are loaded once and kept in memory; they are refreshed shortly
+    before expiry and written back to the token file. Each thread gets its own
+    service object with its own keep-alive httplib2 connection, since
+    httplib2.Http is not safe to share between threads.
+
+    Several server processes share the token file, so a refresh holds a lock
+    file next to it: the first process refreshes, and the others pick up the
+    token it wrote instead of refreshing again.
+    """
+
+    def __init__(self, token_file: str = None, credentials_file: str = CREDENTIALS_FILE,
+                 api_endpoint: str = API_ENDPOINT, credentials: 'Credentials' = None, account: str = None):
+        self.account = account
+        self.token_file = token_file or token_path(account)
+        self.credentials_file = credentials_file
+        self.api_endpoint = api_endpoint
+        self._creds = credentials
+        self._creds_lock = threading.Lock()
+        self._discovery = None
+        self._discovery_lock = threading.Lock()
+        self._local = threading.local()
+
+    def _load_credentials(self) -> 'Credentials':
+        from google.oauth2.credentials import Credentials
+        creds = None
+        # The token file stores the user's access and refresh tokens, and is
+        # created automatically when the authorization flow completes for the
+        # first time.
+        if os.path.exists(self.token_file):
+            creds = Credentials.from_authorized_user_file(self.token_file, SCOPES)
+        if creds and creds.refresh_token:
+            return creds
+        if creds and creds.valid:
+            return creds
+        if self.account is not None:
+            # Named accounts are authorized with auth.py, never from a request
+            raise UnknownAccountError(
+                f"No usable token for account {self.account!r}; run: python src/auth.py --account {self.account}")
+
+        # No usable credentials available, let the user log in.
+        if not os.path.exists(self.credentials_file):
+            raise FileNotFoundError("credentials.json not found. Please download it from Google Cloud Console.")
+
+        from google_auth_oauthlib.flow import InstalledAppFlow
+        flow = InstalledAppFlow.from_client_secrets_file(self.credentials_file, SCOPES)
+        creds = flow.run_local_server(port=0)
+        self._save_credentials(creds)
+        return creds
+
+    def _save_credentials(self, creds: 'Credentials'):
+        write_token(self.token_file, creds.to_json())
+
+    def _read_stored_credentials(self) -> 'Credentials':
+        from google.oauth2.credentials import Credentials
+        try:
+            return Credentials.from_authorized_user_file(self.token_file, SCOPES)
+        except (OSError, ValueError):
+            return None
+
+    def _needs_refresh(self, creds: 'Credentials') -> bool:
+        if not creds.token:
+            return True
+        if creds.expiry is None:
+            return False
+        # google-auth keeps expiry as a naive UTC datetime.
+        return creds.expiry - timedelta(seconds=REFRESH_MARGIN_SECONDS) <= datetime.utcnow()
+
+    def get_credentials(self) -> 'Credentials':
+        """
+        Return in-memory credentials, refreshing them ahead of expiry.
+        """
+        creds = self._creds
+        if creds is not None and not self._needs_refresh(creds):
+            return creds
+
+        with self._creds_lock:
+            if self._creds is None:
+                self._creds = self._load_credentials()
+            creds = self._creds
+            if self._needs_refresh(creds) and creds.refresh_token:
+                with FileLock(self.token_file + LOCK_SUFFIX):
+                    # Another process may have refreshed while we waited
+                    stored = self._read_stored_credentials()
+                    if stored is not None and stored.refresh_token and not self._needs_refresh(stored):
+                        creds = self._creds = stored
+                        metrics.TOKEN_REFRESHES.inc(outcome='reused')
+                    else:
+                        from google.auth.transport.requests import Request
+                        creds.refresh(Request())
+                        self._save_credentials(creds)
+                        metrics.TOKEN_REFRESHES.inc(outcome='refreshed')
+            return creds
+
+    def _get_discovery(self) -> dict:
+        if self._discovery is None:
+            with self._discovery_lock:
+                if self._discovery is None:
+                    self._discovery = load_discovery_document()
+        return self._discovery
+
+    def _build_service(self, creds: 'Credentials'):
+        import httplib2
+        import google_auth_httplib2
+        from googleapiclient.discovery import build_from_document
+        http = google_auth_httplib2.AuthorizedHttp(
+            creds, http=httplib2.Http(timeout=HTTP_TIMEOUT_SECONDS))
+        # Every call, batches included, goes through the quota limiter and retries
+        http = RateLimitedHttp(http, get_rate_limiter(self.account))
+        client_options = {'api_endpoint': self.api_endpoint} if self.api_endpoint else None
+        return build_from_document(self._get_discovery(), http=http, client_options=client_options)
+
+    def get_service(self):
+        """
+        Return the calling thread's Gmail service, building it on first use.
+        """
+        creds = self.get_credentials()
+        service = getattr(self._local, 'service', None)
+        # Rebuilt when the pool switched to credentials another process refreshed;
+        # the old object would otherwise expire and refresh itself outside the lock
+        if service is None or self._local.creds is not creds:
+            service = self._build_service(creds)
+            self._local.service = service
+            self._local.creds = creds
+        return service
+
+    def reset(self):
+        """
+        Drop cached credentials and this thread's service (e.g. after re-authentication).
+        """
+        with self._creds_lock:
+            self._creds = None
+        self._local = threading.local()
+
+
+def execute_raw(request) -> bytes:
+    """
+    Send an HttpRequest like request.execute(), but return the response body
+    unparsed. Used for attachments.get, where decoding and parsing the JSON
+    would hold two more full-size copies of the attachment in memory.
+    Raises HttpError for error responses.
+    """
+    from googleapiclient.errors import HttpError
+    response, content = request.http.request(request.uri, method=request.method, body=request.body,
+                                             headers=request.headers)
+    if response.status >= 300:
+        raise HttpError(response, content, uri=request.uri)
+    return content
+
+
+def batch_uri() -> str:
+    """
+    Return Gmail's batch endpoint, honouring GMAIL_API_ENDPOINT.
+    """
+    root = API_ENDPOINT or 'https://gmail.googleapis.com/'
+    return root.rstrip('/') + '/batch/gmail/v1'
+
+
+def batch_execute(requests: list, chunk_size: int = None) -> list:
+    """
+    Execute Gmail API requests through the batch endpoint.
+
+    Args:
+        requests: HttpRequest objects (e.g. service.users().messages().get(...)).
+        chunk_size: Sub-requests per batch HTTP call (capped at 100).
+
+    Returns a list of (response, exception) tuples in the same order as
+    `requests`. A failing sub-request only sets its own exception; a failing
+    batch call sets the exception for every request in that chunk.
+    Sub-requests that were rate limited or hit a 5xx are re-sent in a new
+    batch with jittered backoff, up to GMAIL_MAX_RETRIES times.
+    """
+    from googleapiclient.http import BatchHttpRequest
+    chunk_size = max(1, min(chunk_size or BATCH_CHUNK_SIZE, MAX_BATCH_CHUNK_SIZE))
+    results = [(None, None)] * len(requests)
+
+    def callback(request_id, response, exception):
+        results[int(request_id)] = (response, exception)
+
+    pending = list(range(len(requests)))
+    # Whole-batch failures were already retried by the rate limiter
+    batch_failed = set()
+    for attempt in range(MAX_RETRIES + 1):
+        for start in range(0, len(pending), chunk_size):
+            chunk = pending[start:start + chunk_size]
+            batch = BatchHttpRequest(callback=callback, batch_uri=batch_uri())
+            for index in chunk:
+                batch.add(requests[index], request_id=str(index))
+            try:
+                batch.execute()
+            except Exception as e:
+                for index in chunk:
+                    results[index] = (None, e)
+                batch_failed.update(chunk)
+
+        pending = [index for index in pending
+                   if index not in batch_failed and _should_retry(results[index][1])]
+        if not pending or attempt == MAX_RETRIES:
+            break
+        get_rate_limiter(current_account()).record_throttle(len(pending))
+        time.sleep(backoff_delay(attempt))
+
+    return results
+
+
+def _should_retry(exception) -> bool:
+    resp = getattr(exception, 'resp', None)
+    return resp is not None and is_retryable(resp.status, getattr(exception, 'content', None))
+
+
+def batch_get_messages(service, message_ids: list, chunk_size: int = None, **get_kwargs) -> list:
+    """
+    Fetch many messages with users.messages.get through the batch endpoint.
+    Extra keyword arguments (format, metadataHeaders, ...) are passed to get().
+
+    Returns a list of (message, exception) tuples in the order of `message_ids`.
+    """
+    requests = [
+        service.users().messages().get(userId='me', id=message_id, **get_kwargs)
+        for message_id in message_ids
+    ]
+    return batch_execute(requests, chunk_size)
+
+
+def iter_message_ids(service, gmail_query: str, max_results: int, page_token: str = None):
+    """
+    Page through messages.list for a Gmail query, yielding (message IDs,
+    next_page_token) per page until max_results IDs have been listed.
+    """
+    remaining = max_results
+    while remaining > 0:
+        kwargs = {'userId': 'me', 'q': gmail_query, 'maxResults': min(remaining, MAX_LIST_PAGE_SIZE), **fields('list')}
+        if page_token:
+            kwargs['pageToken'] = page_token
+        results = service.users().messages().list(**kwargs).execute()
+        messages = results.get('messages', [])
+        page_token = results.get('nextPageToken')
+        remaining -= len(messages)
+        if not messages:
+            break
+        yield [m['id'] for m in messages], page_token
+        if not page_token:
+            break
+
+
+# account name (None: the single TOKEN_FILE account) -> GmailServicePool
+_pools = {}
+_pool_lock = threading.Lock()
+
+
+def get_service_pool(account: str = None) -> GmailServicePool:
+    """
+    Return the process-wide service pool of `account`, by default the
+    account the calling thread works on (see credential_store).
+    """
+    account = account or current_account()
+    pool = _pools.get(account)
+    if pool is None:
+        with _pool_lock:
+            pool = _pools.get(account)
+            if pool is None:
+                pool = _pools[account] = GmailServicePool(account=account)
+    return pool
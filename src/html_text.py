@@ -0,0 +1,313 @@
+import os
+import re
+import time
+import threading
+from html.parser import HTMLParser
+from message_cache import MemoryLRU
+import metrics
+
+# 'stream' is the single-pass extractor below; 'bs4' is the BeautifulSoup path.
+HTML_TEXT_BACKEND = os.environ.get("HTML_TEXT_BACKEND", "stream")
+HTML_TEXT_MEMO_BYTES = int(os.environ.get("HTML_TEXT_MEMO_BYTES", 16 * 1024 * 1024))
+# Cells wider than this are not padded, so one long cell does not push
+# every other row of the table off to the right.
+MAX_COLUMN_WIDTH = 60
+# Rows with a longer cell are treated as page layout rather than data.
+MAX_ROW_CELL = 100
+
+SKIPPED_TAGS = frozenset(['script', 'style', 'head', 'title', 'template', 'noscript', 'svg', 'object'])
+VOID_TAGS = frozenset(['area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta',
+                       'param', 'source', 'track', 'wbr'])
+BLOCK_TAGS = frozenset([
+    'address', 'article', 'aside', 'blockquote', 'br', 'center', 'dd', 'div', 'dl', 'dt', 'fieldset',
+    'figcaption', 'figure', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'li',
+    'main', 'nav', 'ol', 'p', 'pre', 'section', 'ul',
+])
+HIDDEN_STYLE = re.compile(r'display\s*:\s*none|visibility\s*:\s*hidden|mso-hide\s*:\s*all', re.I)
+WHITESPACE = re.compile(r'\s+')
+# Start tags that close an open <p>
+P_CLOSERS = frozenset([
+    'address', 'article', 'aside', 'blockquote', 'details', 'div', 'dl', 'fieldset', 'figcaption', 'figure',
+    'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hgroup', 'hr', 'main', 'menu', 'nav',
+    'ol', 'p', 'pre', 'section', 'table', 'ul',
+])
+TABLE_SECTIONS = frozenset(['thead', 'tbody', 'tfoot'])
+# Tags whose end tag is optional, as (start tags that close them, end tags
+# of parents that close them), following the HTML parsing rules.
+IMPLICIT_END = {
+    'p': (P_CLOSERS, (BLOCK_TAGS - {'p'}) | {'td', 'th', 'body', 'html', 'button'}),
+    'li': (frozenset(['li']), frozenset(['ul', 'ol', 'menu'])),
+    'dt': (frozenset(['dt', 'dd']), frozenset(['dl'])),
+    'dd': (frozenset(['dt', 'dd']), frozenset(['dl'])),
+    'option': (frozenset(['option', 'optgroup']), frozenset(['select', 'datalist', 'optgroup'])),
+    'optgroup': (frozenset(['optgroup']), frozenset(['select'])),
+    'tr': (frozenset(['tr']) | TABLE_SECTIONS, TABLE_SECTIONS | {'table'}),
+    'td': (frozenset(['td', 'th', 'tr']) | TABLE_SECTIONS, TABLE_SECTIONS | {'tr', 'table'}),
+    'th': (frozenset(['td', 'th', 'tr']) | TABLE_SECTIONS, TABLE_SECTIONS | {'tr', 'table'}),
+    'thead': (TABLE_SECTIONS, frozenset(['table'])),
+    'tbody': (TABLE_SECTIONS, frozenset(['table'])),
+    'tfoot': (TABLE_SECTIONS, frozenset(['table'])),
+    'rt': (frozenset(['rt', 'rp']), frozenset(['ruby'])),
+    'rp': (frozenset(['rt', 'rp']), frozenset(['ruby'])),
+}
+# A start tag never implicitly closes an element outside one of these
+SCOPE_TAGS = frozenset(['table', 'td', 'th', 'caption', 'ul', 'ol', 'dl', 'select', 'ruby', 'button', 'template'])
+
+
+class _Block:
+    """
+    Finished lines plus the fragments of the line being built.
+    """
+    __slots__ = ('lines', 'parts')
+
+    def __init__(self):
+        self.lines = []
+        self.parts = []
+
+    def break_line(self):
+        if self.parts:
+            line = ''.join(self.parts).strip()
+            self.parts = []
+            if line:
+                self.lines.append(line)
+
+    def finish(self) -> list:
+        self.break_line()
+        return self.lines
+
+
+class _Table:
+    __slots__ = ('rows', 'row', 'cell')
+
+    def __init__(self):
+        self.rows = []
+        self.row = None
+        self.cell = None
+
+
+def render_table(rows: list) -> list:
+    """
+    Lay out table rows (lists of cells, each a list of lines) as text lines.
+
+    Rows of short cells become one line with columns aligned across the
+    table, so receipt line items read as "Item  Qty  Price". Rows that are
+    page layout (a single cell, or cells holding whole paragraphs) just emit
+    their lines in reading order.
+    """
+    flat = []
+    for row in rows:
+        cells = [' / '.join(cell) for cell in row]
+        if (sum(1 for cell in cells if cell) >= 2
+                and all(len(cell) <= MAX_ROW_CELL and len(lines) <= 3 for cell, lines in zip(cells, row))):
+            flat.append(cells)
+        else:
+            flat.append(None)
+
+    aligned = [cells for cells in flat if cells is not None]
+    columns = max((len(cells) for cells in aligned), default=0)
+    # Spacer columns that are empty in every row are dropped
+    keep = [c for c in range(columns) if any(c < len(cells) and cells[c] for cells in aligned)]
+    widths = {c: min(max(len(cells[c]) for cells in aligned if c < len(cells)), MAX_COLUMN_WIDTH) for c in keep}
+
+    lines = []
+    for row, cells in zip(rows, flat):
+        if cells is None:
+            lines.extend(line for cell in row for line in cell)
+            continue
+        cells = [(cells[c] if c < len(cells) else '', widths[c]) for c in keep]
+        lines.append('  '.join(cell.ljust(width) for cell, width in cells).rstrip())
+    return lines
+
+
+class StreamingTextExtractor(HTMLParser):
+    """
+    Single-pass HTML-to-text converter on top of html.parser.
+
+    No tree is built: invisible subtrees (script/style/head, display:none,
+    hidden) are skipped as they stream past, text is accumulated as line
+    fragments, and only tables are buffered until they close so their rows
+    can be aligned.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._root = _Block()
+        self._blocks = [self._root]
+        self._tables = []
+        # Elements open inside the invisible subtree being skipped, its root first
+        self._skipping = []
+
+    def handle_starttag(self, tag, attrs):
+        if self._skipping:
+            self._close_implied_by(tag)
+            if self._skipping:
+                if tag not in VOID_TAGS:
+                    self._skipping.append(tag)
+                return
+        if tag in SKIPPED_TAGS or (tag not in VOID_TAGS and self._is_hidden(attrs)):
+            self._skipping = [tag]
+            if tag in ('td', 'th') and self._tables:
+                # Keep the column so the rest of the row stays aligned
+                table = self._tables[-1]
+                self._end_cell(table)
+                if table.row is None:
+                    table.row = []
+                table.row.append([])
+            return
+
+        if tag == 'table':
+            self._blocks[-1].break_line()
+            self._tables.append(_Table())
+        elif tag == 'tr' and self._tables:
+            self._end_row(self._tables[-1])
+            self._tables[-1].row = []
+        elif tag in ('td', 'th') and self._tables:
+            table = self._tables[-1]
+            self._end_cell(table)
+            if table.row is None:
+                table.row = []
+            table.cell = _Block()
+            self._blocks.append(table.cell)
+        elif tag in BLOCK_TAGS:
+            self._blocks[-1].break_line()
+            if tag == 'li':
+                self._blocks[-1].parts.append('- ')
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if self._skipping:
+            if tag in self._skipping:
+                # Also closes any elements still open inside it
+                del self._skipping[len(self._skipping) - 1 - self._skipping[::-1].index(tag):]
+                return
+            closers = IMPLICIT_END.get(self._skipping[0])
+            if not closers or tag not in closers[1]:
+                return
+            # The skipped element's parent ends, and with it the element
+            self._skipping = []
+
+        if tag == 'table' and self._tables:
+            table = self._tables.pop()
+            self._end_row(table)
+            block = self._blocks[-1]
+            block.break_line()
+            block.lines.extend(render_table(table.rows))
+        elif tag == 'tr' and self._tables:
+            self._end_row(self._tables[-1])
+        elif tag in ('td', 'th') and self._tables:
+            self._end_cell(self._tables[-1])
+        elif tag in BLOCK_TAGS:
+            self._blocks[-1].break_line()
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self._blocks[-1].parts.append(WHITESPACE.sub(' ', data))
+
+    def _close_implied_by(self, tag: str):
+        """
+        Pop the skipped elements that a `tag` start tag closes: the nearest
+        open one whose end tag it implies (a <p> for a <div>, an <li> for
+        the next <li>), with everything opened inside it.
+        """
+        for n in range(len(self._skipping) - 1, -1, -1):
+            open_tag = self._skipping[n]
+            closers = IMPLICIT_END.get(open_tag)
+            if closers and tag in closers[0]:
+                del self._skipping[n:]
+                return
+            if open_tag in SCOPE_TAGS:
+                return
+
+    def _end_cell(self, table: _Table):
+        if table.cell is not None:
+            self._blocks.pop()
+            table.row.append(table.cell.finish())
+            table.cell = None
+
+    def _end_row(self, table: _Table):
+        self._end_cell(table)
+        if table.row is not None:
+            table.rows.append(table.row)
+            table.row = None
+
+    @staticmethod
+    def _is_hidden(attrs) -> bool:
+        for name, value in attrs:
+            if name == 'hidden' or (name == 'style' and value and HIDDEN_STYLE.search(value)):
+                return True
+        return False
+
+    def text(self) -> str:
+        self.close()
+        # Unclosed tables still contribute their text
+        while self._tables:
+            self.handle_endtag('table')
+        return '\n'.join(self._root.finish())
+
+
+def stream_to_text(html_text: str) -> str:
+    extractor = StreamingTextExtractor()
+    extractor.feed(html_text)
+    return extractor.text()
+
+
+def bs4_to_text(html_text: str) -> str:
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html_text, 'html.parser')
+    # Remove script and style elements
+    for element in soup(['script', 'style', 'head']):
+        element.decompose()
+    return soup.get_text(separator='\n', strip=True)
+
+
+BACKENDS = {
+    'stream': stream_to_text,
+    'bs4': bs4_to_text,
+}
+
+_memo = MemoryLRU(HTML_TEXT_MEMO_BYTES)
+_memo_lock = threading.Lock()
+_memo_hits = 0
+_memo_misses = 0
+
+
+def html_to_text(html_text: str, backend: str = None, key: str = None) -> str:
+    """
+    Convert an HTML body to readable text with the chosen backend
+    (HTML_TEXT_BACKEND by default). Results are memoized under `key`,
+    normally the message ID, since a message's body never changes.
+    """
+    global _memo_hits, _memo_misses
+    backend = backend or HTML_TEXT_BACKEND
+    convert = BACKENDS.get(backend)
+    if convert is None:
+        raise ValueError(f"Unknown HTML text backend: {backend}")
+    if key is not None:
+        with _memo_lock:
+            text = _memo.get((key, backend))
+            if text is not None:
+                _memo_hits += 1
+                return text
+            _memo_misses += 1
+    start = time.perf_counter()
+    text = convert(html_text)
+    metrics.EXTRACTION.observe(time.perf_counter() - start, kind=f'html_{backend}')
+    if key is not None:
+        with _memo_lock:
+            _memo.put((key, backend), text, len(text) * 2)
+    return text
+
+
+def stats() -> dict:
+    with _memo_lock:
+        return {
+            'backend': HTML_TEXT_BACKEND,
+            'memo_entries': len(_memo),
+            'memo_bytes': _memo.bytes,
+            'memo_hits': _memo_hits,
+            'memo_misses': _memo_misses,
+        }
@@ -0,0 +1,257 @@
+"""
+Resumable export of the messages matching a Gmail query to a JSONL or mbox
+file, from format='raw' batch downloads.
+
+    python src/mail_export.py receipts.mbox --format mbox --sender swiggy --start-date 2024-01-01
+
+Progress is checkpointed to <file>.checkpoint.json after every batch, so
+running the same command again after an interruption continues where it
+stopped. Memory use is bounded by EXPORT_WORKERS batches in flight, not by
+the number of messages exported.
+"""
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from email.parser import BytesHeaderParser
+from email import policy
+from gmail_client import get_service_pool, batch_get_messages, iter_message_ids, fields
+import credential_store
+import metrics
+
+# Directory the export_emails tool writes into (the CLI takes any path).
+EXPORT_DIR = os.environ.get("GMAIL_EXPORT_DIR", "exports")
+# Gmail batches downloaded at the same time.
+EXPORT_WORKERS = int(os.environ.get("EXPORT_WORKERS", 4))
+# Messages per batch. Raw messages include their attachments, so this is
+# smaller than GMAIL_BATCH_SIZE; it bounds memory per worker.
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", 25))
+FORMATS = ('jsonl', 'mbox')
+CHECKPOINT_SUFFIX = '.checkpoint.json'
+# Failed message IDs kept in the checkpoint for the final report
+MAX_FAILED_IDS = 100
+
+
+class ExportMismatchError(ValueError):
+    """Raised when a checkpoint belongs to an export with other settings."""
+
+
+def checkpoint_path(path: str) -> str:
+    return path + CHECKPOINT_SUFFIX
+
+
+def load_checkpoint(path: str) -> dict:
+    try:
+        with open(checkpoint_path(path)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(path: str, state: dict):
+    # Written next to the output and renamed over the old one, so a crash
+    # leaves either the previous or the new checkpoint, never a torn one
+    tmp = checkpoint_path(path) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, checkpoint_path(path))
+
+
+def decode_raw(raw: str) -> bytes:
+    return base64.urlsafe_b64decode(raw + '=' * (-len(raw) % 4))
+
+
+def jsonl_record(msg: dict) -> bytes:
+    """
+    One JSON line: Gmail's IDs and labels, the main headers, and the
+    message source as Gmail returns it (base64url), so nothing is lost.
+    """
+    headers = BytesHeaderParser(policy=policy.default).parsebytes(decode_raw(msg['raw']))
+    record = {
+        'id': msg['id'],
+        'threadId': msg.get('threadId'),
+        'labelIds': msg.get('labelIds', []),
+        'internalDate': msg.get('internalDate'),
+        'from': str(headers.get('From', '')),
+        'to': str(headers.get('To', '')),
+        'subject': str(headers.get('Subject', '')),
+        'date': str(headers.get('Date', '')),
+        'raw': msg['raw'],
+    }
+    return json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n'
+
+
+def mbox_record(msg: dict) -> bytes:
+    """
+    One mboxrd entry, with Gmail's thread ID and labels as X-GM-THRID /
+    X-Gmail-Labels headers like a Google Takeout export.
+    """
+    source = decode_raw(msg['raw']).replace(b'\r\n', b'\n')
+    received = time.gmtime(int(msg.get('internalDate', 0)) / 1000)
+    lines = [f"From MAILER-DAEMON {time.strftime('%a %b %d %H:%M:%S %Y', received)}".encode('ascii'),
+             f"X-GM-THRID: {msg.get('threadId', '')}".encode('ascii'),
+             f"X-Gmail-Labels: {','.join(msg.get('labelIds', []))}".encode('utf-8')]
+    for line in source.split(b'\n'):
+        # mboxrd: quote From_ lines (and already-quoted ones) so readers do not split there
+        if line.lstrip(b'>').startswith(b'From '):
+            line = b'>' + line
+        lines.append(line)
+    if lines[-1] != b'':
+        lines.append(b'')
+    return b'\n'.join(lines) + b'\n'
+
+
+WRITERS = {
+    'jsonl': jsonl_record,
+    'mbox': mbox_record,
+}
+
+
+def fetch_raw_batch(message_ids: list) -> list:
+    service = get_service_pool().get_service()
+    return batch_get_messages(service, message_ids, chunk_size=len(message_ids), format='raw', **fields('raw'))
+
+
+def new_state(gmail_query: str, output_format: str, max_results: int) -> dict:
+    started = int(time.time())
+    return {
+        'query': gmail_query,
+        'format': output_format,
+        'max_results': max_results,
+        # Mail arriving during the export must not shift the result pages
+        'frozen_query': f"{gmail_query} before:{started}".strip(),
+        'started': started,
+        'page_token': None,
+        'page_offset': 0,
+        'bytes': 0,
+        'exported': 0,
+        'failed': 0,
+        'failed_ids': [],
+        'complete': False,
+    }
+
+
+def export_messages(path: str, gmail_query: str = "", output_format: str = 'jsonl', max_results: int = None,
+                    restart: bool = False, workers: int = None):
+    """
+    Export the messages matching `gmail_query` to `path`, newest first.
+    A generator: yields the checkpoint state after each batch is written
+    and after each result page (callers report progress from it), ending
+    with the final state.
+
+    An existing checkpoint for the same query and format is resumed: the
+    file is cut back to the last checkpointed size and listing restarts
+    from the saved page. `restart` discards it and starts over. A file
+    without a checkpoint is never overwritten unless `restart` is set.
+    """
+    if output_format not in WRITERS:
+        raise ValueError(f"Unknown export format {output_format!r}; use one of {', '.join(FORMATS)}")
+    state = None if restart else load_checkpoint(path)
+    if state is not None:
+        if (state['query'], state['format'], state['max_results']) != (gmail_query, output_format, max_results):
+            raise ExportMismatchError(
+                f"{checkpoint_path(path)} belongs to an export of {state['query']!r} as {state['format']}; "
+                f"pass restart to start a new export")
+        if state['complete']:
+            yield state
+            return
+    else:
+        if os.path.exists(path) and not restart:
+            raise FileExistsError(f"{path} already exists; pass restart to overwrite it")
+        state = new_state(gmail_query, output_format, max_results)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        open(path, 'wb').close()
+        save_checkpoint(path, state)
+
+    write_record = WRITERS[output_format]
+    workers = workers or EXPORT_WORKERS
+    service = get_service_pool().get_service()
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='export')
+    try:
+        with open(path, 'r+b') as out:
+            # Drop anything written after the last checkpoint
+            out.truncate(state['bytes'])
+            out.seek(state['bytes'])
+            # max_results counts from the start of the page being resumed
+            done_before_page = state['exported'] + state['failed'] - state['page_offset']
+            limit = (max_results or sys.maxsize) - done_before_page
+            for ids, next_page_token in iter_message_ids(service, state['frozen_query'], limit, state['page_token']):
+                ids = ids[state['page_offset']:]
+                pending = deque()
+                for start in range(0, len(ids), EXPORT_BATCH_SIZE):
+                    chunk = ids[start:start + EXPORT_BATCH_SIZE]
+                    pending.append((chunk, executor.submit(credential_store.propagate(metrics.propagate(fetch_raw_batch)), chunk)))
+                    # Batches are written in list order while later ones download
+                    while len(pending) > workers or (pending and start + EXPORT_BATCH_SIZE >= len(ids)):
+                        chunk, future = pending.popleft()
+                        write_batch(out, write_record, chunk, future.result(), state)
+                        save_checkpoint(path, state)
+                        yield state
+                done = not next_page_token or (max_results and state['exported'] + state['failed'] >= max_results)
+                state.update(page_token=next_page_token, page_offset=0, complete=bool(done))
+                save_checkpoint(path, state)
+                yield state
+        if not state['complete']:
+            state['complete'] = True
+            save_checkpoint(path, state)
+            yield state
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def write_batch(out, write_record, message_ids: list, results: list, state: dict):
+    """
+    Append one batch in list order, fsync, and advance the state to match.
+    """
+    for message_id, (msg, error) in zip(message_ids, results):
+        if error is not None or not msg or 'raw' not in msg:
+            state['failed'] += 1
+            if len(state['failed_ids']) < MAX_FAILED_IDS:
+                state['failed_ids'].append(message_id)
+            continue
+        out.write(write_record(msg))
+        state['exported'] += 1
+    out.flush()
+    os.fsync(out.fileno())
+    state['bytes'] = out.tell()
+    state['page_offset'] += len(message_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='Output file')
+    parser.add_argument('--format', choices=FORMATS, default='jsonl')
+    parser.add_argument('--query', default='', help='Gmail search query')
+    parser.add_argument('--sender')
+    parser.add_argument('--recipient')
+    parser.add_argument('--subject')
+    parser.add_argument('--start-date')
+    parser.add_argument('--end-date')
+    parser.add_argument('--max-results', type=int)
+    parser.add_argument('--workers', type=int, default=EXPORT_WORKERS)
+    parser.add_argument('--restart', action='store_true', help='Ignore any checkpoint and overwrite the file')
+    args = parser.parse_args()
+
+    from server import build_search_query
+    gmail_query, _, _ = build_search_query(args.query, args.sender, args.recipient, args.subject,
+                                           args.start_date, args.end_date)
+    try:
+        for state in export_messages(args.path, gmail_query, args.format, args.max_results, args.restart,
+                                     args.workers):
+            print(f"\r{state['exported']} exported, {state['failed']} failed, {state['bytes'] / 1e6:.1f} MB",
+                  end='', file=sys.stderr, flush=True)
+    except (FileExistsError, ExportMismatchError) as e:
+        sys.exit(str(e))
+    print(file=sys.stderr)
+    if state['failed_ids']:
+        print(f"Failed: {' '.join(state['failed_ids'])}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,303 @@
+"""
+Columnar in-memory index of message metadata (sender, date, labels, size,
+attachments) for group-by / count / top-N questions such as "which senders
+did I get the most receipts from this quarter", answered without Gmail.
+
+Rows come from the mailbox mirror (see mailbox_sync), which loads the index
+from its SQLite table once and keeps it current as it applies History API
+deltas.
+"""
+import time
+import bisect
+import threading
+from array import array
+from collections import Counter
+from datetime import datetime
+from email.utils import parseaddr
+from itertools import compress
+
+GROUPS = ('sender', 'domain', 'label', 'month', 'year')
+ORDERS = ('count', 'size')
+# Gmail search leaves these out unless asked for explicitly.
+HIDDEN_LABELS = ('SPAM', 'TRASH')
+
+# Per-row flags; a deleted row has none
+LIVE = 1
+HIDDEN = 2
+ATTACHMENT = 4
+# Deleted rows are dropped once they are this share of the index
+COMPACT_RATIO = 0.25
+
+
+def _selector(include_hidden: bool, has_attachment: bool = None) -> bytes:
+    """
+    bytes.translate() table turning a flags column into a 0/1 selector.
+    """
+    table = bytearray(256)
+    for flags in range(256):
+        if not flags & LIVE or (flags & HIDDEN and not include_hidden):
+            continue
+        if has_attachment is not None and bool(flags & ATTACHMENT) != has_attachment:
+            continue
+        table[flags] = 1
+    return bytes(table)
+
+
+def _and(a: bytes, b: bytes) -> bytes:
+    return (int.from_bytes(a, 'little') & int.from_bytes(b, 'little')).to_bytes(len(a), 'little')
+
+
+def _month_start(year: int, month: int) -> int:
+    return int(datetime(year + (month - 1) // 12, (month - 1) % 12 + 1, 1).timestamp() * 1000)
+
+
+class MailStats:
+    """
+    One row per message in flat arrays ordered by message date, so a date
+    range is a bisect and a query scans only the rows in range. Senders and
+    label sets are dictionary-encoded to small integers; filters become
+    0/1 selector bytes and grouping is done by Counter over the selected
+    codes, all in C loops.
+
+    Rows arriving out of date order, and deleted rows, are folded in by
+    rebuilding the arrays on the next query.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._rows = {}                 # message ID -> row
+        self._dates = array('q')        # internalDate (ms)
+        self._senders = array('I')      # index into _sender_names
+        self._label_sets = array('I')   # index into _label_set_names
+        self._sizes = array('Q')        # sizeEstimate (bytes)
+        self._flags = bytearray()       # LIVE | HIDDEN | ATTACHMENT
+        self._deleted = 0
+        self._sorted = True
+        self._sender_codes, self._sender_names = {}, []
+        self._from_codes = {}           # From header as sent -> sender code
+        self._label_set_codes, self._label_set_names = {}, []
+        self.rebuilds = 0
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    # -- updates -----------------------------------------------------------
+
+    def _sender_code(self, sender: str) -> int:
+        code = self._from_codes.get(sender)
+        if code is None:
+            code = self._from_codes[sender] = self._parse_sender(sender)
+        return code
+
+    def _parse_sender(self, sender: str) -> int:
+        name, address = parseaddr(sender or '')
+        address = address.lower() or (sender or '').strip().lower()
+        code = self._sender_codes.get(address)
+        if code is None:
+            code = self._sender_codes[address] = len(self._sender_names)
+            self._sender_names.append(f"{name} <{address}>" if name else address)
+        return code
+
+    def _label_set_code(self, label_ids) -> int:
+        key = tuple(sorted(label_ids))
+        code = self._label_set_codes.get(key)
+        if code is None:
+            code = self._label_set_codes[key] = len(self._label_set_names)
+            self._label_set_names.append(key)
+        return code
+
+    def _flags_for(self, label_set: int, has_attachment: bool) -> int:
+        hidden = any(label in HIDDEN_LABELS for label in self._label_set_names[label_set])
+        return LIVE | (HIDDEN if hidden else 0) | (ATTACHMENT if has_attachment else 0)
+
+    def _drop(self, message_id: str):
+        row = self._rows.pop(message_id, None)
+        if row is not None:
+            self._flags[row] = 0
+            self._deleted += 1
+
+    def add(self, rows):
+        """
+        Insert or replace messages given as (id, internal_date, sender,
+        label_ids, size_estimate, has_attachment) tuples.
+        """
+        with self._lock:
+            for message_id, internal_date, sender, label_ids, size, has_attachment in rows:
+                self._drop(message_id)
+                label_set = self._label_set_code(label_ids)
+                if self._dates and internal_date < self._dates[-1]:
+                    self._sorted = False
+                self._rows[message_id] = len(self._dates)
+                self._dates.append(internal_date)
+                self._senders.append(self._sender_code(sender))
+                self._label_sets.append(label_set)
+                self._sizes.append(size or 0)
+                self._flags.append(self._flags_for(label_set, has_attachment))
+
+    def remove(self, message_ids):
+        with self._lock:
+            for message_id in message_ids:
+                self._drop(message_id)
+
+    def relabel(self, message_id: str, label_ids):
+        with self._lock:
+            row = self._rows.get(message_id)
+            if row is not None:
+                label_set = self._label_set_code(label_ids)
+                self._label_sets[row] = label_set
+                self._flags[row] = self._flags_for(label_set, self._flags[row] & ATTACHMENT)
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    def _compact(self):
+        """
+        Rebuild the arrays in date order without deleted rows.
+        """
+        order = sorted(self._rows.values(), key=self._dates.__getitem__)
+        new_row = {row: n for n, row in enumerate(order)}
+        self._rows = {message_id: new_row[row] for message_id, row in self._rows.items()}
+        self._dates = array('q', map(self._dates.__getitem__, order))
+        self._senders = array('I', map(self._senders.__getitem__, order))
+        self._label_sets = array('I', map(self._label_sets.__getitem__, order))
+        self._sizes = array('Q', map(self._sizes.__getitem__, order))
+        self._flags = bytearray(map(self._flags.__getitem__, order))
+        self._deleted = 0
+        self._sorted = True
+        self.rebuilds += 1
+
+    # -- queries -----------------------------------------------------------
+
+    def query(self, group_by: str = 'sender', start: datetime = None, end: datetime = None, sender: str = None,
+              label: str = None, has_attachment: bool = None, order_by: str = 'count', top: int = 20) -> dict:
+        """
+        Count the messages matching the filters by `group_by`, largest groups
+        first. `sender` is a case-insensitive substring of "Name <address>",
+        `label` a label ID as Gmail spells it (SPAM and TRASH are left out
+        unless named).
+
+        Returns {'groups': [{'key', 'messages', 'bytes', 'latest'}], 'messages',
+        'bytes', 'distinct', 'scanned', 'elapsed_ms'}. Month and year groups
+        are the `top` most recent, newest first, each with its size. Sender,
+        domain and label groups have 'bytes' None unless order_by='size',
+        which needs a slower per-row pass.
+        """
+        if group_by not in GROUPS:
+            raise ValueError(f"Unknown group_by {group_by!r}; use one of {', '.join(GROUPS)}")
+        if order_by not in ORDERS:
+            raise ValueError(f"Unknown order_by {order_by!r}; use one of {', '.join(ORDERS)}")
+        began = time.perf_counter()
+        with self._lock:
+            if not self._sorted or self._deleted > COMPACT_RATIO * len(self._dates):
+                self._compact()
+            lo = bisect.bisect_left(self._dates, int(start.timestamp() * 1000)) if start else 0
+            hi = bisect.bisect_left(self._dates, int(end.timestamp() * 1000)) if end else len(self._dates)
+            hi = max(lo, hi)
+            # User label IDs (Label_12) are case-sensitive; only system labels are folded
+            if label and label.upper() in HIDDEN_LABELS:
+                label = label.upper()
+            mask = self._flags[lo:hi].translate(_selector(label in HIDDEN_LABELS, has_attachment))
+            if sender:
+                needle = sender.lower()
+                wanted = bytes(needle in name.lower() for name in self._sender_names)
+                mask = _and(mask, bytes(map(wanted.__getitem__, self._senders[lo:hi])))
+            if label:
+                wanted = bytes(label in names for names in self._label_set_names)
+                mask = _and(mask, bytes(map(wanted.__getitem__, self._label_sets[lo:hi])))
+            dates = self._dates[lo:hi]
+            sizes = self._sizes[lo:hi]
+            if group_by in ('month', 'year'):
+                groups = self._by_period(group_by, dates, sizes, mask)
+                distinct = len(groups)
+                groups = groups[::-1][:top]
+            else:
+                codes = (self._label_sets if group_by == 'label' else self._senders)[lo:hi]
+                groups = self._by_code(group_by, codes, sizes, mask, order_by == 'size')
+                distinct = len(groups)
+                if order_by == 'size':
+                    groups.sort(key=lambda g: (-g['bytes'], -g['messages'], g['key']))
+                else:
+                    groups.sort(key=lambda g: (-g['messages'], g['key']))
+                groups = groups[:top]
+                self._add_latest(groups, codes, dates, mask)
+            total = mask.count(1)
+            total_bytes = sum(compress(sizes, mask))
+        return {
+            'groups': groups,
+            'messages': total,
+            'bytes': total_bytes,
+            'distinct': distinct,
+            'scanned': hi - lo,
+            'elapsed_ms': (time.perf_counter() - began) * 1000,
+        }
+
+    def _by_code(self, group_by: str, codes, sizes, mask: bytes, with_bytes: bool) -> list:
+        counts = Counter(compress(codes, mask))
+        totals = None
+        if with_bytes:
+            totals = Counter()
+            for code, size in zip(compress(codes, mask), compress(sizes, mask)):
+                totals[code] += size
+        groups = {}
+        for code, count in counts.items():
+            if group_by == 'label':
+                # A message counts once under each of its labels
+                keys = self._label_set_names[code]
+            elif group_by == 'domain':
+                keys = [self._sender_names[code].rstrip('>').rsplit('@', 1)[-1]]
+            else:
+                keys = [self._sender_names[code]]
+            for key in keys:
+                group = groups.setdefault(key, {'key': key, 'messages': 0, 'bytes': 0 if with_bytes else None,
+                                                'latest': None, 'codes': []})
+                group['messages'] += count
+                group['codes'].append(code)
+                if with_bytes:
+                    group['bytes'] += totals[code]
+        return list(groups.values())
+
+    @staticmethod
+    def _add_latest(groups: list, codes, dates, mask: bytes):
+        """
+        Fill in each group's latest message date. Rows are in date order, so
+        scanning backwards from the end stops as soon as every code of the
+        returned groups has been seen once.
+        """
+        wanted = {code for group in groups for code in group['codes']}
+        latest = {}
+        for code, date in zip(compress(reversed(codes), reversed(mask)), compress(reversed(dates), reversed(mask))):
+            if code in wanted and code not in latest:
+                latest[code] = date
+                if len(latest) == len(wanted):
+                    break
+        for group in groups:
+            group['latest'] = max(latest[code] for code in group.pop('codes'))
+
+    def _by_period(self, group_by: str, dates, sizes, mask: bytes) -> list:
+        if not dates:
+            return []
+        first = datetime.fromtimestamp(dates[0] / 1000)
+        step = 12 if group_by == 'year' else 1
+        month = first.month if group_by == 'month' else 1
+        index = first.year * 12 + month - 1
+        groups = []
+        a = 0
+        while a < len(dates):
+            year, month = divmod(index + step, 12)
+            b = bisect.bisect_left(dates, _month_start(year, month + 1), a)
+            count = mask[a:b].count(1)
+            if count:
+                y, m = divmod(index, 12)
+                groups.append({
+                    'key': f"{y}" if group_by == 'year' else f"{y}-{m + 1:02d}",
+                    'messages': count,
+                    'bytes': sum(compress(sizes[a:b], mask[a:b])),
+                    'latest': dates[mask.rindex(1, a, b)],
+                })
+            a = b
+            index += step
+        return groups
@@ -0,0 +1,448 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from googleapiclient.errors import HttpError
+from gmail_client import get_service_pool, batch_get_messages, fields
+from message_cache import CACHE_DIR, CACHE_ENABLED
+from credential_store import DEFAULT_ACCOUNT, current_account, account_dir
+from mail_stats import MailStats, HIDDEN_LABELS
+
+logger = logging.getLogger(__name__)
+
+# Seconds between History API polls; 0 (or GMAIL_CACHE=0) disables the mirror entirely.
+SYNC_INTERVAL_SECONDS = int(os.environ.get("GMAIL_SYNC_INTERVAL", 0)) if CACHE_ENABLED else 0
+# Searches are only answered locally if the last successful sync is this recent.
+SYNC_MAX_LAG_SECONDS = int(os.environ.get("GMAIL_SYNC_MAX_LAG", 600))
+# Optional label ID to mirror (e.g. a "Receipts" label); empty mirrors the whole mailbox.
+SYNC_LABEL = os.environ.get("GMAIL_SYNC_LABEL", "")
+# Upper bound on messages pulled by the initial seed. Older mail stays on Gmail.
+SYNC_SEED_MAX = int(os.environ.get("GMAIL_SYNC_SEED_MAX", 20000))
+
+MIRROR_HEADERS = ['From', 'To', 'Subject', 'Date']
+HISTORY_TYPES = ['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved']
+# Columns added after the first release; a mirror without them is reseeded.
+LATER_COLUMNS = {'size_estimate': 'INTEGER', 'has_attachment': 'INTEGER'}
+
+
+def _header(headers: list, name: str, default: str = '') -> str:
+    return next((h['value'] for h in headers if h['name'] == name), default)
+
+
+def _has_attachment(msg: dict) -> bool:
+    # format='metadata' has no part tree; attachments make the top level multipart/mixed
+    return msg.get('payload', {}).get('mimeType', '').lower() == 'multipart/mixed'
+
+
+class MailboxMirror:
+    """
+    Local SQLite copy of message metadata, seeded once from messages.list and
+    kept current with users.history.list deltas. The same deltas keep a
+    MailStats index over the table current once it has been loaded.
+    """
+
+    def __init__(self, path: str, label: str = SYNC_LABEL, seed_max: int = SYNC_SEED_MAX,
+                 max_lag_seconds: int = SYNC_MAX_LAG_SECONDS):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.label = label
+        self.seed_max = seed_max
+        self.max_lag_seconds = max_lag_seconds
+        self.last_error = None
+        self.full_resyncs = 0
+        self._seeding = False
+        self._stats = None
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id TEXT PRIMARY KEY,
+                thread_id TEXT,
+                internal_date INTEGER NOT NULL,
+                sender TEXT,
+                recipient TEXT,
+                subject TEXT,
+                date TEXT,
+                snippet TEXT,
+                label_ids TEXT,
+                size_estimate INTEGER,
+                has_attachment INTEGER
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS messages_internal_date ON messages (internal_date)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)")
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(messages)")}
+        missing = [name for name in LATER_COLUMNS if name not in columns]
+        for name in missing:
+            self._conn.execute(f"ALTER TABLE messages ADD COLUMN {name} {LATER_COLUMNS[name]}")
+        if missing:
+            # Existing rows lack the new columns: rebuild on the next sync
+            self._conn.execute("DELETE FROM state WHERE key = 'history_id'")
+        self._conn.commit()
+        # Kept in memory too so status() never waits behind a sync
+        self._state = dict(self._conn.execute("SELECT key, value FROM state"))
+        self._message_count = self._count_messages()
+        last_sync = self._get_state('last_sync')
+        self._last_sync = float(last_sync) if last_sync else None
+        # One sync at a time; Gmail is called without holding _lock
+        self._sync_lock = threading.Lock()
+
+    # -- state -------------------------------------------------------------
+
+    def _get_state(self, key: str, default=None):
+        return self._state.get(key, default)
+
+    def _set_state(self, key: str, value):
+        self._conn.execute("INSERT OR REPLACE INTO state VALUES (?, ?)", (key, str(value)))
+        self._state[key] = str(value)
+
+    def _count_messages(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def _commit(self):
+        self._conn.commit()
+        self._message_count = self._count_messages()
+
+    def _rollback(self):
+        """
+        Drop a failed sync's uncommitted writes, and the index rows that
+        came with them.
+        """
+        with self._lock:
+            self._conn.rollback()
+            self._state = dict(self._conn.execute("SELECT key, value FROM state"))
+            self._message_count = self._count_messages()
+            self._stats = None
+
+    def _mark_synced(self):
+        self._last_sync = time.time()
+        self._set_state('last_sync', self._last_sync)
+
+    @property
+    def history_id(self):
+        return self._get_state('history_id')
+
+    def lag_seconds(self):
+        """
+        Seconds since the last successful sync, or None if never synced.
+        """
+        return time.time() - self._last_sync if self._last_sync else None
+
+    def is_fresh(self) -> bool:
+        lag = self.lag_seconds()
+        return lag is not None and lag <= self.max_lag_seconds
+
+    def status(self) -> dict:
+        """
+        Mirror state from memory, without the lock, so it answers during a
+        seed (GET /stats runs on the event loop).
+        """
+        lag = self.lag_seconds()
+        stats = self._stats
+        return {
+            'label': self.label or None,
+            'messages': self._message_count,
+            'history_id': self.history_id,
+            'lag_seconds': round(lag, 1) if lag is not None else None,
+            'fresh': self.is_fresh(),
+            'coverage_start': self._get_state('coverage_start', '0'),
+            'full_resyncs': self.full_resyncs,
+            'last_error': self.last_error,
+            'stats_rows': len(stats) if stats is not None else None,
+        }
+
+    # -- sync --------------------------------------------------------------
+
+    def _store(self, messages: list):
+        rows = []
+        for msg in messages:
+            headers = msg.get('payload', {}).get('headers', [])
+            rows.append((
+                msg['id'], msg.get('threadId'), int(msg.get('internalDate', 0)),
+                _header(headers, 'From'), _header(headers, 'To'), _header(headers, 'Subject'),
+                _header(headers, 'Date'), msg.get('snippet', ''), ','.join(msg.get('labelIds', [])),
+                int(msg.get('sizeEstimate', 0)), int(_has_attachment(msg)),
+            ))
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO messages (id, thread_id, internal_date, sender, recipient, subject, date, "
+            "snippet, label_ids, size_estimate, has_attachment) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        if self._stats is not None:
+            self._stats.add((r[0], r[2], r[3], r[8].split(',') if r[8] else [], r[9], r[10]) for r in rows)
+
+    def _delete(self, message_ids):
+        self._conn.executemany("DELETE FROM messages WHERE id = ?", [(i,) for i in message_ids])
+        if self._stats is not None:
+            self._stats.remove(message_ids)
+
+    def _fetch(self, service, message_ids: list) -> list:
+        """
+        Metadata of the given messages from Gmail. Called without the lock.
+        """
+        if not message_ids:
+            return []
+        results = batch_get_messages(service, message_ids, format='metadata', metadataHeaders=MIRROR_HEADERS,
+                                     **fields('mirror'))
+        fetched = []
+        for message_id, (msg, error) in zip(message_ids, results):
+            if error is None:
+                fetched.append(msg)
+            elif not (isinstance(error, HttpError) and error.resp.status == 404):
+                # Deleted in the meantime is fine; anything else must be retried.
+                raise error
+        return fetched
+
+    def seed(self, service):
+        """
+        Rebuild the mirror from scratch with messages.list. The lock is only
+        held to write each page; the rebuild is committed once at the end.
+        """
+        # Take the history ID first so changes made while we list are replayed later.
+        history_id = service.users().getProfile(userId='me').execute()['historyId']
+        with self._lock:
+            self._conn.execute("DELETE FROM messages")
+            if self._stats is not None:
+                self._stats.clear()
+        page_token = None
+        seeded = 0
+        truncated = False
+        while True:
+            kwargs = {'userId': 'me', 'maxResults': 500, **fields('list')}
+            if self.label:
+                kwargs['labelIds'] = [self.label]
+            if page_token:
+                kwargs['pageToken'] = page_token
+            results = service.users().messages().list(**kwargs).execute()
+            ids = [m['id'] for m in results.get('messages', [])][:self.seed_max - seeded]
+            fetched = self._fetch(service, ids)
+            with self._lock:
+                self._store(fetched)
+            seeded += len(ids)
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
+            if seeded >= self.seed_max:
+                truncated = True
+                break
+        with self._lock:
+            coverage_start = 0
+            if truncated:
+                coverage_start = self._conn.execute("SELECT MIN(internal_date) FROM messages").fetchone()[0] or 0
+            self._set_state('coverage_start', coverage_start)
+            self._set_state('history_id', history_id)
+            self._mark_synced()
+            self._commit()
+        logger.info("Mailbox mirror seeded with %d messages", seeded)
+
+    def apply_history(self, service):
+        """
+        Replay users.history.list from the stored history ID. Changes are
+        listed and fetched first, then written under the lock in one go.
+        Returns (messages added, deleted, relabeled); messages that gained the
+        sync label count as added. Raises HttpError 404 if that history ID
+        has expired.
+        """
+        added, deleted, relabeled = set(), set(), {}
+        page_token = None
+        start_history_id = latest_history_id = self.history_id
+        while True:
+            kwargs = {'userId': 'me', 'startHistoryId': start_history_id, 'historyTypes': HISTORY_TYPES}
+            if self.label:
+                kwargs['labelId'] = self.label
+            if page_token:
+                kwargs['pageToken'] = page_token
+            results = service.users().history().list(**kwargs).execute()
+            for record in results.get('history', []):
+                for item in record.get('messagesAdded', []):
+                    added.add(item['message']['id'])
+                    deleted.discard(item['message']['id'])
+                for item in record.get('messagesDeleted', []):
+                    deleted.add(item['message']['id'])
+                    added.discard(item['message']['id'])
+                for key in ('labelsAdded', 'labelsRemoved'):
+                    for item in record.get(key, []):
+                        relabeled[item['message']['id']] = item['message'].get('labelIds', [])
+            latest_history_id = results.get('historyId', latest_history_id)
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
+
+        # With a sync label, a message labelled after delivery only shows up in
+        # labelsAdded: it is not in the table yet and has to be fetched like a new one
+        joined = []
+        if self.label:
+            with self._lock:
+                joined = sorted(
+                    message_id for message_id, label_ids in relabeled.items()
+                    if self.label in label_ids and message_id not in added and message_id not in deleted
+                    and not self._conn.execute("SELECT 1 FROM messages WHERE id = ?", (message_id,)).fetchone())
+        fetched = self._fetch(service, sorted(added) + joined)
+        with self._lock:
+            self._store(fetched)
+            if deleted:
+                self._delete(deleted)
+            for message_id, label_ids in relabeled.items():
+                if message_id in added or message_id in deleted or message_id in joined:
+                    continue
+                if self.label and self.label not in label_ids:
+                    self._delete([message_id])
+                else:
+                    self._conn.execute("UPDATE messages SET label_ids = ? WHERE id = ?",
+                                       (','.join(label_ids), message_id))
+                    if self._stats is not None:
+                        self._stats.relabel(message_id, label_ids)
+            self._set_state('history_id', latest_history_id)
+            self._mark_synced()
+            self._commit()
+        return len(added) + len(joined), len(deleted), len(relabeled)
+
+    def sync(self, service=None):
+        """
+        Bring the mirror up to date: seed on first use, apply history deltas
+        afterwards, and fall back to a full resync if the history ID expired.
+        """
+        service = service or get_service_pool().get_service()
+        with self._sync_lock:
+            try:
+                if self.history_id is None:
+                    self._reseed(service)
+                else:
+                    try:
+                        self.apply_history(service)
+                    except HttpError as e:
+                        if e.resp.status != 404:
+                            raise
+                        logger.warning("History ID %s expired, running full resync", self.history_id)
+                        self.full_resyncs += 1
+                        self._reseed(service)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                self._rollback()
+                raise
+
+    def _reseed(self, service):
+        # Searches fall back to Gmail while the table is being rebuilt.
+        self._seeding = True
+        try:
+            self.seed(service)
+        finally:
+            self._seeding = False
+
+    # -- queries -----------------------------------------------------------
+
+    def answers(self, query: str, start: datetime = None) -> bool:
+        """
+        Whether a search with this free-text query and start date is fully
+        covered by the mirror.
+        """
+        if self._seeding or not self.is_fresh():
+            return False
+        coverage_start = int(self._get_state('coverage_start', '0'))
+        query = (query or '').strip().lower()
+        if query and not (self.label and query in (f"label:{self.label.lower()}", f"in:{self.label.lower()}")):
+            return False
+        if not query and self.label:
+            return False
+        if coverage_start and (start is None or start.timestamp() * 1000 < coverage_start):
+            return False
+        return True
+
+    def search(self, sender: str = None, recipient: str = None, subject: str = None,
+               start: datetime = None, end: datetime = None, max_results: int = 10, offset: int = 0) -> list:
+        """
+        Newest-first metadata rows matching the filters. Text filters are
+        case-insensitive substring matches, like Gmail's from:/to:/subject:.
+        """
+        clauses, params = [], []
+        for column, value in (('sender', sender), ('recipient', recipient), ('subject', subject)):
+            if value:
+                clauses.append(f"{column} LIKE ? ESCAPE '\\'")
+                escaped = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+                params.append(f"%{escaped}%")
+        if start:
+            clauses.append("internal_date >= ?")
+            params.append(int(start.timestamp() * 1000))
+        if end:
+            clauses.append("internal_date < ?")
+            params.append(int(end.timestamp() * 1000))
+        for label in HIDDEN_LABELS:
+            clauses.append("(',' || label_ids || ',') NOT LIKE ?")
+            params.append(f"%,{label},%")
+        where = " AND ".join(clauses) if clauses else "1"
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, date, sender, subject, snippet FROM messages WHERE {where} "
+                f"ORDER BY internal_date DESC, id DESC LIMIT ? OFFSET ?", params + [max_results, offset]).fetchall()
+        return [
+            {'id': r[0], 'date': r[1], 'sender': r[2], 'subject': r[3], 'snippet': r[4]}
+            for r in rows
+        ]
+
+
+    def stats(self) -> MailStats:
+        """
+        The MailStats index over the mirrored messages, loaded from the table
+        on first use and updated by every sync after that.
+        """
+        with self._lock:
+            if self._stats is None:
+                stats = MailStats()
+                rows = self._conn.execute(
+                    "SELECT id, internal_date, sender, label_ids, size_estimate, has_attachment FROM messages "
+                    "ORDER BY internal_date")
+                stats.add((r[0], r[1], r[2], r[3].split(',') if r[3] else [], r[4], r[5]) for r in rows)
+                self._stats = stats
+            return self._stats
+
+    def is_seeded(self) -> bool:
+        return self.history_id is not None and not self._seeding
+
+
+class SyncLoop:
+    """
+    Background thread that calls MailboxMirror.sync() every `interval` seconds.
+    """
+
+    def __init__(self, mirror: MailboxMirror, interval: int):
+        self.mirror = mirror
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="gmail-sync", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.mirror.sync()
+            except Exception:
+                logger.exception("Mailbox sync failed")
+            self._stop.wait(self.interval)
+
+    def stop(self):
+        self._stop.set()
+
+
+_mirror = None
+_mirror_lock = threading.Lock()
+
+
+def get_mailbox_mirror():
+    """
+    Return the process-wide mailbox mirror, or None if GMAIL_SYNC_INTERVAL or GMAIL_CACHE is 0.
+    Only the default account (GMAIL_ACCOUNT) is mirrored; requests for other
+    accounts get None and go to Gmail.
+    """
+    global _mirror
+    if not SYNC_INTERVAL_SECONDS or current_account() != DEFAULT_ACCOUNT:
+        return None
+    if _mirror is None:
+        with _mirror_lock:
+            if _mirror is None:
+                _mirror = MailboxMirror(os.path.join(account_dir(CACHE_DIR, DEFAULT_ACCOUNT), 'mirror.sqlite3'))
+    return _mirror
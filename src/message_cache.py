@@ -0,0 +1,272 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from credential_store import current_account, account_dir
+
+# Gmail messages are immutable once delivered, so a fetched payload can be
+# reused for as long as we care to keep it. GMAIL_CACHE=0 also turns off every
+# other on-disk store (text index, attachment store, PDF text cache, mirror).
+CACHE_ENABLED = os.environ.get("GMAIL_CACHE", "1") != "0"
+CACHE_DIR = os.environ.get("GMAIL_CACHE_DIR", ".cache")
+MEMORY_CACHE_BYTES = int(os.environ.get("GMAIL_CACHE_MEMORY_BYTES", 64 * 1024 * 1024))
+DISK_CACHE_BYTES = int(os.environ.get("GMAIL_CACHE_DISK_BYTES", 512 * 1024 * 1024))
+# 'lru' evicts the least recently read entries first, 'fifo' the oldest stored.
+DISK_EVICTION_POLICY = os.environ.get("GMAIL_CACHE_EVICTION", "lru")
+# Entries older than this are dropped from disk regardless of size (0 = keep forever).
+DISK_MAX_AGE_SECONDS = int(os.environ.get("GMAIL_CACHE_MAX_AGE_DAYS", 30)) * 86400
+# With 'lru', read times are written back in batches of this many entries, or
+# after this many seconds, instead of one write per disk hit.
+ACCESS_FLUSH_ROWS = 256
+ACCESS_FLUSH_SECONDS = 30
+
+# Slots: 'full' holds format='full' messages, 'metadata' holds format='metadata'
+# responses from search_emails, and 'structure' holds the MIME part tree
+# without body data. A lookup falls back to richer slots that can answer it.
+SLOTS = ('full', 'metadata', 'structure')
+FALLBACK_SLOTS = {
+    'full': (),
+    'metadata': ('full', 'structure'),
+    'structure': ('full',),
+}
+
+
+class MemoryLRU:
+    """
+    In-memory LRU of decoded messages, bounded by their serialized size.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value, size: int):
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.bytes -= old[1]
+        self._entries[key] = (value, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskCache:
+    """
+    SQLite-backed message store that survives restarts.
+    """
+
+    def __init__(self, path: str, max_bytes: int, eviction: str = DISK_EVICTION_POLICY,
+                 max_age_seconds: int = DISK_MAX_AGE_SECONDS):
+        if eviction not in ('lru', 'fifo'):
+            raise ValueError(f"Unknown cache eviction policy: {eviction}")
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.eviction = eviction
+        self.max_age_seconds = max_age_seconds
+        self.evictions = 0
+        # (message_id, slot) -> last read time not yet written to disk
+        self._pending_access = {}
+        self._flushed_at = time.monotonic()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                message_id TEXT NOT NULL,
+                slot TEXT NOT NULL,
+                data BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (message_id, slot)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS messages_last_access ON messages (last_access)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS messages_created_at ON messages (created_at)")
+        self._conn.commit()
+        self.bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM messages").fetchone()[0]
+        self.expire()
+
+    def get(self, message_id: str, slot: str):
+        row = self._conn.execute(
+            "SELECT data FROM messages WHERE message_id = ? AND slot = ?", (message_id, slot)).fetchone()
+        if row is None:
+            return None
+        if self.eviction == 'lru':
+            self._pending_access[(message_id, slot)] = time.time()
+            if (len(self._pending_access) >= ACCESS_FLUSH_ROWS
+                    or time.monotonic() - self._flushed_at >= ACCESS_FLUSH_SECONDS):
+                self._write_access()
+                self._conn.commit()
+        return row[0]
+
+    def _write_access(self):
+        """
+        Write the batched read times; the caller commits.
+        """
+        if self._pending_access:
+            self._conn.executemany(
+                "UPDATE messages SET last_access = ? WHERE message_id = ? AND slot = ?",
+                [(at, message_id, slot) for (message_id, slot), at in self._pending_access.items()])
+            self._pending_access.clear()
+        self._flushed_at = time.monotonic()
+
+    def put(self, message_id: str, slot: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        now = time.time()
+        old = self._conn.execute(
+            "SELECT size FROM messages WHERE message_id = ? AND slot = ?", (message_id, slot)).fetchone()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?)",
+            (message_id, slot, data, len(data), now, now))
+        self._pending_access.pop((message_id, slot), None)
+        self.bytes += len(data) - (old[0] if old else 0)
+        if self.bytes > self.max_bytes:
+            self._evict()
+        self._conn.commit()
+
+    def _evict(self):
+        # Recent reads must count before choosing what to drop
+        self._write_access()
+        order_column = 'last_access' if self.eviction == 'lru' else 'created_at'
+        # Evict down to 90% so we don't run eviction on every subsequent insert.
+        target = self.max_bytes * 0.9
+        rows = self._conn.execute(
+            f"SELECT message_id, slot, size FROM messages ORDER BY {order_column}").fetchall()
+        for message_id, slot, size in rows:
+            if self.bytes <= target:
+                break
+            self._conn.execute("DELETE FROM messages WHERE message_id = ? AND slot = ?", (message_id, slot))
+            self.bytes -= size
+            self.evictions += 1
+
+    def expire(self):
+        """
+        Drop entries older than the configured maximum age.
+        """
+        if not self.max_age_seconds:
+            return
+        cutoff = time.time() - self.max_age_seconds
+        row = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM messages WHERE created_at < ?", (cutoff,)).fetchone()
+        if row[0]:
+            self._conn.execute("DELETE FROM messages WHERE created_at < ?", (cutoff,))
+            self._conn.commit()
+            self.bytes -= row[1]
+            self.evictions += row[0]
+
+    def count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+
+class MessageCache:
+    """
+    Two-tier cache of Gmail API message resources keyed by (message ID, slot).
+
+    Lookups go memory -> disk; disk hits are promoted into memory. All methods
+    are thread-safe.
+    """
+
+    def __init__(self, memory_bytes: int = MEMORY_CACHE_BYTES, disk_path: str = None,
+                 disk_bytes: int = DISK_CACHE_BYTES):
+        self.memory = MemoryLRU(memory_bytes)
+        self.disk = DiskCache(disk_path, disk_bytes) if disk_path else None
+        self._lock = threading.Lock()
+        self.hits = {'memory': 0, 'disk': 0}
+        self.misses = 0
+
+    def _lookup(self, message_id: str, slot: str):
+        key = (message_id, slot)
+        msg = self.memory.get(key)
+        if msg is not None:
+            self.hits['memory'] += 1
+            return msg
+        if self.disk is not None:
+            data = self.disk.get(message_id, slot)
+            if data is not None:
+                self.hits['disk'] += 1
+                msg = json.loads(data)
+                self.memory.put(key, msg, len(data))
+                return msg
+        return None
+
+    def get(self, message_id: str, slot: str = 'full'):
+        """
+        Return the cached message for this slot, or None. Callers must treat
+        the returned dict as read-only.
+        """
+        with self._lock:
+            msg = self._lookup(message_id, slot)
+            for fallback in FALLBACK_SLOTS[slot]:
+                if msg is not None:
+                    break
+                msg = self._lookup(message_id, fallback)
+            if msg is None:
+                self.misses += 1
+            return msg
+
+    def put(self, message_id: str, msg: dict, slot: str = 'full'):
+        if slot not in SLOTS:
+            raise ValueError(f"Unknown cache slot: {slot}")
+        data = json.dumps(msg, separators=(',', ':')).encode('utf-8')
+        with self._lock:
+            self.memory.put((message_id, slot), msg, len(data))
+            if self.disk is not None:
+                self.disk.put(message_id, slot, data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits['memory'] + self.hits['disk'] + self.misses
+            return {
+                'hits_memory': self.hits['memory'],
+                'hits_disk': self.hits['disk'],
+                'misses': self.misses,
+                'hit_ratio': round((lookups - self.misses) / lookups, 4) if lookups else 0.0,
+                'memory_entries': len(self.memory),
+                'memory_bytes': self.memory.bytes,
+                'memory_evictions': self.memory.evictions,
+                'disk_entries': self.disk.count() if self.disk else 0,
+                'disk_bytes': self.disk.bytes if self.disk else 0,
+                'disk_evictions': self.disk.evictions if self.disk else 0,
+            }
+
+
+# account name -> MessageCache; message IDs are only unique within a mailbox
+_caches = {}
+_cache_lock = threading.Lock()
+
+
+def get_message_cache():
+    """
+    Return the current account's message cache, or None if GMAIL_CACHE=0.
+    """
+    if not CACHE_ENABLED:
+        return None
+    account = current_account()
+    cache = _caches.get(account)
+    if cache is None:
+        with _cache_lock:
+            cache = _caches.get(account)
+            if cache is None:
+                cache = _caches[account] = MessageCache(
+                    disk_path=os.path.join(account_dir(CACHE_DIR, account), 'messages.sqlite3'))
+    return cache
@@ -0,0 +1,262 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+# Per-call phase timing (auth / list / fetch / decode / extract). Off by
+# default; when on, each tool call logs its breakdown and feeds
+# mcp_tool_phase_seconds.
+SPANS_ENABLED = os.environ.get("METRICS_SPANS", "0") != "0"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+logger = logging.getLogger(__name__)
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def samples(self) -> list:
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for name, key, value in self.samples():
+            lines.append(f"{name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += 1
+            entry[2] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = [(key, (list(e[0]), e[1], e[2])) for key, e in self._values.items()]
+        for key, (counts, count, total) in items:
+            for bound, bucket_count in zip(self.buckets, counts):
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+        return lines
+
+
+REGISTRY = []
+# Callables run at scrape time returning [(name, type, help, [(labels dict, value)])]
+COLLECTORS = []
+
+TOOL_DURATION = Histogram('mcp_tool_duration_seconds', 'Tool call latency, including queueing.', ('tool', 'status'))
+TOOLS_IN_FLIGHT = Gauge('mcp_tools_in_flight', 'Tool calls queued or running.', ('tool',))
+REQUESTS_IN_FLIGHT = Gauge('mcp_http_requests_in_flight', 'HTTP requests being handled.')
+TOOL_PHASE = Histogram('mcp_tool_phase_seconds', 'Time per phase of a tool call (METRICS_SPANS=1).', ('tool', 'phase'))
+GMAIL_CALLS = Counter('gmail_api_calls_total', 'Gmail HTTP calls (batches count once).', ('method', 'status'))
+GMAIL_DURATION = Histogram('gmail_api_call_duration_seconds', 'Gmail HTTP call latency.', ('method',))
+GMAIL_BYTES = Counter('gmail_api_response_bytes_total', 'Bytes downloaded from Gmail.', ('method',))
+TOOL_GMAIL_BYTES = Counter('mcp_tool_gmail_response_bytes_total', 'Bytes downloaded from Gmail, by the tool that asked.',
+                           ('tool',))
+EXTRACTION = Histogram('text_extraction_seconds', 'Time to turn an HTML body or PDF into text.', ('kind',))
+PDF_PAGES = Counter('pdf_pages_extracted_total', 'PDF pages returned, by source.', ('source',))
+TOKEN_REFRESHES = Counter('gmail_token_refreshes_total',
+                          'Expiring OAuth tokens refreshed here, or reused after another process refreshed them.',
+                          ('outcome',))
+
+
+def register_collector(fn):
+    COLLECTORS.append(fn)
+    return fn
+
+
+def render() -> str:
+    """
+    All metrics in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    for collect in COLLECTORS:
+        try:
+            families = collect()
+        except Exception as e:
+            logger.warning("metrics collector %s failed: %s", getattr(collect, '__name__', collect), e)
+            continue
+        for name, kind, help, samples in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                lines.append(f"{name}{{{label_text}}} {_format_value(value)}" if label_text
+                             else f"{name} {_format_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+_trace = threading.local()
+
+
+def current_tool() -> str:
+    """
+    Name of the tool call running on this thread, or None outside of one.
+    """
+    return getattr(_trace, 'tool', None)
+
+
+@contextmanager
+def span(phase: str):
+    """
+    Time a phase of the current tool call. A no-op unless METRICS_SPANS=1
+    and the call runs under traced().
+    """
+    phases = getattr(_trace, 'phases', None)
+    if phases is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases[phase] = phases.get(phase, 0.0) + time.perf_counter() - start
+
+
+@contextmanager
+def trace(tool_name: str):
+    """
+    Collect span() timings for one tool call on this thread, then record
+    and log them.
+    """
+    if not SPANS_ENABLED or getattr(_trace, 'phases', None) is not None:
+        yield
+        return
+    _trace.phases = phases = {}
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _trace.phases = None
+        total = time.perf_counter() - start
+        for phase, seconds in phases.items():
+            TOOL_PHASE.observe(seconds, tool=tool_name, phase=phase)
+        TOOL_PHASE.observe(max(0.0, total - sum(phases.values())), tool=tool_name, phase='other')
+        logger.info("span tool=%s total=%.3fs %s", tool_name, total,
+                    ' '.join(f"{phase}={seconds:.3f}s" for phase, seconds in phases.items()))
+
+
+@contextmanager
+def _tool_context(tool_name: str):
+    outer = getattr(_trace, 'tool', None)
+    _trace.tool = tool_name
+    try:
+        with trace(tool_name):
+            yield
+    finally:
+        _trace.tool = outer
+
+
+def traced(tool_name: str, fn):
+    """
+    Wrap a tool function so the thread that runs it knows the tool's name
+    (see current_tool()) and, with METRICS_SPANS=1, traces the call.
+    """
+    def call(**arguments):
+        with _tool_context(tool_name):
+            return fn(**arguments)
+    return call
+
+
+def traced_generator(tool_name: str, gen_fn):
+    """
+    Like traced(), for the generator functions behind streaming tools.
+    """
+    def generate(**arguments):
+        with _tool_context(tool_name):
+            yield from gen_fn(**arguments)
+    return generate
+
+
+def propagate(fn):
+    """
+    Wrap fn so that, run on another thread (a worker pool inside a tool
+    call), it still reports the calling thread's current_tool().
+    """
+    tool = current_tool()
+
+    def call(*args, **kwargs):
+        outer = getattr(_trace, 'tool', None)
+        _trace.tool = tool
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _trace.tool = outer
+    return call
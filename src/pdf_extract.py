@@ -0,0 +1,343 @@
+import os
+import io
+import time
+import sqlite3
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from message_cache import CACHE_DIR, CACHE_ENABLED
+from credential_store import current_account, account_dir
+from single_flight import SingleFlight
+import metrics
+
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", min(4, os.cpu_count() or 1)))
+# Pages handed to one worker task; small documents are extracted inline
+# because starting a task costs more than parsing a page or two.
+PDF_PAGES_PER_TASK = int(os.environ.get("PDF_PAGES_PER_TASK", 4))
+PDF_INLINE_PAGES = int(os.environ.get("PDF_INLINE_PAGES", 2))
+# Per-document budget: stop after this many pages or seconds.
+PDF_MAX_PAGES = int(os.environ.get("PDF_MAX_PAGES", 200))
+PDF_TIME_BUDGET_SECONDS = float(os.environ.get("PDF_TIME_BUDGET", 30))
+PDF_TEXT_CACHE_ENABLED = CACHE_ENABLED and os.environ.get("PDF_TEXT_CACHE", "1") != "0"
+
+# Concurrent reads of the same PDF share extraction work, keyed by
+# (content hash, password state, pages).
+pdf_flights = SingleFlight('pdf_pages')
+
+
+def parse_page_ranges(pages: str, page_count: int) -> list:
+    """
+    Turn a page selection like "1-3,7,10-" into sorted 1-based page numbers
+    within the document. None or "" selects every page.
+    """
+    if not pages:
+        return list(range(1, page_count + 1))
+    selected = set()
+    for part in pages.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            start, _, end = part.partition('-')
+            start = int(start) if start.strip() else 1
+            end = int(end) if end.strip() else page_count
+        else:
+            start = end = int(part)
+        if start < 1 or end < start:
+            raise ValueError(f"Invalid page range: {part}")
+        selected.update(range(start, min(end, page_count) + 1))
+    return sorted(selected)
+
+
+def _open(source, password: str = None):
+    # `source` is the PDF's bytes or the path of a file holding them
+    import pdfplumber
+    return pdfplumber.open(io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source, password=password)
+
+
+def source_sha256(source) -> str:
+    digest = hashlib.sha256()
+    if isinstance(source, (bytes, bytearray)):
+        digest.update(source)
+    else:
+        with open(source, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def count_pages(source, password: str = None) -> int:
+    """
+    Open the PDF (bytes or a file path) and return its page count.
+    Raises on wrong/missing passwords.
+    """
+    with _open(source, password) as pdf:
+        return len(pdf.pages)
+
+
+def extract_pages(source, password: str, page_numbers: list) -> list:
+    """
+    Extract text from the given 1-based pages. Returns [(page_number, text)].
+    Runs in worker processes, so it must stay a picklable top-level function;
+    passing a file path rather than bytes saves pickling the PDF per task.
+    """
+    results = []
+    with _open(source, password) as pdf:
+        for number in page_numbers:
+            results.append((number, pdf.pages[number - 1].extract_text() or ''))
+    return results
+
+
+def password_state(password: str) -> str:
+    """
+    Cache-key component for a password without storing the password itself.
+    """
+    if not password:
+        return 'none'
+    return hashlib.sha256(password.encode('utf-8')).hexdigest()[:16]
+
+
+class PdfTextCache:
+    """
+    SQLite cache of extracted page text keyed by (PDF SHA-256, password state, page).
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                sha256 TEXT NOT NULL,
+                password_state TEXT NOT NULL,
+                page INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                PRIMARY KEY (sha256, password_state, page)
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                sha256 TEXT NOT NULL,
+                password_state TEXT NOT NULL,
+                page_count INTEGER NOT NULL,
+                PRIMARY KEY (sha256, password_state)
+            )
+        """)
+        self._conn.commit()
+
+    def page_count(self, sha256: str, state: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT page_count FROM documents WHERE sha256 = ? AND password_state = ?", (sha256, state)).fetchone()
+            return row[0] if row else None
+
+    def set_page_count(self, sha256: str, state: str, page_count: int):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO documents VALUES (?, ?, ?)", (sha256, state, page_count))
+            self._conn.commit()
+
+    def get_pages(self, sha256: str, state: str, page_numbers: list) -> dict:
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT page, text FROM pages WHERE sha256 = ? AND password_state = ? "
+                f"AND page IN ({','.join('?' * len(page_numbers))})",
+                [sha256, state] + list(page_numbers)).fetchall() if page_numbers else []
+            found = dict(rows)
+            self.hits += len(found)
+            self.misses += len(page_numbers) - len(found)
+            return found
+
+    def put_pages(self, sha256: str, state: str, pages: list):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)",
+                [(sha256, state, number, text) for number, text in pages])
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'page_hits': self.hits, 'page_misses': self.misses}
+
+
+class PdfExtractor:
+    """
+    Extracts PDF text across a process pool, in page chunks, with a per-document
+    page/time budget and a persistent per-page text cache.
+
+    `cache` is a PdfTextCache, or a function returning the one to use for
+    the calling request (the process-wide extractor keeps one per account).
+    """
+
+    def __init__(self, workers: int = PDF_WORKERS, cache=None):
+        self.workers = workers
+        self.cache = cache
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def iter_pages(self, data, password: str = None, pages: str = None,
+                   max_pages: int = PDF_MAX_PAGES, time_budget: float = PDF_TIME_BUDGET_SECONDS,
+                   sha256: str = None):
+        """
+        Yield (page_number, text) in page order as soon as each page is
+        available. Cached pages come first without touching the pool.
+
+        `data` is the PDF's bytes or the path of a file holding them; pass
+        `sha256` if the content hash is already known.
+
+        The generator's return value (StopIteration.value) is a dict with
+        page_count, selected page numbers and whether the budget truncated it.
+        """
+        started = time.perf_counter()
+        sha256 = sha256 or source_sha256(data)
+        state = password_state(password)
+        cache = self.cache() if callable(self.cache) else self.cache
+        page_count = cache.page_count(sha256, state) if cache else None
+        if page_count is None:
+            page_count = count_pages(data, password)
+            if cache:
+                cache.set_page_count(sha256, state, page_count)
+
+        selected = parse_page_ranges(pages, page_count)
+        truncated = len(selected) > max_pages
+        selected = selected[:max_pages]
+
+        done = cache.get_pages(sha256, state, selected) if cache else {}
+        todo = [n for n in selected if n not in done]
+        cached = len(done)
+        metrics.PDF_PAGES.inc(cached, source='cache')
+        order = iter(selected)
+        next_page = next(order, None)
+
+        def drain():
+            # Emit every page that is ready, in order
+            nonlocal next_page
+            while next_page is not None and next_page in done:
+                yield next_page, done[next_page]
+                next_page = next(order, None)
+
+        yield from drain()
+
+        if todo and len(todo) <= PDF_INLINE_PAGES:
+            extracted = pdf_flights.do((sha256, state, tuple(todo)), extract_pages, data, password, todo)
+            done.update(extracted)
+            if cache:
+                cache.put_pages(sha256, state, extracted)
+            todo = []
+            yield from drain()
+
+        if todo:
+            deadline = time.monotonic() + time_budget
+            executor = self._get_executor()
+            keys = {}
+            for i in range(0, len(todo), PDF_PAGES_PER_TASK):
+                chunk = todo[i:i + PDF_PAGES_PER_TASK]
+                key = (sha256, state, tuple(chunk))
+                future = pdf_flights.acquire_future(
+                    key, lambda chunk=chunk: executor.submit(extract_pages, data, password, chunk))
+                keys[future] = key
+            futures = set(keys)
+            try:
+                while futures:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        truncated = True
+                        break
+                    finished, futures = wait(futures, timeout=remaining, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        extracted = future.result()
+                        done.update(extracted)
+                        if cache:
+                            cache.put_pages(sha256, state, extracted)
+                    yield from drain()
+            finally:
+                # Leave chunks running that another reader of this PDF still waits on
+                for future, key in keys.items():
+                    if pdf_flights.release_future(key) and not future.done():
+                        future.cancel()
+
+        metrics.PDF_PAGES.inc(len(done) - cached, source='extracted')
+        metrics.EXTRACTION.observe(time.perf_counter() - started, kind='pdf')
+        return {
+            'page_count': page_count,
+            'selected': selected,
+            'truncated': truncated or next_page is not None,
+        }
+
+    def extract(self, data, password: str = None, pages: str = None, **budget) -> tuple:
+        """
+        Collect iter_pages() into ([(page_number, text)], info).
+        """
+        iterator = self.iter_pages(data, password, pages, **budget)
+        results = []
+        while True:
+            try:
+                results.append(next(iterator))
+            except StopIteration as stop:
+                return results, stop.value
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# account name -> PdfTextCache; extracted text is as private as the mailbox it came from
+_caches = {}
+_cache_lock = threading.Lock()
+_extractor = None
+_extractor_lock = threading.Lock()
+
+
+def get_pdf_text_cache():
+    """
+    Return the current account's PDF text cache, or None if PDF_TEXT_CACHE or GMAIL_CACHE is 0.
+    """
+    if not PDF_TEXT_CACHE_ENABLED:
+        return None
+    account = current_account()
+    cache = _caches.get(account)
+    if cache is None:
+        with _cache_lock:
+            cache = _caches.get(account)
+            if cache is None:
+                cache = _caches[account] = PdfTextCache(os.path.join(account_dir(CACHE_DIR, account), 'pdf_text.sqlite3'))
+    return cache
+
+
+def get_pdf_extractor() -> PdfExtractor:
+    """
+    Return the process-wide PDF extractor. Its worker processes are shared by
+    all accounts; each account's extracted text is cached separately.
+    """
+    global _extractor
+    if _extractor is None:
+        with _extractor_lock:
+            if _extractor is None:
+                _extractor = PdfExtractor(cache=get_pdf_text_cache)
+    return _extractor
+
+
+def shutdown_pdf_extractor():
+    """
+    Stop the worker processes, if the extractor was ever used.
+    """
+    if _extractor is not None:
+        _extractor.shutdown()
+
+
+def stats():
+    """
+    The current account's text cache counters, or None if it has read no PDF
+    (or the cache is off).
+    """
+    cache = _caches.get(current_account())
+    return cache.stats() if cache else None
@@ -0,0 +1,324 @@
+import os
+import re
+import json
+import time
+import random
+import threading
+import metrics
+
+# Gmail's per-user limit is 250 quota units per second (moving average, so
+# short bursts are tolerated).
+QUOTA_UNITS_PER_SECOND = float(os.environ.get("GMAIL_QUOTA_UNITS_PER_SECOND", 250))
+QUOTA_BURST_UNITS = float(os.environ.get("GMAIL_QUOTA_BURST", 250))
+# Retries of rate-limited and 5xx responses, with jittered exponential backoff.
+MAX_RETRIES = int(os.environ.get("GMAIL_MAX_RETRIES", 5))
+RETRY_BASE_SECONDS = float(os.environ.get("GMAIL_RETRY_BASE", 0.5))
+RETRY_MAX_SECONDS = float(os.environ.get("GMAIL_RETRY_MAX", 32))
+# Upper bound on concurrent Gmail HTTP calls; the live limit halves on throttling.
+MAX_CONCURRENCY = int(os.environ.get("GMAIL_MAX_CONCURRENCY", 16))
+
+# Quota units per Gmail method, from the Gmail API usage limits page.
+GMAIL_QUOTA_COSTS = {
+    'users.getProfile': 1,
+    'users.history.list': 2,
+    'users.labels.list': 1,
+    'users.messages.list': 5,
+    'users.messages.get': 5,
+    'users.messages.attachments.get': 5,
+    'users.threads.list': 10,
+    'users.threads.get': 10,
+}
+DEFAULT_COST = 5
+
+# (method, path regex) -> Gmail method name; first match wins.
+METHOD_PATTERNS = [
+    ('GET', re.compile(r'/gmail/v1/users/[^/]+/profile$'), 'users.getProfile'),
+    ('GET', re.compile(r'/gmail/v1/users/[^/]+/history$'), 'users.history.list'),
+    ('GET', re.compile(r'/gmail/v1/users/[^/]+/labels$'), 'users.labels.list'),
+    ('GET', re.compile(r'/gmail/v1/users/[^/]+/messages/[^/]+/attachments/[^/]+$'), 'users.messages.attachments.get'),
+    ('GET', re.compile(r'/gmail/v1/users/[^/]+/messages/?$'), 'users.messages.list'),
+    ('GET', re.compile(r'/gmail/v1/users/[^/]+/messages/[^/]+$'), 'users.messages.get'),
+    ('GET', re.compile(r'/gmail/v1/users/[^/]+/threads/?$'), 'users.threads.list'),
+    ('GET', re.compile(r'/gmail/v1/users/[^/]+/threads/[^/]+$'), 'users.threads.get'),
+]
+BATCH_PATH = re.compile(r'/batch/gmail/v1$')
+# Request lines of the sub-requests inside a batch body
+BATCH_REQUEST_LINE = re.compile(r'^(GET|POST|PUT|PATCH|DELETE) (\S+) HTTP/1\.1', re.M)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+
+
+def gmail_method(http_method: str, uri: str) -> str:
+    """
+    Map an HTTP call to its Gmail method name, or None if unknown.
+    """
+    path = re.sub(r'^[a-z]+://[^/]+', '', uri).split('?', 1)[0]
+    for method, pattern, name in METHOD_PATTERNS:
+        if method == http_method and pattern.search(path):
+            return name
+    return None
+
+
+def quota_cost(http_method: str, uri: str, body=None) -> int:
+    """
+    Quota units a request will consume. A batch costs the sum of its parts.
+    """
+    path = re.sub(r'^[a-z]+://[^/]+', '', uri).split('?', 1)[0]
+    if BATCH_PATH.search(path) and body:
+        if isinstance(body, bytes):
+            body = body.decode('utf-8', errors='ignore')
+        lines = BATCH_REQUEST_LINE.findall(body)
+        return sum(GMAIL_QUOTA_COSTS.get(gmail_method(m, target), DEFAULT_COST) for m, target in lines) or DEFAULT_COST
+    return GMAIL_QUOTA_COSTS.get(gmail_method(http_method, uri), DEFAULT_COST)
+
+
+def is_retryable(status: int, content) -> bool:
+    """
+    True for 429, 5xx, and 403s whose reason is a rate limit.
+    """
+    if status in RETRY_STATUSES:
+        return True
+    if status == 403 and content:
+        if isinstance(content, bytes):
+            content = content.decode('utf-8', errors='ignore')
+        try:
+            errors = json.loads(content).get('error', {}).get('errors', [])
+        except (ValueError, AttributeError):
+            return any(reason in content for reason in RATE_LIMIT_REASONS)
+        return any(e.get('reason') in RATE_LIMIT_REASONS for e in errors)
+    return False
+
+
+def backoff_delay(attempt: int, retry_after: str = None) -> float:
+    """
+    Full-jitter exponential backoff; a server-sent Retry-After wins if longer.
+    """
+    delay = random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * (2 ** attempt)))
+    if retry_after:
+        try:
+            delay = max(delay, float(retry_after))
+        except ValueError:
+            pass
+    return delay
+
+
+class TokenBucket:
+    """
+    Quota-unit token bucket: `rate` units per second, holding up to `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, units: float) -> float:
+        """
+        Take `units` tokens, sleeping until they are available. Returns the
+        seconds spent waiting. Requests larger than the bucket are allowed
+        once it is full.
+        """
+        units = min(units, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= units:
+                    self._tokens -= units
+                    return waited
+                wait = (units - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def drain(self):
+        """
+        Empty the bucket, e.g. after Gmail reported the quota exhausted.
+        """
+        with self._lock:
+            self._tokens = 0.0
+            self._updated = time.monotonic()
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD limit on concurrent calls: halves when Gmail throttles, grows by
+    one after each `limit` consecutive successes, up to `max_limit`.
+    """
+
+    def __init__(self, max_limit: int):
+        self.max_limit = max(1, max_limit)
+        self.limit = self.max_limit
+        self.in_flight = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, throttled: bool):
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self._shrink()
+            else:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.max_limit:
+                    self.limit += 1
+                    self._successes = 0
+            self._cond.notify_all()
+
+    def throttled(self):
+        """
+        Shrink the limit without a matching acquire().
+        """
+        with self._cond:
+            self._shrink()
+
+    def _shrink(self):
+        self.limit = max(1, self.limit // 2)
+        self._successes = 0
+
+
+class GmailRateLimiter:
+    """
+    Central throttle for every Gmail HTTP call: quota-unit token bucket,
+    adaptive concurrency, and retry of rate-limited / 5xx responses.
+    """
+
+    def __init__(self, units_per_second: float = QUOTA_UNITS_PER_SECOND, burst: float = QUOTA_BURST_UNITS,
+                 max_concurrency: int = MAX_CONCURRENCY, max_retries: int = MAX_RETRIES):
+        self.bucket = TokenBucket(units_per_second, burst)
+        self.concurrency = AdaptiveConcurrency(max_concurrency)
+        self.max_retries = max_retries
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.gave_up = 0
+        self.quota_units = 0
+        self.wait_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def call(self, send, cost: int):
+        """
+        Run send() -> (response, content) under the limits, retrying while
+        is_retryable(). After max_retries the last response is returned so
+        the caller raises its usual HttpError.
+        """
+        for attempt in range(self.max_retries + 1):
+            waited = self.bucket.acquire(cost)
+            self.concurrency.acquire()
+            retry = False
+            try:
+                response, content = send()
+                retry = is_retryable(response.status, content)
+            finally:
+                self.concurrency.release(throttled=retry)
+            with self._lock:
+                self.requests += 1
+                self.quota_units += cost
+                self.wait_seconds += waited
+                if retry:
+                    self.throttled += 1
+                    if attempt == self.max_retries:
+                        self.gave_up += 1
+            if not retry or attempt == self.max_retries:
+                return response, content
+            if response.status in (403, 429):
+                self.bucket.drain()
+            with self._lock:
+                self.retries += 1
+            time.sleep(backoff_delay(attempt, response.get('retry-after')))
+
+    def record_throttle(self, retried: int = 1):
+        """
+        Note sub-requests of a batch response that were throttled and are
+        about to be retried.
+        """
+        with self._lock:
+            self.throttled += retried
+            self.retries += retried
+        self.concurrency.throttled()
+        self.bucket.drain()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'retries': self.retries,
+                'throttled': self.throttled,
+                'gave_up': self.gave_up,
+                'quota_units': self.quota_units,
+                'wait_seconds': round(self.wait_seconds, 3),
+                'concurrency_limit': self.concurrency.limit,
+                'in_flight': self.concurrency.in_flight,
+            }
+
+
+class RateLimitedHttp:
+    """
+    Wraps an httplib2-compatible Http so every request goes through the
+    limiter. Everything else is delegated to the wrapped object.
+    """
+
+    def __init__(self, http, limiter: GmailRateLimiter):
+        self.http = http
+        self.limiter = limiter
+
+    def request(self, uri, method='GET', body=None, headers=None, *args, **kwargs):
+        cost = quota_cost(method, uri, body)
+        path = re.sub(r'^[a-z]+://[^/]+', '', uri).split('?', 1)[0]
+        name = 'batch' if BATCH_PATH.search(path) else (gmail_method(method, uri) or 'other')
+
+        def send():
+            start = time.perf_counter()
+            status = 'error'
+            try:
+                response, content = self.http.request(uri, method, body, headers, *args, **kwargs)
+                status = str(response.status)
+                metrics.GMAIL_BYTES.inc(len(content or b''), method=name)
+                metrics.TOOL_GMAIL_BYTES.inc(len(content or b''), tool=metrics.current_tool() or 'background')
+                return response, content
+            finally:
+                metrics.GMAIL_DURATION.observe(time.perf_counter() - start, method=name)
+                metrics.GMAIL_CALLS.inc(method=name, status=status)
+
+        with metrics.span('list' if name.endswith('.list') else 'fetch'):
+            return self.limiter.call(send, cost)
+
+    def __getattr__(self, name):
+        return getattr(self.http, name)
+
+
+# Gmail's quota is per user, so each account gets its own limiter.
+# account name (None: the single-account token) -> GmailRateLimiter
+_limiters = {}
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter(account: str = None) -> GmailRateLimiter:
+    """
+    Return the process-wide Gmail rate limiter of an account.
+    """
+    limiter = _limiters.get(account)
+    if limiter is None:
+        with _limiter_lock:
+            limiter = _limiters.get(account)
+            if limiter is None:
+                limiter = _limiters[account] = GmailRateLimiter()
+    return limiter
+
+
+def rate_limiters() -> dict:
+    """
+    The limiters created so far, by account.
+    """
+    with _limiter_lock:
+        return dict(_limiters)
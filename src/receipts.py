@@ -0,0 +1,203 @@
+import os
+import re
+from datetime import datetime
+from email.utils import parseaddr
+
+# Gmail batches (of BATCH_CHUNK_SIZE messages) fetched and parsed at the same
+# time by extract_receipts; the rate limiter still bounds the request rate.
+RECEIPT_WORKERS = int(os.environ.get("RECEIPT_WORKERS", 4))
+# Upper bound on messages one extract_receipts call reads.
+RECEIPT_MAX_RESULTS = int(os.environ.get("RECEIPT_MAX_RESULTS", 5000))
+# PDF pages read when the mail body has no total (invoices put it up front).
+RECEIPT_PDF_PAGES = os.environ.get("RECEIPT_PDF_PAGES", "1-2")
+
+CURRENCIES = {
+    '₹': 'INR', 'rs': 'INR', 'rs.': 'INR', 'inr': 'INR',
+    '$': 'USD', 'usd': 'USD',
+    '€': 'EUR', 'eur': 'EUR',
+    '£': 'GBP', 'gbp': 'GBP',
+}
+_CURRENCY = r'₹|Rs\.?|INR|\$|USD|€|EUR|£|GBP'
+_NUMBER = r'\d{1,3}(?:,\d{2,3})+(?:\.\d{1,2})?|\d+(?:\.\d{1,2})?'
+AMOUNT = re.compile(rf'(?P<pre>{_CURRENCY})\s*(?P<num>{_NUMBER})(?![\d,])|(?P<num2>{_NUMBER})\s*(?P<post>INR|USD|EUR|GBP)\b',
+                    re.I)
+# Lines naming the amount actually paid, strongest first
+TOTAL_KEYWORDS = [
+    ('grand total', 'total amount', 'amount paid', 'total paid', 'order total', 'amount charged',
+     'total charged', 'you paid', 'net amount', 'bill total', 'amount debited'),
+    ('total', 'paid', 'charged', 'debited'),
+]
+# How much an amount can be trusted, by find_total() confidence
+CONFIDENCE_RANK = {'total': 2, 'guess': 1, None: 0}
+NOT_TOTAL = re.compile(r'sub\s*-?\s*total|item\s*total|saving|discount|you saved|cashback|\btips?\b|\blimit\b|'
+                       r'\bbalance\b', re.I)
+# "Order #41", "Order ID: OD12345", "Invoice INV-0042"; IDs contain a digit ("order confirmed" is no ID).
+# The keyword in front is what tells an ID apart from any other number, so short IDs are fine.
+ORDER_ID = re.compile(r'\b(?:order|invoice|booking|bill)\s*(?:#|no\.?|number|id)?\s*[:#]?\s*((?=[A-Z-]*\d)[A-Z0-9][A-Z0-9-]*)\b',
+                      re.I)
+# Words dropped from sender names to get the merchant ("Uber Receipts" -> "Uber")
+SENDER_NOISE = re.compile(r'\b(receipts?|orders?|order updates|team|no-?reply|notifications?|alerts?|support|'
+                          r'billing|payments?|invoices?|care)\b', re.I)
+SECOND_LEVEL = {'co', 'com', 'net', 'org', 'ac', 'gov', 'edu'}
+
+
+def parse_amounts(line: str) -> list:
+    """
+    Every currency amount on a line, as (value, currency code, position).
+    """
+    amounts = []
+    for match in AMOUNT.finditer(line):
+        number = match.group('num') or match.group('num2')
+        symbol = match.group('pre') or match.group('post')
+        amounts.append((float(number.replace(',', '')), CURRENCIES[symbol.lower()], match.start()))
+    return amounts
+
+
+def find_total(text: str) -> tuple:
+    """
+    The amount paid according to a receipt's text: (value, currency,
+    confidence), or (None, None, None).
+
+    The first amount after a label naming a total ("Grand Total", "Amount
+    paid") wins, the strongest label first and the last such line on ties,
+    since totals come after the line items. Otherwise the largest amount
+    is returned with confidence 'guess'.
+    """
+    best = None
+    largest = None
+    for line in text.splitlines():
+        amounts = parse_amounts(line)
+        if not amounts:
+            continue
+        for amount in amounts:
+            if largest is None or amount[0] > largest[0]:
+                largest = amount
+        lowered = line.lower()
+        for rank, keywords in enumerate(TOTAL_KEYWORDS):
+            positions = [lowered.rfind(keyword) for keyword in keywords if keyword in lowered]
+            if not positions:
+                continue
+            label = max(positions)
+            amount = next((a for a in amounts if a[2] >= label), amounts[-1])
+            # "Subtotal", "Avl balance" etc. between the label and its amount
+            if not NOT_TOTAL.search(lowered, 0, max(amount[2], label + 1)) \
+                    and (best is None or rank <= best[0]):
+                best = (rank, amount)
+            break
+    if best is not None:
+        return best[1][0], best[1][1], 'total'
+    if largest is not None:
+        return largest[0], largest[1], 'guess'
+    return None, None, None
+
+
+def merchant_from_sender(sender: str) -> str:
+    """
+    "Uber Receipts <noreply@uber.com>" -> "Uber"; falls back to the domain.
+    """
+    name, address = parseaddr(sender)
+    cleaned = ' '.join(SENDER_NOISE.sub(' ', name).replace('"', '').split()).strip(' -|:')
+    if cleaned:
+        return cleaned
+    labels = address.rpartition('@')[2].lower().split('.')
+    if len(labels) >= 3 and labels[-2] in SECOND_LEVEL:
+        return labels[-3].capitalize()
+    return labels[-2].capitalize() if len(labels) >= 2 else (address or sender)
+
+
+def parse_receipt(text: str, sender: str, subject: str, internal_date_ms: int) -> dict:
+    """
+    Receipt fields found in a message's text (body or attachment).
+    """
+    when = datetime.fromtimestamp(internal_date_ms / 1000) if internal_date_ms else None
+    amount, currency, confidence = find_total(text)
+    order = ORDER_ID.search(subject) or ORDER_ID.search(text)
+    return {
+        'date': when.strftime('%Y-%m-%d') if when else None,
+        'month': when.strftime('%Y-%m') if when else None,
+        'merchant': merchant_from_sender(sender),
+        'sender': sender,
+        'subject': subject,
+        'amount': amount,
+        'currency': currency,
+        'confidence': confidence,
+        'order_id': order.group(1) if order else None,
+    }
+
+
+class ReceiptTotals:
+    """
+    Running totals over receipt rows, per currency: overall, by merchant
+    and by month. Amounts that are only a guess (the largest number in the
+    mail) are summed separately and left out of the totals. Of several
+    mails about one order (same merchant and order ID, e.g. "order
+    confirmed" and "order delivered"), only the one with the best amount
+    is counted; the others are marked as duplicates.
+    """
+
+    def __init__(self):
+        self.messages = 0
+        self.receipts = 0
+        self.without_amount = 0
+        self.duplicates = 0
+        self.errors = 0
+        self.total = {}
+        self.guessed = {}
+        self.by_merchant = {}
+        self.by_month = {}
+        self._orders = {}       # (merchant, order ID) -> row counted for it
+
+    def add(self, row: dict):
+        self.messages += 1
+        if row.get('error'):
+            self.errors += 1
+            return
+        row['duplicate'] = False
+        order_key = (row['merchant'], row['order_id']) if row.get('order_id') else None
+        counted = self._orders.get(order_key)
+        if counted is not None:
+            self.duplicates += 1
+            if CONFIDENCE_RANK[row.get('confidence')] <= CONFIDENCE_RANK[counted.get('confidence')]:
+                row['duplicate'] = True
+                return
+            # A later mail about the order has a better amount: count it instead
+            self._count(counted, -1)
+            counted['duplicate'] = True
+            row['replaces'] = counted.get('message_id')
+        if order_key:
+            self._orders[order_key] = row
+        self._count(row, 1)
+
+    def _count(self, row: dict, sign: int):
+        self.receipts += sign
+        if row.get('amount') is None:
+            self.without_amount += sign
+            return
+        groups = ((self.by_merchant, row['merchant']), (self.by_month, row['month'] or 'unknown'))
+        if row.get('confidence') == 'guess':
+            buckets = [self.guessed]
+        else:
+            buckets = [self.total] + [by.setdefault(key, {}) for by, key in groups]
+        for bucket in buckets:
+            entry = bucket.setdefault(row['currency'], {'amount': 0.0, 'count': 0})
+            entry['amount'] = round(entry['amount'] + sign * row['amount'], 2)
+            entry['count'] += sign
+            if not entry['count']:
+                del bucket[row['currency']]
+        # A replaced row can leave its merchant or month without amounts
+        for by, key in groups:
+            if key in by and not by[key]:
+                del by[key]
+
+    def as_dict(self) -> dict:
+        return {
+            'messages': self.messages,
+            'receipts': self.receipts,
+            'without_amount': self.without_amount,
+            'duplicates': self.duplicates,
+            'errors': self.errors,
+            'total': self.total,
+            'guessed': self.guessed,
+            'by_merchant': dict(sorted(self.by_merchant.items())),
+            'by_month': dict(sorted(self.by_month.items())),
+        }
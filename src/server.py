@@ -1,72 +1,142 @@
 import os.path
 import base64
+import re
 import json
-import io
+import sqlite3
 from typing import List, Optional
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from mcp.server.fastmcp import FastMCP
-from bs4 import BeautifulSoup
-import dateparser
+from datetime import datetime
 from fastapi import FastAPI, Request as FastAPIRequest
-from fastapi.responses import JSONResponse, StreamingResponse
-import uvicorn
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 import asyncio
-import pdfplumber
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from gmail_client import get_service_pool, batch_get_messages, execute_raw, fields, iter_message_ids, BATCH_CHUNK_SIZE
+from tool_runner import ToolRunner, ToolBusyError
+from message_cache import get_message_cache
+from text_index import get_text_index
+from html_text import html_to_text, stats as html_text_stats
+from thread_text import strip_quoted, RepeatFilter
+from mail_export import export_messages, load_checkpoint, checkpoint_path, ExportMismatchError, EXPORT_DIR, FORMATS as EXPORT_FORMATS
+from receipts import parse_receipt, ReceiptTotals, RECEIPT_WORKERS, RECEIPT_MAX_RESULTS, RECEIPT_PDF_PAGES
+from attachment_store import get_attachment_store
+from attachment_data import decode_attachment, response_data, READ_BYTES as ATTACHMENT_READ_BYTES, MAX_READ_BYTES as ATTACHMENT_MAX_READ_BYTES
+from pdf_extract import get_pdf_extractor, shutdown_pdf_extractor, stats as pdf_text_stats
+from mailbox_sync import get_mailbox_mirror, SyncLoop, SYNC_INTERVAL_SECONDS
+from mail_stats import GROUPS as STATS_GROUPS, ORDERS as STATS_ORDERS
+from single_flight import SingleFlight, stats as single_flight_stats
+from rate_limit import rate_limiters
+from credential_store import current_account, check_account, list_accounts, account_dir, UnknownAccountError, DEFAULT_ACCOUNT
+import credential_store
+import metrics
+from startup import LazyFastMCP, LAZY_IMPORTS, WARMUP_ENABLED, preload_modules, start_warmup
 
-# If modifying these scopes, delete the file token.json.
-SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
+if not LAZY_IMPORTS:
+    preload_modules()
 
-mcp = FastMCP("gmail-receipts")
-app = FastAPI()
+mcp = LazyFastMCP("gmail-receipts")
+tool_runner = ToolRunner()
+# Identical concurrent Gmail downloads share one request
+message_flights = SingleFlight('messages')
+thread_flights = SingleFlight('threads')
+attachment_flights = SingleFlight('attachments')
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    sync_loop = None
+    mirror = get_mailbox_mirror()
+    if mirror:
+        sync_loop = SyncLoop(mirror, SYNC_INTERVAL_SECONDS)
+        sync_loop.start()
+    yield
+    if sync_loop:
+        sync_loop.stop()
+    tool_runner.shutdown()
+    shutdown_pdf_extractor()
+
+app = FastAPI(lifespan=lifespan)
 
 def get_gmail_service():
-    """Shows basic usage of the Gmail API.
-    Lists the user's Gmail labels.
-    """
-    creds = None
-    # The file token.json stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            if not os.path.exists('credentials.json'):
-                raise FileNotFoundError("credentials.json not found. Please download it from Google Cloud Console.")
-            
-            flow = InstalledAppFlow.from_client_secrets_file(
-                'credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
+    """
+    Return a Gmail service for the calling thread and the account of its request.
+    Credentials and HTTP connections are pooled process-wide (see gmail_client).
+    """
+    with metrics.span('auth'):
+        return get_service_pool().get_service()
 
-    service = build('gmail', 'v1', credentials=creds)
-    return service
+def fetch_message(service, email_id: str) -> dict:
+    """
+    Return the format='full' message, served from the local message cache when possible.
+    """
+    cache = get_message_cache()
+    msg = cache.get(email_id, 'full') if cache else None
+    if msg is None:
+        def fetch():
+            msg = service.users().messages().get(userId='me', id=email_id, format='full', **fields('full')).execute()
+            if cache:
+                cache.put(email_id, msg, 'full')
+            return msg
+        msg = message_flights.do((current_account(), email_id, 'full'), fetch)
+    return msg
 
-@mcp.tool()
-def search_emails(query: str = "", sender: str = None, recipient: str = None, subject: str = None, start_date: str = None, end_date: str = None, max_results: int = 10) -> str:
+MIRROR_PAGE_PREFIX = "mirror:"
+
+class PageTokenError(ValueError):
+    """Raised for a search page token that can no longer be continued."""
+
+def mirror_page_offset(page_token: str) -> int:
     """
-    Search for emails in Gmail and return lightweight metadata (ID, subject, sender, date, snippet).
-    Use get_email_content() to fetch full email body.
-    
-    Args:
-        query: General search query (e.g., 'receipt').
-        sender: Filter by sender (e.g., 'swiggy', 'uber'). Matches names or emails.
-        recipient: Filter by recipient.
-        subject: Filter by subject line.
-        start_date: Start date (inclusive) in any common format (e.g., '2024-01-01', 'last week').
-        end_date: End date (exclusive) in any common format.
-        max_results: Maximum number of emails to return.
+    The result offset in a "mirror:<offset>" page token.
+    """
+    offset = page_token[len(MIRROR_PAGE_PREFIX):]
+    if not offset.isdigit():
+        raise PageTokenError(f"Invalid page token {page_token!r}; rerun the search without page_token.")
+    return int(offset)
+
+def fetch_message_structure(service, email_id: str, refresh: bool = False) -> dict:
+    """
+    Return the message's part tree (headers, filenames, MIME types, attachment IDs)
+    without downloading any body data, using the cache unless refresh is set.
+    """
+    cache = get_message_cache()
+    msg = cache.get(email_id, 'structure') if cache and not refresh else None
+    if msg is None:
+        def fetch():
+            msg = service.users().messages().get(userId='me', id=email_id, format='full', **fields('structure')).execute()
+            if cache:
+                cache.put(email_id, msg, 'structure')
+            return msg
+        msg = message_flights.do((current_account(), email_id, 'structure'), fetch)
+    return msg
+
+def prefetch_messages(message_ids: list, slot: str = 'full') -> int:
+    """
+    Fetch the messages not yet in the cache slot ('full' or 'structure') in
+    one Gmail batch, so later per-message calls are cache hits. Failures
+    are left for those calls to report. Returns the number fetched.
+    """
+    cache = get_message_cache()
+    if not cache:
+        return 0
+    missing = [i for i in dict.fromkeys(message_ids) if cache.get(i, slot) is None]
+    if not missing:
+        return 0
+    get_kwargs = dict(format='full', **fields(slot))
+    fetched = 0
+    for message_id, (msg, error) in zip(missing, batch_get_messages(get_gmail_service(), missing, **get_kwargs)):
+        if error is None:
+            cache.put(message_id, msg, slot)
+            fetched += 1
+    return fetched
+
+def format_search_entry(message_id: str, date: str, sender: str, subject: str, snippet: str) -> str:
+    return f"ID: {message_id}\nDate: {date}\nFrom: {sender}\nSubject: {subject}\nSnippet: {snippet}\n---"
+
+def build_search_query(query: str = "", sender: str = None, recipient: str = None, subject: str = None, start_date: str = None, end_date: str = None) -> tuple:
+    """
+    Build the Gmail q= string from search_emails filters.
+    Returns (gmail_query, start_datetime, end_datetime); the dates are day-aligned or None.
     """
-    service = get_gmail_service()
-    
     search_parts = []
     if query:
         search_parts.append(query)
@@ -77,37 +147,134 @@ def search_emails(query: str = "", sender: str = None, recipient: str = None, su
     if subject:
         search_parts.append(f"subject:{subject}")
     
-    if start_date:
-        dt = dateparser.parse(start_date)
-        if dt:
-            search_parts.append(f"after:{dt.strftime('%Y/%m/%d')}")
+    import dateparser
+    start_dt = dateparser.parse(start_date) if start_date else None
+    if start_dt:
+        start_dt = start_dt.replace(hour=0, minute=0, second=0, microsecond=0)
+        search_parts.append(f"after:{start_dt.strftime('%Y/%m/%d')}")
             
-    if end_date:
-        dt = dateparser.parse(end_date)
-        if dt:
-            search_parts.append(f"before:{dt.strftime('%Y/%m/%d')}")
+    end_dt = dateparser.parse(end_date) if end_date else None
+    if end_dt:
+        end_dt = end_dt.replace(hour=0, minute=0, second=0, microsecond=0)
+        search_parts.append(f"before:{end_dt.strftime('%Y/%m/%d')}")
             
-    final_query = " ".join(search_parts).strip()
-    if not final_query:
-        pass
+    return " ".join(search_parts).strip(), start_dt, end_dt
 
-    results = service.users().messages().list(userId='me', q=final_query, maxResults=max_results).execute()
-    messages = results.get('messages', [])
+def fetch_batch(service, message_ids: list, slot: str, **get_kwargs) -> list:
+    """
+    Return (message, error) pairs for messages.get lookups, in order.
+    Entries in the cache slot are reused; the rest are fetched in one Gmail
+    batch and cached.
+    """
+    cache = get_message_cache()
+    fetched = {}
+    if cache:
+        for message_id in message_ids:
+            msg = cache.get(message_id, slot)
+            if msg is not None:
+                fetched[message_id] = (msg, None)
+    missing = [i for i in message_ids if i not in fetched]
+    if missing:
+        for message_id, (msg, error) in zip(missing, batch_get_messages(service, missing, **get_kwargs)):
+            fetched[message_id] = (msg, error)
+            if cache and error is None:
+                cache.put(message_id, msg, slot)
+    return [fetched[i] for i in message_ids]
 
-    if not messages:
-        return "No messages found."
+def fetch_metadata(service, message_ids: list) -> list:
+    """
+    Return (message, error) pairs for format='metadata' lookups, in order.
+    """
+    return fetch_batch(service, message_ids, 'metadata', format='metadata',
+                       metadataHeaders=['From', 'Subject', 'Date'], **fields('metadata'))
 
-    output = []
-    for message in messages:
-        msg = service.users().messages().get(userId='me', id=message['id'], format='metadata', metadataHeaders=['From', 'Subject', 'Date']).execute()
-        headers = msg['payload']['headers']
-        subject_val = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-        sender_val = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
-        date_val = next((h['value'] for h in headers if h['name'] == 'Date'), 'Unknown Date')
-        snippet = msg.get('snippet', '')
-        output.append(f"ID: {message['id']}\nDate: {date_val}\nFrom: {sender_val}\nSubject: {subject_val}\nSnippet: {snippet}\n---")
+def iter_search_results(query: str = "", sender: str = None, recipient: str = None, subject: str = None, start_date: str = None, end_date: str = None, max_results: int = 10, page_token: str = None):
+    """
+    Run a search_emails query and yield (entries, next_page_token) as each
+    batch of metadata arrives. `entries` is a list of formatted result
+    blocks; next_page_token is only set on the final batch, and only if
+    more results are available.
+    """
+    final_query, start_dt, end_dt = build_search_query(query, sender, recipient, subject, start_date, end_date)
 
-    return "\n".join(output)
+    # Answer from the local mirror when it is fresh and covers these filters.
+    # Mirror page tokens are "mirror:<offset>" so they never mix with Gmail's,
+    # and are never sent to Gmail: if the mirror cannot answer any more, the
+    # caller has to start the search over.
+    mirror_token = bool(page_token) and page_token.startswith(MIRROR_PAGE_PREFIX)
+    offset = mirror_page_offset(page_token) if mirror_token else 0
+    mirror = get_mailbox_mirror()
+    mirror_answers = (not page_token or mirror_token) and mirror is not None and mirror.answers(query, start_dt)
+    if mirror_token and not mirror_answers:
+        raise PageTokenError("Page token expired (the local mirror can no longer answer this search); "
+                             "rerun the search without page_token.")
+    if mirror_answers:
+        rows = mirror.search(sender, recipient, subject, start_dt, end_dt, max_results + 1, offset)
+        entries = [
+            format_search_entry(r['id'], r['date'] or 'Unknown Date', r['sender'] or 'Unknown Sender',
+                                r['subject'] or 'No Subject', r['snippet'])
+            for r in rows[:max_results]
+        ]
+        yield entries, f"{MIRROR_PAGE_PREFIX}{offset + max_results}" if len(rows) > max_results else None
+        return
+
+    service = get_gmail_service()
+    remaining = max_results
+    for ids, page_token in iter_message_ids(service, final_query, max_results, page_token):
+        remaining -= len(ids)
+        # Fetch metadata one Gmail batch at a time so callers can stream results
+        for start in range(0, len(ids), BATCH_CHUNK_SIZE):
+            chunk = ids[start:start + BATCH_CHUNK_SIZE]
+            entries = []
+            for message_id, (msg, error) in zip(chunk, fetch_metadata(service, chunk)):
+                if error is not None:
+                    entries.append(f"ID: {message_id}\nError: {str(error)}\n---")
+                    continue
+                headers = msg['payload']['headers']
+                subject_val = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
+                sender_val = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
+                date_val = next((h['value'] for h in headers if h['name'] == 'Date'), 'Unknown Date')
+                snippet = msg.get('snippet', '')
+                entries.append(format_search_entry(message_id, date_val, sender_val, subject_val, snippet))
+            last_batch = start + BATCH_CHUNK_SIZE >= len(ids) and (remaining <= 0 or not page_token)
+            yield entries, page_token if last_batch else None
+
+@mcp.tool()
+def search_emails(query: str = "", sender: str = None, recipient: str = None, subject: str = None, start_date: str = None, end_date: str = None, max_results: int = 10, page_token: str = None) -> str:
+    """
+    Search for emails in Gmail and return lightweight metadata (ID, subject, sender, date, snippet).
+    Use get_email_content() to fetch full email body.
+    
+    Args:
+        query: General search query (e.g., 'receipt').
+        sender: Filter by sender (e.g., 'swiggy', 'uber'). Matches names or emails.
+        recipient: Filter by recipient.
+        subject: Filter by subject line.
+        start_date: Start date (inclusive) in any common format (e.g., '2024-01-01', 'last week').
+        end_date: End date (exclusive) in any common format.
+        max_results: Maximum number of emails to return.
+        page_token: Continue a previous search from its "Next page token".
+    """
+    return "".join(iter_search_emails(query, sender, recipient, subject, start_date, end_date, max_results, page_token))
+
+def iter_search_emails(query: str = "", sender: str = None, recipient: str = None, subject: str = None, start_date: str = None, end_date: str = None, max_results: int = 10, page_token: str = None):
+    """
+    Generator behind search_emails(): yields the output one batch of results at a time.
+    """
+    emitted = False
+    next_page_token = None
+    try:
+        for entries, next_page_token in iter_search_results(query, sender, recipient, subject, start_date, end_date, max_results, page_token):
+            if entries:
+                yield ("\n" if emitted else "") + "\n".join(entries)
+                emitted = True
+    except PageTokenError as e:
+        yield f"Error: {str(e)}"
+        return
+    if not emitted:
+        yield "No messages found."
+    elif next_page_token:
+        yield f"\nNext page token: {next_page_token}"
 
 def extract_attachments_from_payload(payload: dict, attachments: list = None) -> list:
     """
@@ -126,6 +293,7 @@ def extract_attachments_from_payload(payload: dict, attachments: list = None) ->
             'mime_type': payload.get('mimeType', 'application/octet-stream'),
             'size': body.get('size', 0),
             'attachment_id': body.get('attachmentId', ''),
+            'part_id': payload.get('partId', ''),
         }
         
         # Check if PDF might be password protected (we can't know for sure until we try to read it)
@@ -176,6 +344,67 @@ def extract_body_from_payload(payload: dict) -> tuple[str, str]:
     return plain_text, html_text
 
 
+def read_message(msg: dict, email_id: str) -> dict:
+    """
+    Headers, readable body and attachment metadata of a format='full'
+    message. The body is added to the local full-text index.
+    """
+    payload = msg['payload']
+    headers = payload['headers']
+    
+    # Extract headers
+    subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
+    sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
+    date = next((h['value'] for h in headers if h['name'] == 'Date'), 'Unknown Date')
+    to = next((h['value'] for h in headers if h['name'] == 'To'), 'Unknown Recipient')
+    
+    # Extract body recursively
+    with metrics.span('decode'):
+        plain_text, html_text = extract_body_from_payload(payload)
+    
+    # Prefer plain text, fall back to HTML converted to text
+    if plain_text:
+        body = plain_text
+    elif html_text:
+        with metrics.span('extract'):
+            body = html_to_text(html_text, key=(current_account(), email_id))
+    else:
+        # Last resort: use the snippet from the message
+        body = msg.get('snippet', '(No body content available)')
+    
+    # Make the body searchable with search_local_text()
+    index = get_text_index()
+    if index and not index.contains(email_id):
+        index.add(email_id, body, sender=sender, subject=subject, date=date,
+                  message_date=int(msg.get('internalDate', 0)) or None)
+    
+    return {
+        'subject': subject,
+        'sender': sender,
+        'date': date,
+        'to': to,
+        'body': body,
+        # Converted from HTML: one block per line rather than blank-line paragraphs
+        'html_body': not plain_text and bool(html_text),
+        'attachments': extract_attachments_from_payload(payload),
+    }
+
+def format_attachment_section(attachments: list) -> str:
+    if not attachments:
+        return "\n--- Attachments (0) ---\nNo attachments"
+    attachment_lines = [f"\n--- Attachments ({len(attachments)}) ---"]
+    for i, att in enumerate(attachments, 1):
+        size_kb = att['size'] / 1024
+        if size_kb >= 1024:
+            size_str = f"{size_kb/1024:.1f}MB"
+        else:
+            size_str = f"{size_kb:.1f}KB"
+        attachment_lines.append(
+            f"{i}. {att['filename']} | {att['mime_type']} | {size_str} | protection: {att['protection']} | ID: {att['attachment_id']}"
+        )
+    return "\n".join(attachment_lines)
+
+
 @mcp.tool()
 def get_email_content(email_id: str) -> str:
     """
@@ -188,81 +417,186 @@ def get_email_content(email_id: str) -> str:
     service = get_gmail_service()
     
     try:
-        msg = service.users().messages().get(userId='me', id=email_id, format='full').execute()
-        payload = msg['payload']
-        headers = payload['headers']
-        
-        # Extract headers
-        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-        sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
-        date = next((h['value'] for h in headers if h['name'] == 'Date'), 'Unknown Date')
-        to = next((h['value'] for h in headers if h['name'] == 'To'), 'Unknown Recipient')
-        
-        # Extract body recursively
-        plain_text, html_text = extract_body_from_payload(payload)
-        
-        # Prefer plain text, fall back to HTML converted to text
-        if plain_text:
-            body = plain_text
-        elif html_text:
-            soup = BeautifulSoup(html_text, 'html.parser')
-            # Remove script and style elements
-            for element in soup(['script', 'style', 'head']):
-                element.decompose()
-            body = soup.get_text(separator='\n', strip=True)
-        else:
-            # Last resort: use the snippet from the message
-            body = msg.get('snippet', '(No body content available)')
-        
-        # Extract attachment metadata
-        attachments = extract_attachments_from_payload(payload)
-        
-        # Format attachment info
-        if attachments:
-            attachment_lines = [f"\n--- Attachments ({len(attachments)}) ---"]
-            for i, att in enumerate(attachments, 1):
-                size_kb = att['size'] / 1024
-                if size_kb >= 1024:
-                    size_str = f"{size_kb/1024:.1f}MB"
-                else:
-                    size_str = f"{size_kb:.1f}KB"
-                attachment_lines.append(
-                    f"{i}. {att['filename']} | {att['mime_type']} | {size_str} | protection: {att['protection']} | ID: {att['attachment_id']}"
-                )
-            attachment_section = "\n".join(attachment_lines)
-        else:
-            attachment_section = "\n--- Attachments (0) ---\nNo attachments"
-        
+        message = read_message(fetch_message(service, email_id), email_id)
         return f"""Email ID: {email_id}
-From: {sender}
-To: {to}
-Date: {date}
-Subject: {subject}
+From: {message['sender']}
+To: {message['to']}
+Date: {message['date']}
+Subject: {message['subject']}
 
 --- Body ---
-{body}
-{attachment_section}"""
+{message['body']}
+{format_attachment_section(message['attachments'])}"""
     
     except Exception as e:
         return f"Error fetching email {email_id}: {str(e)}"
 
 
+def fetch_thread(service, thread_id: str) -> dict:
+    """
+    Return a thread with all its messages in format='full', in one
+    threads.get call. `thread_id` may also be the ID of any message in the
+    thread. Each message is written to the message cache.
+    """
+    cache = get_message_cache()
+    # A cached copy of the message knows its thread
+    for slot in ('full', 'structure'):
+        msg = cache.get(thread_id, slot) if cache else None
+        if msg and msg.get('threadId'):
+            thread_id = msg['threadId']
+            break
+    
+    def fetch(thread_id):
+        return service.users().threads().get(userId='me', id=thread_id, format='full', **fields('thread')).execute()
+    
+    from googleapiclient.errors import HttpError
+    try:
+        thread = thread_flights.do((current_account(), thread_id), fetch, thread_id)
+    except HttpError as e:
+        if e.resp.status != 404:
+            raise
+        # Not a thread ID; treat it as a message ID
+        msg = service.users().messages().get(userId='me', id=thread_id, format='minimal', **fields('thread_id')).execute()
+        thread = thread_flights.do((current_account(), msg['threadId']), fetch, msg['threadId'])
+    
+    if cache:
+        for msg in thread.get('messages', []):
+            cache.put(msg['id'], msg, 'full')
+    return thread
+
+def normalize_subject(subject: str) -> str:
+    return re.sub(r'^((re|fwd?|aw|wg)\s*:\s*)+', '', subject.strip(), flags=re.I).lower()
+
+@mcp.tool()
+def get_thread(thread_id: str) -> str:
+    """
+    Get every message of an email conversation in one call (e.g. an order and its updates,
+    or a receipt dispute). Quoted replies and paragraphs repeated from earlier messages
+    are left out, so each message shows only what it added.
+    
+    Args:
+        thread_id: The Gmail thread ID, or the ID of any message in the thread (from search_emails results).
+    """
+    service = get_gmail_service()
+    
+    try:
+        thread = fetch_thread(service, thread_id)
+        messages = sorted(thread.get('messages', []), key=lambda m: int(m.get('internalDate', 0)))
+        if not messages:
+            return f"Thread {thread_id} has no messages."
+        
+        repeats = RepeatFilter()
+        sections = []
+        thread_subject = None
+        for i, msg in enumerate(messages, 1):
+            message = read_message(msg, msg['id'])
+            if thread_subject is None:
+                thread_subject = message['subject']
+            with metrics.span('extract'):
+                body, quoted = strip_quoted(message['body'])
+                body, repeated = repeats.filter(body, by_line=message['html_body'])
+            
+            lines = [f"=== Message {i} of {len(messages)} ===",
+                     f"Email ID: {msg['id']}",
+                     f"From: {message['sender']}",
+                     f"To: {message['to']}",
+                     f"Date: {message['date']}"]
+            if normalize_subject(message['subject']) != normalize_subject(thread_subject):
+                lines.append(f"Subject: {message['subject']}")
+            lines.append("")
+            lines.append(body or "(No new content)")
+            if quoted:
+                lines.append("[Quoted earlier messages trimmed]")
+            if repeated:
+                lines.append(f"[{repeated} paragraph(s) repeated from earlier messages omitted]")
+            if message['attachments']:
+                lines.append(format_attachment_section(message['attachments']))
+            sections.append("\n".join(lines))
+        
+        return f"""Thread ID: {thread['id']}
+Subject: {thread_subject}
+Messages: {len(messages)}
+
+""" + "\n\n".join(sections)
+    
+    except Exception as e:
+        return f"Error fetching thread {thread_id}: {str(e)}"
+
+
+def index_attachment_text(msg: dict, email_id: str, filename: str, text: str):
+    """
+    Add extracted attachment text to the local full-text index.
+    """
+    index = get_text_index()
+    if not index:
+        return
+    headers = msg['payload'].get('headers', [])
+    index.add(
+        email_id, text, kind='attachment', name=filename,
+        sender=next((h['value'] for h in headers if h['name'] == 'From'), ''),
+        subject=next((h['value'] for h in headers if h['name'] == 'Subject'), ''),
+        date=next((h['value'] for h in headers if h['name'] == 'Date'), ''),
+        message_date=int(msg.get('internalDate', 0)) or None,
+    )
+
+
+def download_attachment(service, email_id: str, attachment_id: str, part_id: str = None):
+    """
+    Return an attachment's decoded content as AttachmentData, from the
+    attachment store when it was downloaded before.
+    """
+    # Reuse previously downloaded bytes; part IDs are stable, attachment IDs are not
+    store = get_attachment_store()
+    part_key = part_id or attachment_id
+    file_data = store.open(email_id, part_key) if store else None
+    if file_data is not None:
+        return file_data
+    
+    def download():
+        # The response is not parsed into a dict: base64 is decoded straight from the raw body
+        content = execute_raw(service.users().messages().attachments().get(
+            userId='me',
+            messageId=email_id,
+            id=attachment_id,
+            **fields('attachment')
+        ))
+        
+        # Decode in chunks; large files are spooled to disk, not kept in memory
+        with metrics.span('decode'):
+            file_data = decode_attachment(response_data(content), store.spool_dir if store else None)
+        del content
+        if store:
+            file_data = store.put_data(email_id, part_key, file_data)
+        return file_data
+    return attachment_flights.do((current_account(), email_id, part_key), download)
+
+
 @mcp.tool()
-def get_email_attachment(email_id: str, attachment_id: str, password: str = None) -> str:
+def get_email_attachment(email_id: str, attachment_id: str, password: str = None, pages: str = None, offset: int = 0, length: int = None) -> str:
     """
     Download and read an email attachment. For PDFs, extracts text content.
-    For other files, returns base64-encoded content.
+    For other files, returns a range of the content (text as-is, binaries as base64).
     
     Args:
         email_id: The Gmail message ID.
         attachment_id: The attachment ID (from get_email_content results).
         password: Optional password for password-protected PDF files.
+        pages: Optional PDF page selection, e.g. '1-3,7' (default: all pages).
+        offset: For non-PDF files, the byte offset to start reading from.
+        length: For non-PDF files, the number of bytes to read (default and maximum are configurable).
+    """
+    return "".join(iter_email_attachment(email_id, attachment_id, password, pages, offset, length))
+
+def iter_email_attachment(email_id: str, attachment_id: str, password: str = None, pages: str = None, offset: int = 0, length: int = None):
+    """
+    Generator behind get_email_attachment(): yields the output in pieces so
+    PDF pages can be streamed as soon as they are extracted.
     """
     service = get_gmail_service()
     
     try:
-        # Get the original message to find the filename and mime type first
-        msg = service.users().messages().get(userId='me', id=email_id, format='full').execute()
+        # Look up the filename and mime type from the part tree (no body data)
+        msg = fetch_message_structure(service, email_id)
         attachments = extract_attachments_from_payload(msg['payload'])
         
         # Find the matching attachment metadata
@@ -272,6 +606,12 @@ def get_email_attachment(email_id: str, attachment_id: str, password: str = None
                 attachment_info = att
                 break
         
+        # Attachment IDs can change between fetches; re-read the part tree once
+        if not attachment_info and len(attachments) > 1:
+            msg = fetch_message_structure(service, email_id, refresh=True)
+            attachments = extract_attachments_from_payload(msg['payload'])
+            attachment_info = next((att for att in attachments if att['attachment_id'] == attachment_id), None)
+        
         # If not found by exact match, try to find by position (fallback)
         if not attachment_info and attachments:
             # Use first attachment if only one exists
@@ -280,123 +620,651 @@ def get_email_attachment(email_id: str, attachment_id: str, password: str = None
                 attachment_id = attachment_info['attachment_id']
         
         if not attachment_info:
-            return f"Error: Attachment with ID {attachment_id} not found in email. Available attachments: {[a['filename'] for a in attachments]}"
+            yield f"Error: Attachment with ID {attachment_id} not found in email. Available attachments: {[a['filename'] for a in attachments]}"
+            return
         
         filename = attachment_info['filename']
         mime_type = attachment_info['mime_type']
         
-        # Get the attachment data
-        attachment = service.users().messages().attachments().get(
-            userId='me',
-            messageId=email_id,
-            id=attachment_id
-        ).execute()
-        
-        # Decode the attachment data
-        file_data = base64.urlsafe_b64decode(attachment['data'])
+        file_data = download_attachment(service, email_id, attachment_id, attachment_info['part_id'])
         
-        # Handle PDF files - extract text
+        # Handle PDF files - extract text (in worker processes, page by page, cached)
         if mime_type == 'application/pdf':
             try:
-                pdf_file = io.BytesIO(file_data)
-                text_content = []
-                
                 # pdfplumber expects password as string, not bytes
                 pdf_password = password if password else None
+                page_iter = get_pdf_extractor().iter_pages(file_data.source, pdf_password, pages,
+                                                           sha256=file_data.sha256)
+                text_content = []
                 
-                with pdfplumber.open(pdf_file, password=pdf_password) as pdf:
-                    for i, page in enumerate(pdf.pages, 1):
-                        page_text = page.extract_text()
-                        if page_text:
-                            text_content.append(f"--- Page {i} ---\n{page_text}")
-                
-                if text_content:
-                    extracted_text = "\n\n".join(text_content)
-                    return f"""Attachment: {filename}
+                while True:
+                    try:
+                        with metrics.span('extract'):
+                            i, page_text = next(page_iter)
+                    except StopIteration as stop:
+                        extraction = stop.value
+                        break
+                    if page_text:
+                        if not text_content:
+                            yield f"""Attachment: {filename}
 Type: {mime_type}
-Size: {len(file_data)} bytes
+Size: {file_data.size} bytes
 Protection: {'password-protected' if password else 'none'}
 
 --- Extracted Text ---
-{extracted_text}"""
+"""
+                        else:
+                            yield "\n\n"
+                        text_content.append(f"--- Page {i} ---\n{page_text}")
+                        yield text_content[-1]
+                
+                if text_content:
+                    if extraction['truncated']:
+                        yield f"\n\nNote: Extraction stopped early (page or time budget) for a {extraction['page_count']}-page PDF. Use the pages parameter to read the rest."
+                    elif not pages:
+                        index_attachment_text(msg, email_id, filename, "\n\n".join(text_content))
+                    return
                 else:
-                    return f"""Attachment: {filename}
+                    yield f"""Attachment: {filename}
 Type: {mime_type}
-Size: {len(file_data)} bytes
+Size: {file_data.size} bytes
 
 Note: PDF contains no extractable text (may be image-based or scanned document)."""
+                    return
                     
             except Exception as pdf_error:
                 error_msg = str(pdf_error).lower()
                 if 'password' in error_msg or 'encrypted' in error_msg:
-                    return f"""Attachment: {filename}
+                    yield f"""Attachment: {filename}
 Type: {mime_type}
-Size: {len(file_data)} bytes
+Size: {file_data.size} bytes
 Protection: password-protected
 
 Error: This PDF is password-protected. Please provide the password parameter to extract text."""
+                    return
                 else:
-                    return f"""Attachment: {filename}
+                    yield f"""Attachment: {filename}
 Type: {mime_type}
-Size: {len(file_data)} bytes
+Size: {file_data.size} bytes
 
 Error extracting PDF text: {str(pdf_error)}
 
 Falling back to base64 content (first 1000 chars):
-{base64.b64encode(file_data).decode()[:1000]}..."""
+{base64.b64encode(file_data.read(0, 750)).decode()}..."""
+                    return
+        
+        # Everything else is returned as a bounded range of the file
+        offset = max(0, offset or 0)
+        length = min(length or ATTACHMENT_READ_BYTES, ATTACHMENT_MAX_READ_BYTES)
+        end = min(file_data.size, offset + length)
+        if end < file_data.size:
+            range_note = f"\n\nNote: Bytes {offset}-{end} of {file_data.size}. Call again with offset={end} for the rest."
+        else:
+            range_note = ""
         
         # Handle text-based files
-        elif mime_type.startswith('text/') or mime_type in ['application/json', 'application/xml']:
-            try:
-                text_content = file_data.decode('utf-8', errors='ignore')
-                return f"""Attachment: {filename}
+        if mime_type.startswith('text/') or mime_type in ['application/json', 'application/xml']:
+            text_content = file_data.read(offset, end - offset).decode('utf-8', errors='ignore')
+            yield f"""Attachment: {filename}
 Type: {mime_type}
-Size: {len(file_data)} bytes
+Size: {file_data.size} bytes
 
 --- Content ---
-{text_content}"""
-            except:
-                pass
+{text_content}{range_note}"""
+            return
         
-        # Handle image files - return base64 for potential display
-        elif mime_type.startswith('image/'):
-            b64_content = base64.b64encode(file_data).decode()
-            return f"""Attachment: {filename}
+        # Images that fit in one read go out as a data URI for display;
+        # everything else (and images read in pieces) as raw base64
+        if mime_type.startswith('image/') and offset == 0 and not range_note:
+            yield f"""Attachment: {filename}
 Type: {mime_type}
-Size: {len(file_data)} bytes
+Size: {file_data.size} bytes
 
 --- Base64 Content (for display) ---
-data:{mime_type};base64,{b64_content}"""
-        
-        # For other binary files, return base64 with size limit
+data:{mime_type};base64,"""
         else:
-            b64_content = base64.b64encode(file_data).decode()
-            if len(b64_content) > 10000:
-                return f"""Attachment: {filename}
+            yield f"""Attachment: {filename}
 Type: {mime_type}
-Size: {len(file_data)} bytes
+Size: {file_data.size} bytes
 
---- Base64 Content (truncated, first 10000 chars) ---
-{b64_content[:10000]}...
+--- Base64 Content (bytes {offset}-{end}) ---
+"""
+        yield from file_data.iter_base64(offset, end - offset)
+        yield range_note
+        return
+    
+    except Exception as e:
+        yield f"Error fetching attachment {attachment_id} from email {email_id}: {str(e)}"
+        return
 
-Note: Full content truncated. Total base64 length: {len(b64_content)} chars"""
-            else:
-                return f"""Attachment: {filename}
-Type: {mime_type}
-Size: {len(file_data)} bytes
+def receipt_pdf_text(service, email_id: str, attachment: dict) -> str:
+    """
+    Text of the first RECEIPT_PDF_PAGES pages of a PDF attachment, or ''
+    if it cannot be read (e.g. password-protected).
+    """
+    try:
+        file_data = download_attachment(service, email_id, attachment['attachment_id'], attachment['part_id'])
+        with metrics.span('extract'):
+            return "\n".join(text for _, text in get_pdf_extractor().iter_pages(
+                file_data.source, None, RECEIPT_PDF_PAGES, sha256=file_data.sha256))
+    except Exception:
+        return ''
 
---- Base64 Content ---
-{b64_content}"""
+def read_receipt(msg: dict, email_id: str) -> tuple:
+    """
+    Receipt row parsed from the body of one format='full' message, and the
+    message's PDF attachments.
+    """
+    message = read_message(msg, email_id)
+    row = parse_receipt(message['body'], message['sender'], message['subject'], int(msg.get('internalDate', 0)))
+    row.update(message_id=email_id, source='body')
+    return row, [a for a in message['attachments'] if a['mime_type'] == 'application/pdf']
+
+def read_pdf_receipt(row: dict, attachments: list, internal_date: int) -> dict:
+    """
+    Re-parse a receipt whose body names no total from its PDF attachments,
+    keeping the body's row if none of them names one either.
+    """
+    service = get_gmail_service()
+    for attachment in attachments:
+        pdf_row = parse_receipt(receipt_pdf_text(service, row['message_id'], attachment), row['sender'],
+                                row['subject'], internal_date)
+        if pdf_row['confidence'] == 'total' or (row['amount'] is None and pdf_row['amount'] is not None):
+            pdf_row.update(message_id=row['message_id'], order_id=pdf_row['order_id'] or row['order_id'],
+                           source=f"pdf:{attachment['filename']}")
+            row = pdf_row
+            if row['confidence'] == 'total':
+                break
+    return row
+
+def read_receipt_batch(message_ids: list, include_pdfs: bool, pdf_executor: ThreadPoolExecutor) -> list:
+    """
+    Fetch up to one Gmail batch of messages (cached ones are not re-fetched)
+    and return their receipt rows, in order. PDF fallbacks each download an
+    attachment, so they run side by side on `pdf_executor`.
+    """
+    service = get_gmail_service()
+    rows = []
+    pdf_rows = []
+    messages = fetch_batch(service, message_ids, 'full', format='full', **fields('full'))
+    for message_id, (msg, error) in zip(message_ids, messages):
+        try:
+            if error is not None:
+                raise error
+            row, pdfs = read_receipt(msg, message_id)
+            if include_pdfs and pdfs and row['confidence'] != 'total':
+                read_pdf = credential_store.propagate(metrics.propagate(read_pdf_receipt))
+                pdf_rows.append((len(rows), pdf_executor.submit(read_pdf, row, pdfs, int(msg.get('internalDate', 0)))))
+            rows.append(row)
+        except Exception as e:
+            rows.append({'message_id': message_id, 'error': str(e)})
+    for i, future in pdf_rows:
+        rows[i] = future.result()
+    return rows
+
+def iter_receipt_rows(query: str = "", sender: str = None, start_date: str = None, end_date: str = None, max_results: int = 500, include_pdfs: bool = True):
+    """
+    The receipt pipeline: list matching message IDs, then fetch and parse
+    them one Gmail batch at a time on RECEIPT_WORKERS threads, yielding
+    each batch's rows in list order while later batches are in flight.
+    """
+    final_query, _, _ = build_search_query(query, sender, None, None, start_date, end_date)
+    service = get_gmail_service()
+    executor = ThreadPoolExecutor(max_workers=RECEIPT_WORKERS, thread_name_prefix='receipts')
+    pdf_executor = ThreadPoolExecutor(max_workers=RECEIPT_WORKERS, thread_name_prefix='receipt-pdfs')
+    pending = deque()
+    try:
+        for ids, _ in iter_message_ids(service, final_query, min(max_results, RECEIPT_MAX_RESULTS)):
+            for start in range(0, len(ids), BATCH_CHUNK_SIZE):
+                chunk = ids[start:start + BATCH_CHUNK_SIZE]
+                read_batch = credential_store.propagate(metrics.propagate(read_receipt_batch))
+                pending.append(executor.submit(read_batch, chunk, include_pdfs, pdf_executor))
+                # Keep listing only while the workers have a batch queued
+                while len(pending) > RECEIPT_WORKERS:
+                    yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        pdf_executor.shutdown(wait=False, cancel_futures=True)
+
+def format_receipt_row(row: dict) -> str:
+    if row.get('error'):
+        return f"ID: {row['message_id']} | Error: {row['error']}"
+    if row['amount'] is None:
+        amount = "no amount found"
+    else:
+        amount = f"{row['currency']} {row['amount']:,.2f}" + (" (guess, not in totals)" if row['confidence'] == 'guess' else "")
+    notes = ""
+    if row['source'] != 'body':
+        notes += f" | from {row['source'][4:]}"
+    if row['duplicate']:
+        notes += " | duplicate, not counted"
+    elif row.get('replaces'):
+        notes += f" | counted instead of {row['replaces']}"
+    order = f"order {row['order_id']}" if row['order_id'] else "no order ID"
+    return f"{row['date']} | {row['merchant']} | {amount} | {order} | {row['subject']} | ID: {row['message_id']}{notes}"
+
+def format_amounts(amounts: dict) -> str:
+    return "; ".join(f"{currency} {entry['amount']:,.2f} ({entry['count']})" for currency, entry in sorted(amounts.items()))
+
+def format_receipt_totals(totals: ReceiptTotals) -> str:
+    lines = [
+        "--- Totals ---",
+        f"Messages read: {totals.messages} | receipts: {totals.receipts} | without amount: {totals.without_amount} | "
+        f"duplicates: {totals.duplicates} | errors: {totals.errors}",
+        f"Total: {format_amounts(totals.total) or 'none'}",
+        f"Guessed amounts, not in totals: {format_amounts(totals.guessed) or 'none'}",
+        "",
+        "--- By sender ---",
+    ]
+    lines += [f"{merchant}: {format_amounts(amounts)}" for merchant, amounts in sorted(totals.by_merchant.items())]
+    lines += ["", "--- By month ---"]
+    lines += [f"{month}: {format_amounts(amounts)}" for month, amounts in sorted(totals.by_month.items())]
+    return "\n".join(lines)
+
+@mcp.tool()
+def extract_receipts(query: str = "", sender: str = None, start_date: str = None, end_date: str = None, max_results: int = 500, include_pdfs: bool = True, output_format: str = "text") -> str:
+    """
+    Read every receipt matching a search and return one row per receipt (date, merchant,
+    amount, currency, order ID) plus totals by sender and by month.
+    
+    Args:
+        query: General search query (e.g., 'receipt OR invoice OR order').
+        sender: Filter by sender (e.g., 'swiggy', 'uber').
+        start_date: Start date (inclusive) in any common format (e.g., '2024-01-01').
+        end_date: End date (exclusive) in any common format.
+        max_results: Maximum number of emails to read.
+        include_pdfs: Read PDF attachments of mails whose body names no total.
+        output_format: 'text' (one line per receipt, then totals) or 'json'.
+    """
+    return "".join(iter_extract_receipts(query, sender, start_date, end_date, max_results, include_pdfs, output_format))
+
+def iter_extract_receipts(query: str = "", sender: str = None, start_date: str = None, end_date: str = None, max_results: int = 500, include_pdfs: bool = True, output_format: str = "text"):
+    """
+    Generator behind extract_receipts(): in text format, yields each Gmail
+    batch's rows as soon as they are parsed, then the totals.
+    """
+    totals = ReceiptTotals()
+    rows = []
+    try:
+        for batch in iter_receipt_rows(query, sender, start_date, end_date, max_results, include_pdfs):
+            for row in batch:
+                totals.add(row)
+            if output_format == 'json':
+                rows.extend(batch)
+            elif batch:
+                yield ("\n" if totals.messages > len(batch) else "") + "\n".join(format_receipt_row(r) for r in batch)
+    except Exception as e:
+        yield f"Error reading receipts: {str(e)}"
+        return
+    if output_format == 'json':
+        yield json.dumps({'receipts': rows, 'totals': totals.as_dict()}, ensure_ascii=False)
+    elif not totals.messages:
+        yield "No messages found."
+    else:
+        yield "\n\n" + format_receipt_totals(totals)
+
+@mcp.tool()
+def export_emails(filename: str, query: str = "", sender: str = None, recipient: str = None, subject: str = None, start_date: str = None, end_date: str = None, output_format: str = "jsonl", max_results: int = None, restart: bool = False) -> str:
+    """
+    Export every email matching a search to a JSONL or mbox file on the server, e.g. to
+    archive a year of receipts. Calling again with the same arguments resumes an
+    interrupted export.
     
+    Args:
+        filename: Name of the file to write in the server's export directory (e.g. 'receipts-2024.mbox').
+        query: General search query (e.g., 'receipt').
+        sender: Filter by sender (e.g., 'swiggy', 'uber').
+        recipient: Filter by recipient.
+        subject: Filter by subject line.
+        start_date: Start date (inclusive) in any common format (e.g., '2024-01-01').
+        end_date: End date (exclusive) in any common format.
+        output_format: 'jsonl' (one JSON object per message, with the raw source) or 'mbox'.
+        max_results: Maximum number of emails to export (default: all).
+        restart: Discard a previous export to this file and start over.
+    """
+    return "".join(iter_export_emails(filename, query, sender, recipient, subject, start_date, end_date, output_format, max_results, restart))
+
+def iter_export_emails(filename: str, query: str = "", sender: str = None, recipient: str = None, subject: str = None, start_date: str = None, end_date: str = None, output_format: str = "jsonl", max_results: int = None, restart: bool = False):
+    """
+    Generator behind export_emails(): yields a progress line per result page, then a summary.
+    """
+    if not filename or os.path.basename(filename) != filename or filename in ('.', '..'):
+        yield f"Error: filename must be a plain file name inside the export directory, got {filename!r}"
+        return
+    if output_format not in EXPORT_FORMATS:
+        yield f"Error: output_format must be one of {', '.join(EXPORT_FORMATS)}"
+        return
+    path = os.path.join(account_dir(EXPORT_DIR, current_account()), filename)
+    final_query, _, _ = build_search_query(query, sender, recipient, subject, start_date, end_date)
+    checkpoint = None if restart else load_checkpoint(path)
+    if checkpoint and not checkpoint['complete']:
+        yield f"Resuming export to {path} after {checkpoint['exported']} messages\n"
+    state = None
+    try:
+        for state in export_messages(path, final_query, output_format, max_results, restart):
+            # One line per finished result page (up to 500 messages)
+            if state['page_offset'] == 0 and not state['complete']:
+                yield f"Exported {state['exported']} messages ({state['bytes'] / 1e6:.1f} MB)\n"
+    except (FileExistsError, ExportMismatchError) as e:
+        yield f"Error: {str(e)}"
+        return
     except Exception as e:
-        return f"Error fetching attachment {attachment_id} from email {email_id}: {str(e)}"
+        progress = f" after {state['exported']} messages; call again to resume" if state else ""
+        yield f"Error exporting emails{progress}: {str(e)}"
+        return
+    failed = f" ({state['failed']} failed: {', '.join(state['failed_ids'])})" if state['failed'] else ""
+    yield (f"Export complete: {state['exported']} messages{failed} written to {os.path.abspath(path)} "
+           f"({state['bytes'] / 1e6:.1f} MB, {output_format}). Checkpoint: {checkpoint_path(path)}")
+
+@mcp.tool()
+def search_local_text(query: str, max_results: int = 10) -> str:
+    """
+    Full-text search over email bodies and PDF attachment text that have already been
+    fetched with get_email_content() / get_email_attachment(). Runs locally, no Gmail call.
+    
+    Args:
+        query: Words, "exact phrases", prefix* terms, combined with AND / OR / NOT.
+        max_results: Maximum number of matches to return.
+    """
+    index = get_text_index()
+    if index is None:
+        return "Local text index is disabled (GMAIL_TEXT_INDEX=0)."
+    try:
+        matches = index.search(query, max_results)
+    except sqlite3.OperationalError as e:
+        return f"Invalid search query {query!r}: {str(e)}"
+    if not matches:
+        return "No matches found in the local index."
+    output = []
+    for m in matches:
+        source = f"attachment {m['name']}" if m['kind'] == 'attachment' else 'body'
+        snippet = " ".join(m['snippet'].split())
+        output.append(f"ID: {m['message_id']}\nDate: {m['date']}\nFrom: {m['sender']}\nSubject: {m['subject']}\nMatch ({source}): {snippet}\n---")
+    return "\n".join(output)
+
+def mirror_unavailable() -> Optional[str]:
+    """
+    Why the calling request's account has no mailbox mirror, or None.
+    """
+    if not SYNC_INTERVAL_SECONDS:
+        return "Mailbox mirror is disabled (set GMAIL_SYNC_INTERVAL, and leave GMAIL_CACHE on, to enable it)."
+    if current_account() != DEFAULT_ACCOUNT:
+        return (f"The mailbox mirror only covers the default account ({DEFAULT_ACCOUNT or 'token.json'}); "
+                f"account {current_account()!r} is not mirrored.")
+    return None
+
+@mcp.tool()
+def get_sync_status() -> str:
+    """
+    Report the state of the local mailbox mirror: message count, last history ID and sync lag.
+    """
+    unavailable = mirror_unavailable()
+    if unavailable:
+        return unavailable
+    mirror = get_mailbox_mirror()
+    if mirror is None:
+        return "Mailbox mirror is disabled (set GMAIL_SYNC_INTERVAL, and leave GMAIL_CACHE on, to enable it)."
+    status = mirror.status()
+    lag = f"{status['lag_seconds']}s" if status['lag_seconds'] is not None else "never synced"
+    return f"""Mailbox mirror: {'fresh' if status['fresh'] else 'stale'}
+Label: {status['label'] or 'all mail'}
+Messages: {status['messages']}
+History ID: {status['history_id']}
+Sync lag: {lag}
+Full resyncs: {status['full_resyncs']}
+Last error: {status['last_error'] or 'none'}"""
+
+def format_size(size: int) -> str:
+    return f"{size / 1e6:,.1f} MB" if size >= 1e5 else f"{size / 1e3:,.1f} KB"
+
+@mcp.tool()
+def get_mail_stats(group_by: str = "sender", sender: str = None, label: str = None, start_date: str = None, end_date: str = None, has_attachment: bool = None, order_by: str = "count", top: int = 20) -> str:
+    """
+    Count mirrored messages by sender, sender domain, label, month or year and return the
+    largest groups (e.g. the senders with the most receipts this quarter). Runs locally on
+    the mailbox mirror's metadata, no Gmail call.
+    
+    Args:
+        group_by: 'sender', 'domain', 'label', 'month' or 'year'.
+        sender: Only count senders whose name or address contains this (e.g., 'swiggy').
+        label: Only count messages with this label ID (e.g., 'CATEGORY_PURCHASES', 'Label_12').
+        start_date: Start date (inclusive) in any common format (e.g., '2024-01-01').
+        end_date: End date (exclusive) in any common format.
+        has_attachment: Only count messages with (true) or without (false) attachments.
+        order_by: 'count' (most messages first) or 'size' (most bytes first).
+        top: Number of groups to return.
+    """
+    unavailable = mirror_unavailable()
+    if unavailable:
+        return unavailable
+    mirror = get_mailbox_mirror()
+    if mirror is None:
+        return "Mailbox mirror is disabled (set GMAIL_SYNC_INTERVAL, and leave GMAIL_CACHE on, to enable it)."
+    if not mirror.is_seeded():
+        return "Mailbox mirror is still being built; try again once get_sync_status shows messages."
+    _, start_dt, end_dt = build_search_query(start_date=start_date, end_date=end_date)
+    try:
+        result = mirror.stats().query(group_by, start_dt, end_dt, sender, label, has_attachment, order_by, top)
+    except ValueError as e:
+        return f"Error: {str(e)}"
+    status = mirror.status()
+    lag = f"synced {status['lag_seconds']:.0f}s ago" if status['lag_seconds'] is not None else "never synced"
+    coverage = ""
+    if int(status['coverage_start']):
+        coverage = f"; covers mail since {datetime.fromtimestamp(int(status['coverage_start']) / 1000):%Y-%m-%d}"
+    if not result['groups']:
+        return f"No mirrored messages match ({lag}{coverage})."
+    output = [f"{result['messages']:,} messages ({format_size(result['bytes'])}), top {len(result['groups'])} of "
+              f"{result['distinct']:,} by {group_by}; mirror {lag}{coverage}"]
+    for rank, group in enumerate(result['groups'], 1):
+        size = f" | {format_size(group['bytes'])}" if group['bytes'] is not None else ""
+        latest = datetime.fromtimestamp(group['latest'] / 1000).strftime('%Y-%m-%d')
+        output.append(f"{rank}. {group['key']} | {group['messages']:,} messages{size} | latest {latest}")
+    return "\n".join(output)
+
+TOOL_FUNCTIONS = {
+    "search_emails": search_emails,
+    "get_email_content": get_email_content,
+    "get_email_attachment": get_email_attachment,
+    "get_thread": get_thread,
+    "extract_receipts": extract_receipts,
+    "export_emails": export_emails,
+    "search_local_text": search_local_text,
+    "get_sync_status": get_sync_status,
+    "get_mail_stats": get_mail_stats,
+}
+
+# Generators behind tools that can emit partial output as notifications/progress over SSE.
+# Joining everything a generator yields gives the tool's normal result.
+STREAMING_TOOLS = {
+    "search_emails": iter_search_emails,
+    "get_email_attachment": iter_email_attachment,
+    "extract_receipts": iter_extract_receipts,
+    "export_emails": iter_export_emails,
+}
+
+# Per-message tools whose Gmail fetches are coalesced across a JSON-RPC batch:
+# tool name -> (message ID argument, message cache slot to prefetch).
+COALESCED_TOOLS = {
+    "get_email_content": ("email_id", "full"),
+    "get_email_attachment": ("email_id", "structure"),
+}
+# Optional argument of every Gmail tool: which authorized account to use.
+ACCOUNT_PROPERTY = {"type": "string", "description": "Gmail account to use, by name (see auth.py --account). Defaults to the server's account."}
+# The mailbox mirror holds the default account only; other accounts get an explanation instead
+MIRROR_ACCOUNT_PROPERTY = {"type": "string", "description": "Gmail account, by name. Only the server's default account is mirrored."}
+# Entries of one JSON-RPC batch handled at the same time.
+BATCH_CONCURRENCY = int(os.environ.get("MCP_BATCH_CONCURRENCY", 8))
+
+def sse_event(message: dict) -> str:
+    return f"event: message\ndata: {json.dumps(message)}\n\n"
+
+async def stream_tool_call(request_id, tool_name: str, arguments: dict, progress_token):
+    """
+    Run a streaming tool and send each piece of output as a
+    notifications/progress event, followed by the normal JSON-RPC response.
+    """
+    arguments = dict(arguments)
+    account = arguments.pop("account", None)
+    try:
+        check_account(account)
+    except UnknownAccountError as e:
+        return JSONResponse({
+            "jsonrpc": "2.0",
+            "id": request_id,
+            "error": {"code": -32602, "message": str(e)}
+        })
+    gen_fn = credential_store.using_account_generator(account, STREAMING_TOOLS[tool_name])
+    chunks = tool_runner.stream(tool_name, gen_fn, arguments)
+    # Pull the first chunk before committing to SSE so busy/timeout errors stay plain JSON
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except ToolBusyError as e:
+        return JSONResponse({
+            "jsonrpc": "2.0",
+            "id": request_id,
+            "error": {"code": -32000, "message": f"Server busy: {str(e)}. Retry later."}
+        })
+    except asyncio.TimeoutError:
+        return JSONResponse({
+            "jsonrpc": "2.0",
+            "id": request_id,
+            "error": {"code": -32001, "message": f"Tool {tool_name} timed out"}
+        })
+
+    async def event_generator():
+        output = []
+        chunk = first
+        try:
+            while chunk is not None:
+                output.append(chunk)
+                yield sse_event({
+                    "jsonrpc": "2.0",
+                    "method": "notifications/progress",
+                    "params": {
+                        "progressToken": progress_token,
+                        "progress": len(output),
+                        "message": chunk,
+                    }
+                })
+                chunk = await anext(chunks, None)
+        except Exception as e:
+            yield sse_event({
+                "jsonrpc": "2.0",
+                "id": request_id,
+                "error": {"code": -32603, "message": f"Internal error: {str(e)}"}
+            })
+            return
+        finally:
+            await chunks.aclose()
+        yield sse_event({
+            "jsonrpc": "2.0",
+            "id": request_id,
+            "result": {"content": [{"type": "text", "text": "".join(output)}]}
+        })
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"}
+    )
+
+async def prefetch_batch(messages: list):
+    """
+    Fetch the messages that the batch's per-message tool calls will read
+    with one Gmail batch request per account and cache slot.
+    """
+    ids_by_slot = {}
+    for message in messages:
+        if not isinstance(message, dict) or message.get("method") != "tools/call":
+            continue
+        params = message.get("params") or {}
+        arguments = params.get("arguments") or {}
+        argument, slot = COALESCED_TOOLS.get(params.get("name"), (None, None))
+        message_id = arguments.get(argument) if argument else None
+        account = arguments.get("account")
+        if isinstance(message_id, str) and (account is None or isinstance(account, str)):
+            ids_by_slot.setdefault((account, slot), []).append(message_id)
+    jobs = [
+        tool_runner.run("prefetch_messages", credential_store.using_account(account, prefetch_messages),
+                        {"message_ids": ids, "slot": slot})
+        for (account, slot), ids in ids_by_slot.items() if len(ids) > 1
+    ]
+    # Best effort: on failure each call simply fetches its own message
+    await asyncio.gather(*jobs, return_exceptions=True)
+
+async def handle_rpc_batch(messages: list):
+    """
+    Handle a JSON-RPC 2.0 batch: entries run concurrently (at most
+    BATCH_CONCURRENCY at a time) and responses come back in request order.
+    Notifications (entries without an id) get no response.
+
+    A batch never has more calls on a tool pool than the pool has workers;
+    the rest wait their turn instead of being turned away as busy by the
+    batch's own calls.
+    """
+    if not messages:
+        return JSONResponse({
+            "jsonrpc": "2.0",
+            "id": None,
+            "error": {"code": -32600, "message": "Invalid Request: empty batch"}
+        })
+
+    await prefetch_batch(messages)
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    pool_slots = {name: asyncio.Semaphore(pool.workers) for name, pool in tool_runner.pools.items()}
+
+    async def handle(message):
+        if not isinstance(message, dict):
+            return {"jsonrpc": "2.0", "id": None, "error": {"code": -32600, "message": "Invalid Request"}}
+        params = message.get("params") if message.get("method") == "tools/call" else None
+        tool_name = params.get("name") if isinstance(params, dict) else None
+        tool_name = tool_name if isinstance(tool_name, str) else None
+        async with pool_slots[tool_runner.pool_for(tool_name).name], semaphore:
+            response = await handle_rpc(message)
+        return response if "id" in message else None
+
+    responses = await asyncio.gather(*(handle(message) for message in messages))
+    responses = [response for response in responses if response is not None]
+    if not responses:
+        return Response(status_code=202)
+    return JSONResponse(responses)
 
 @app.post("/mcp")
 async def mcp_handler(request: FastAPIRequest):
     """Handle MCP requests over HTTP"""
     try:
         body = await request.json()
-        
+    except ValueError as e:
+        return JSONResponse({
+            "jsonrpc": "2.0",
+            "id": None,
+            "error": {"code": -32700, "message": f"Parse error: {str(e)}"}
+        })
+    
+    if isinstance(body, list):
+        return await handle_rpc_batch(body)
+    if not isinstance(body, dict):
+        return JSONResponse({"jsonrpc": "2.0", "id": None, "error": {"code": -32600, "message": "Invalid Request"}})
+    
+    # Stream results over SSE when the client asked for progress and accepts it
+    if body.get("method") == "tools/call":
+        params = body.get("params") or {}
+        tool_name = params.get("name")
+        progress_token = (params.get("_meta") or {}).get("progressToken")
+        if (tool_name in STREAMING_TOOLS and progress_token is not None
+                and "text/event-stream" in request.headers.get("accept", "")):
+            return await stream_tool_call(body.get("id"), tool_name, params.get("arguments", {}), progress_token)
+    
+    return JSONResponse(await handle_rpc(body))
+
+async def handle_rpc(body: dict) -> dict:
+    """Handle one (non-streaming) JSON-RPC request and return its response"""
+    try:
         # Route to appropriate MCP method
         method = body.get("method")
         request_id = body.get("id")
@@ -420,7 +1288,9 @@ async def mcp_handler(request: FastAPIRequest):
                                     "subject": {"type": "string", "description": "Filter by subject line."},
                                     "start_date": {"type": "string", "description": "Start date (inclusive) in any common format (e.g., '2024-01-01', 'last week')."},
                                     "end_date": {"type": "string", "description": "End date (exclusive) in any common format."},
-                                    "max_results": {"type": "integer", "description": "Maximum number of emails to return."}
+                                    "max_results": {"type": "integer", "description": "Maximum number of emails to return."},
+                                    "page_token": {"type": "string", "description": "Continue a previous search from its \"Next page token\"."},
+                                    "account": ACCOUNT_PROPERTY
                                 }
                             }
                         },
@@ -430,23 +1300,119 @@ async def mcp_handler(request: FastAPIRequest):
                             "inputSchema": {
                                 "type": "object",
                                 "properties": {
-                                    "email_id": {"type": "string", "description": "The Gmail message ID (from search_emails results)."}
+                                    "email_id": {"type": "string", "description": "The Gmail message ID (from search_emails results)."},
+                                    "account": ACCOUNT_PROPERTY
                                 },
                                 "required": ["email_id"]
                             }
                         },
                         {
                             "name": "get_email_attachment",
-                            "description": "Download and read an email attachment. For PDFs, extracts text content. For other files, returns base64-encoded content.",
+                            "description": "Download and read an email attachment. For PDFs, extracts text content. For other files, returns a range of the content (text as-is, binaries as base64).",
                             "inputSchema": {
                                 "type": "object",
                                 "properties": {
                                     "email_id": {"type": "string", "description": "The Gmail message ID."},
                                     "attachment_id": {"type": "string", "description": "The attachment ID (from get_email_content results)."},
-                                    "password": {"type": "string", "description": "Optional password for password-protected PDF files."}
+                                    "password": {"type": "string", "description": "Optional password for password-protected PDF files."},
+                                    "pages": {"type": "string", "description": "Optional PDF page selection, e.g. '1-3,7' (default: all pages)."},
+                                    "offset": {"type": "integer", "description": "For non-PDF files, the byte offset to start reading from."},
+                                    "length": {"type": "integer", "description": "For non-PDF files, the number of bytes to read (default and maximum are configurable)."},
+                                    "account": ACCOUNT_PROPERTY
                                 },
                                 "required": ["email_id", "attachment_id"]
                             }
+                        },
+                        {
+                            "name": "get_thread",
+                            "description": "Get every message of an email conversation in one call (e.g. an order and its updates, or a receipt dispute). Quoted replies and paragraphs repeated from earlier messages are left out, so each message shows only what it added.",
+                            "inputSchema": {
+                                "type": "object",
+                                "properties": {
+                                    "thread_id": {"type": "string", "description": "The Gmail thread ID, or the ID of any message in the thread (from search_emails results)."},
+                                    "account": ACCOUNT_PROPERTY
+                                },
+                                "required": ["thread_id"]
+                            }
+                        },
+                        {
+                            "name": "extract_receipts",
+                            "description": "Read every receipt matching a search and return one row per receipt (date, merchant, amount, currency, order ID) plus totals by sender and by month.",
+                            "inputSchema": {
+                                "type": "object",
+                                "properties": {
+                                    "query": {"type": "string", "description": "General search query (e.g., 'receipt OR invoice OR order')."},
+                                    "sender": {"type": "string", "description": "Filter by sender (e.g., 'swiggy', 'uber')."},
+                                    "start_date": {"type": "string", "description": "Start date (inclusive) in any common format (e.g., '2024-01-01')."},
+                                    "end_date": {"type": "string", "description": "End date (exclusive) in any common format."},
+                                    "max_results": {"type": "integer", "description": "Maximum number of emails to read."},
+                                    "include_pdfs": {"type": "boolean", "description": "Read PDF attachments of mails whose body names no total."},
+                                    "output_format": {"type": "string", "enum": ["text", "json"], "description": "'text' (one line per receipt, then totals) or 'json'."},
+                                    "account": ACCOUNT_PROPERTY
+                                }
+                            }
+                        },
+                        {
+                            "name": "export_emails",
+                            "description": "Export every email matching a search to a JSONL or mbox file on the server, e.g. to archive a year of receipts. Calling again with the same arguments resumes an interrupted export.",
+                            "inputSchema": {
+                                "type": "object",
+                                "properties": {
+                                    "filename": {"type": "string", "description": "Name of the file to write in the server's export directory (e.g. 'receipts-2024.mbox')."},
+                                    "query": {"type": "string", "description": "General search query (e.g., 'receipt')."},
+                                    "sender": {"type": "string", "description": "Filter by sender (e.g., 'swiggy', 'uber')."},
+                                    "recipient": {"type": "string", "description": "Filter by recipient."},
+                                    "subject": {"type": "string", "description": "Filter by subject line."},
+                                    "start_date": {"type": "string", "description": "Start date (inclusive) in any common format (e.g., '2024-01-01')."},
+                                    "end_date": {"type": "string", "description": "End date (exclusive) in any common format."},
+                                    "output_format": {"type": "string", "enum": ["jsonl", "mbox"], "description": "'jsonl' (one JSON object per message, with the raw source) or 'mbox'."},
+                                    "max_results": {"type": "integer", "description": "Maximum number of emails to export (default: all)."},
+                                    "restart": {"type": "boolean", "description": "Discard a previous export to this file and start over."},
+                                    "account": ACCOUNT_PROPERTY
+                                },
+                                "required": ["filename"]
+                            }
+                        },
+                        {
+                            "name": "search_local_text",
+                            "description": "Full-text search over email bodies and PDF attachment text that have already been fetched with get_email_content() / get_email_attachment(). Runs locally, no Gmail call.",
+                            "inputSchema": {
+                                "type": "object",
+                                "properties": {
+                                    "query": {"type": "string", "description": "Words, \"exact phrases\", prefix* terms, combined with AND / OR / NOT."},
+                                    "max_results": {"type": "integer", "description": "Maximum number of matches to return."},
+                                    "account": ACCOUNT_PROPERTY
+                                },
+                                "required": ["query"]
+                            }
+                        },
+                        {
+                            "name": "get_sync_status",
+                            "description": "Report the state of the local mailbox mirror: message count, last history ID and sync lag.",
+                            "inputSchema": {
+                                "type": "object",
+                                "properties": {
+                                    "account": MIRROR_ACCOUNT_PROPERTY
+                                }
+                            }
+                        },
+                        {
+                            "name": "get_mail_stats",
+                            "description": "Count mirrored messages by sender, sender domain, label, month or year and return the largest groups (e.g. the senders with the most receipts this quarter). Runs locally on the mailbox mirror's metadata, no Gmail call.",
+                            "inputSchema": {
+                                "type": "object",
+                                "properties": {
+                                    "group_by": {"type": "string", "enum": list(STATS_GROUPS), "description": "What to count messages by (default: sender)."},
+                                    "sender": {"type": "string", "description": "Only count senders whose name or address contains this (e.g., 'swiggy')."},
+                                    "label": {"type": "string", "description": "Only count messages with this label ID (e.g., 'CATEGORY_PURCHASES', 'Label_12')."},
+                                    "start_date": {"type": "string", "description": "Start date (inclusive) in any common format (e.g., '2024-01-01')."},
+                                    "end_date": {"type": "string", "description": "End date (exclusive) in any common format."},
+                                    "has_attachment": {"type": "boolean", "description": "Only count messages with (true) or without (false) attachments."},
+                                    "order_by": {"type": "string", "enum": list(STATS_ORDERS), "description": "'count' (most messages first) or 'size' (most bytes first)."},
+                                    "top": {"type": "integer", "description": "Number of groups to return (default: 20)."},
+                                    "account": MIRROR_ACCOUNT_PROPERTY
+                                }
+                            }
                         }
                     ]
                 }
@@ -454,21 +1420,41 @@ async def mcp_handler(request: FastAPIRequest):
         elif method == "tools/call":
             params = body.get("params", {})
             tool_name = params.get("name")
-            arguments = params.get("arguments", {})
+            arguments = dict(params.get("arguments", {}))
+            # Every tool takes an optional account; the tool itself never sees it
+            account = arguments.pop("account", None)
             
-            # Call the appropriate tool
-            if tool_name == "search_emails":
-                result = search_emails(**arguments)
-            elif tool_name == "get_email_content":
-                result = get_email_content(**arguments)
-            elif tool_name == "get_email_attachment":
-                result = get_email_attachment(**arguments)
-            else:
-                return JSONResponse({
+            tool = TOOL_FUNCTIONS.get(tool_name)
+            if tool is None:
+                return {
                     "jsonrpc": "2.0",
                     "id": request_id,
                     "error": {"code": -32601, "message": f"Unknown tool: {tool_name}"}
-                })
+                }
+            try:
+                check_account(account)
+            except UnknownAccountError as e:
+                return {
+                    "jsonrpc": "2.0",
+                    "id": request_id,
+                    "error": {"code": -32602, "message": str(e)}
+                }
+            
+            # Run the (blocking) tool on its bounded pool so the event loop stays free
+            try:
+                result = await tool_runner.run(tool_name, credential_store.using_account(account, tool), arguments)
+            except ToolBusyError as e:
+                return {
+                    "jsonrpc": "2.0",
+                    "id": request_id,
+                    "error": {"code": -32000, "message": f"Server busy: {str(e)}. Retry later."}
+                }
+            except asyncio.TimeoutError:
+                return {
+                    "jsonrpc": "2.0",
+                    "id": request_id,
+                    "error": {"code": -32001, "message": f"Tool {tool_name} timed out"}
+                }
             
             return {
                 "jsonrpc": "2.0",
@@ -491,25 +1477,111 @@ async def mcp_handler(request: FastAPIRequest):
                 }
             }
         else:
-            return JSONResponse({
+            return {
                 "jsonrpc": "2.0",
                 "id": request_id,
                 "error": {"code": -32601, "message": f"Unknown method: {method}"}
-            })
+            }
     except Exception as e:
         import traceback
         traceback.print_exc()
-        return JSONResponse({
+        return {
             "jsonrpc": "2.0",
-            "id": body.get("id") if 'body' in dir() else None,
+            "id": body.get("id"),
             "error": {"code": -32603, "message": f"Internal error: {str(e)}"}
-        })
+        }
+
+@app.middleware("http")
+async def track_in_flight(request: FastAPIRequest, call_next):
+    metrics.REQUESTS_IN_FLIGHT.inc()
+    try:
+        return await call_next(request)
+    finally:
+        metrics.REQUESTS_IN_FLIGHT.dec()
+
+@metrics.register_collector
+def cache_metrics() -> list:
+    """
+    Hit/miss counters of the local caches and other component stats, read at scrape time.
+    """
+    hits, misses = [], []
+    cache = get_message_cache()
+    if cache:
+        cache_stats = cache.stats()
+        hits += [({"cache": "message", "tier": "memory"}, cache_stats["hits_memory"]),
+                 ({"cache": "message", "tier": "disk"}, cache_stats["hits_disk"])]
+        misses.append(({"cache": "message"}, cache_stats["misses"]))
+    store = get_attachment_store()
+    if store:
+        store_stats = store.stats()
+        hits.append(({"cache": "attachment", "tier": "disk"}, store_stats["hits"]))
+        misses.append(({"cache": "attachment"}, store_stats["misses"]))
+    pdf_stats = pdf_text_stats()
+    if pdf_stats:
+        hits.append(({"cache": "pdf_text", "tier": "disk"}, pdf_stats["page_hits"]))
+        misses.append(({"cache": "pdf_text"}, pdf_stats["page_misses"]))
+    html_stats = html_text_stats()
+    hits.append(({"cache": "html_text", "tier": "memory"}, html_stats["memo_hits"]))
+    misses.append(({"cache": "html_text"}, html_stats["memo_misses"]))
+
+    ratios = []
+    for labels, missed in misses:
+        hit = sum(value for hit_labels, value in hits if hit_labels["cache"] == labels["cache"])
+        ratios.append((labels, hit / (hit + missed) if hit + missed else 0.0))
+
+    # Gmail's quota is per user, so each account has its own limiter
+    limiters = [({"account": account or "default"}, limiter.stats()) for account, limiter in rate_limiters().items()]
+    flights = single_flight_stats()
+    pools = tool_runner.stats()
+    return [
+        ("cache_hits_total", "counter", "Local cache hits.", hits),
+        ("cache_misses_total", "counter", "Local cache misses.", misses),
+        ("cache_hit_ratio", "gauge", "Hits / lookups since start.", ratios),
+        ("single_flight_deduplicated_total", "counter", "Calls that joined an identical in-flight call.",
+         [({"group": name}, group["deduplicated"]) for name, group in flights.items()]),
+        ("gmail_quota_units_total", "counter", "Gmail quota units spent.",
+         [(labels, limiter["quota_units"]) for labels, limiter in limiters]),
+        ("gmail_retries_total", "counter", "Gmail calls retried after throttling or 5xx.",
+         [(labels, limiter["retries"]) for labels, limiter in limiters]),
+        ("gmail_throttled_total", "counter", "Gmail responses that were rate limits or 5xx.",
+         [(labels, limiter["throttled"]) for labels, limiter in limiters]),
+        ("gmail_concurrency_limit", "gauge", "Current adaptive limit on concurrent Gmail calls.",
+         [(labels, limiter["concurrency_limit"]) for labels, limiter in limiters]),
+        ("gmail_calls_in_flight", "gauge", "Gmail HTTP calls in progress.",
+         [(labels, limiter["in_flight"]) for labels, limiter in limiters]),
+        ("tool_pool_pending", "gauge", "Calls queued or running per tool pool.",
+         [({"pool": name}, pool["pending"]) for name, pool in pools.items()]),
+    ]
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus text-format metrics"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/healthz")
 async def health():
     """Health check endpoint"""
     return {"status": "ok"}
 
+@app.get("/stats")
+async def stats():
+    """Cache and worker pool counters"""
+    cache = get_message_cache()
+    mirror = get_mailbox_mirror()
+    index = get_text_index()
+    store = get_attachment_store()
+    return {
+        "message_cache": cache.stats() if cache else None,
+        "mailbox_mirror": mirror.status() if mirror else None,
+        "text_index": index.stats() if index else None,
+        "attachment_store": store.stats() if store else None,
+        "html_text": html_text_stats(),
+        "single_flight": single_flight_stats(),
+        "accounts": list_accounts(),
+        "gmail_rate_limit": {account or "default": limiter.stats() for account, limiter in rate_limiters().items()},
+        "tool_pools": tool_runner.stats(),
+    }
+
 @app.get("/mcp")
 async def handle_sse(request: FastAPIRequest):
     """
@@ -536,6 +1608,26 @@ async def handle_sse(request: FastAPIRequest):
         }
     )
 
-if __name__ == "__main__":
+def warm_up_gmail():
+    """
+    Load the Gmail discovery document so the first tool call skips it.
+    """
+    get_service_pool()._get_discovery()
+
+
+def main():
+    import uvicorn
+
+    class Server(uvicorn.Server):
+        async def startup(self, sockets=None):
+            await super().startup(sockets=sockets)
+            # Only once the port is bound, so warm-up never delays /healthz
+            if WARMUP_ENABLED and LAZY_IMPORTS and not self.should_exit:
+                start_warmup(warm_up_gmail)
+
     port = int(os.environ.get("PORT", 3001))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    Server(uvicorn.Config(app, host="0.0.0.0", port=port)).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import threading
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapses concurrent identical operations into one.
+
+    do(key, fn) runs fn() once for all callers that arrive with the same key
+    while it is still running; they all get its result (or exception).
+    Nothing is remembered once the call finishes; caching is left to the
+    message cache and attachment store.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.executed = 0
+        self.deduplicated = 0
+        self._calls = {}
+        self._futures = {}
+        self._lock = threading.Lock()
+        with _groups_lock:
+            _groups[name] = self
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                self.deduplicated += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def acquire_future(self, key, submit):
+        """
+        Future-based variant for work handed to an executor: return the
+        in-flight Future for `key`, or the one from submit(). Every caller
+        must call release_future(key) when it no longer needs the result.
+        """
+        with self._lock:
+            entry = self._futures.get(key)
+            if entry is not None and not entry[0].cancelled():
+                entry[1] += 1
+                self.deduplicated += 1
+                return entry[0]
+            future = submit()
+            self._futures[key] = [future, 1]
+            self.executed += 1
+            return future
+
+    def release_future(self, key) -> bool:
+        """
+        Drop one reference; returns True (and forgets the future) if the
+        caller was the last one, i.e. it may cancel the future.
+        """
+        with self._lock:
+            entry = self._futures.get(key)
+            if entry is None:
+                return False
+            entry[1] -= 1
+            if entry[1] > 0:
+                return False
+            del self._futures[key]
+            return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'executed': self.executed,
+                'deduplicated': self.deduplicated,
+                'in_flight': len(self._calls) + len(self._futures),
+            }
+
+
+_groups = {}
+_groups_lock = threading.Lock()
+
+
+def stats() -> dict:
+    """
+    Counters for every SingleFlight group, by name.
+    """
+    with _groups_lock:
+        groups = list(_groups.values())
+    return {group.name: group.stats() for group in groups}
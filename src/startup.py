@@ -0,0 +1,99 @@
+import os
+import time
+import logging
+import importlib
+import threading
+
+# LAZY_IMPORTS=0 imports every heavy dependency at server start (the old
+# behaviour); by default each is imported by the first tool call needing it.
+LAZY_IMPORTS = os.environ.get("LAZY_IMPORTS", "1") != "0"
+# Preload the deferred dependencies in a background thread once the port is bound.
+WARMUP_ENABLED = os.environ.get("WARMUP", "1") != "0"
+
+# Dependencies that are slow to import and not needed to answer /healthz.
+HEAVY_MODULES = [
+    'mcp.server.fastmcp',
+    'dateparser',
+    'googleapiclient.discovery',
+    'googleapiclient.http',
+    'google_auth_httplib2',
+    'google.auth.transport.requests',
+    'google.oauth2.credentials',
+    'bs4',
+    'pdfplumber',
+]
+
+logger = logging.getLogger(__name__)
+
+
+def preload_modules(modules: list = HEAVY_MODULES) -> dict:
+    """
+    Import each module and return {module: seconds spent}. Modules that
+    fail to import are skipped; the tool using them reports the error.
+    """
+    timings = {}
+    for name in modules:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            logger.warning("warm-up could not import %s: %s", name, e)
+            continue
+        timings[name] = time.perf_counter() - start
+    return timings
+
+
+def start_warmup(extra=None) -> threading.Thread:
+    """
+    Preload HEAVY_MODULES in a daemon thread, then call `extra()` if given
+    (e.g. to load the Gmail discovery document).
+    """
+    def warm_up():
+        start = time.perf_counter()
+        preload_modules()
+        if extra is not None:
+            try:
+                extra()
+            except Exception as e:
+                logger.warning("warm-up step failed: %s", e)
+        logger.info("warm-up finished in %.2fs", time.perf_counter() - start)
+
+    thread = threading.Thread(target=warm_up, name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+class LazyFastMCP:
+    """
+    Stand-in for FastMCP that records @tool() registrations and only imports
+    and builds the real server (the single slowest import here) when one of
+    its other attributes is first used.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._tools = []
+        self._server = None
+        self._lock = threading.Lock()
+
+    def tool(self, *args, **kwargs):
+        def register(fn):
+            with self._lock:
+                self._tools.append((fn, args, kwargs))
+                if self._server is not None:
+                    self._server.tool(*args, **kwargs)(fn)
+            return fn
+        return register
+
+    def _get_server(self):
+        with self._lock:
+            if self._server is None:
+                from mcp.server.fastmcp import FastMCP
+                server = FastMCP(self.name)
+                for fn, args, kwargs in self._tools:
+                    server.tool(*args, **kwargs)(fn)
+                self._server = server
+            return self._server
+
+    def __getattr__(self, name):
+        return getattr(self._get_server(), name)
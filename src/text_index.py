@@ -0,0 +1,163 @@
+import os
+import time
+import sqlite3
+import threading
+from message_cache import CACHE_DIR, CACHE_ENABLED
+from credential_store import current_account, account_dir
+
+TEXT_INDEX_ENABLED = CACHE_ENABLED and os.environ.get("GMAIL_TEXT_INDEX", "1") != "0"
+# Retention: keep at most this many documents, and drop messages older than
+# the age limit (by message date, 0 = no age limit).
+TEXT_INDEX_MAX_DOCS = int(os.environ.get("GMAIL_TEXT_INDEX_MAX_DOCS", 50000))
+TEXT_INDEX_MAX_AGE_SECONDS = int(os.environ.get("GMAIL_TEXT_INDEX_MAX_AGE_DAYS", 365)) * 86400
+# Retention is enforced every this many inserts rather than on every insert.
+PRUNE_EVERY = 100
+
+
+class TextIndex:
+    """
+    SQLite FTS5 index over email bodies and extracted attachment text.
+
+    Each document is either a message body (kind='body') or one attachment
+    (kind='attachment'), and is indexed at most once.
+    """
+
+    def __init__(self, path: str, max_docs: int = TEXT_INDEX_MAX_DOCS,
+                 max_age_seconds: int = TEXT_INDEX_MAX_AGE_SECONDS):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.max_docs = max_docs
+        self.max_age_seconds = max_age_seconds
+        self._inserts = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                id INTEGER PRIMARY KEY,
+                message_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                name TEXT NOT NULL DEFAULT '',
+                sender TEXT,
+                subject TEXT,
+                date TEXT,
+                message_date INTEGER,
+                indexed_at REAL,
+                UNIQUE (message_id, kind, name)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS documents_message_date ON documents (message_date)")
+        self._conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+                subject, sender, name, body, tokenize = 'unicode61 remove_diacritics 2'
+            )
+        """)
+        self._conn.commit()
+
+    def contains(self, message_id: str, kind: str = 'body', name: str = '') -> bool:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM documents WHERE message_id = ? AND kind = ? AND name = ?",
+                (message_id, kind, name)).fetchone() is not None
+
+    def add(self, message_id: str, body: str, kind: str = 'body', name: str = '', sender: str = '',
+            subject: str = '', date: str = '', message_date: int = None):
+        """
+        Index one document, replacing any previous copy of it.
+        """
+        if not body:
+            return
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM documents WHERE message_id = ? AND kind = ? AND name = ?",
+                (message_id, kind, name)).fetchone()
+            if row:
+                self._delete(row[0])
+            cursor = self._conn.execute(
+                "INSERT INTO documents (message_id, kind, name, sender, subject, date, message_date, indexed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (message_id, kind, name, sender, subject, date, message_date, time.time()))
+            self._conn.execute(
+                "INSERT INTO documents_fts (rowid, subject, sender, name, body) VALUES (?, ?, ?, ?, ?)",
+                (cursor.lastrowid, subject, sender, name, body))
+            self._inserts += 1
+            if self._inserts % PRUNE_EVERY == 0:
+                self._prune()
+            self._conn.commit()
+
+    def _delete(self, doc_id: int):
+        self._conn.execute("DELETE FROM documents WHERE id = ?", (doc_id,))
+        self._conn.execute("DELETE FROM documents_fts WHERE rowid = ?", (doc_id,))
+
+    def _prune(self):
+        doomed = []
+        if self.max_age_seconds:
+            cutoff = int((time.time() - self.max_age_seconds) * 1000)
+            doomed += [r[0] for r in self._conn.execute(
+                "SELECT id FROM documents WHERE message_date < ?", (cutoff,))]
+        count = self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0] - len(doomed)
+        if count > self.max_docs:
+            doomed += [r[0] for r in self._conn.execute(
+                "SELECT id FROM documents ORDER BY COALESCE(message_date, 0), id LIMIT ?",
+                (count - self.max_docs,))]
+        for doc_id in set(doomed):
+            self._delete(doc_id)
+
+    def prune(self):
+        """
+        Enforce the retention limits now.
+        """
+        with self._lock:
+            self._prune()
+            self._conn.commit()
+
+    def search(self, query: str, max_results: int = 10) -> list:
+        """
+        Run an FTS5 query (words, "exact phrases", prefix*, AND/OR/NOT) and
+        return the best matches by bm25 rank, each with a highlighted snippet.
+        Raises sqlite3.OperationalError on malformed queries.
+        """
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT d.message_id, d.kind, d.name, d.sender, d.subject, d.date,
+                       snippet(documents_fts, 3, '[', ']', '...', 16)
+                FROM documents_fts
+                JOIN documents d ON d.id = documents_fts.rowid
+                WHERE documents_fts MATCH ?
+                ORDER BY bm25(documents_fts, 4.0, 2.0, 2.0, 1.0)
+                LIMIT ?
+            """, (query, max_results)).fetchall()
+        return [
+            {'message_id': r[0], 'kind': r[1], 'name': r[2], 'sender': r[3],
+             'subject': r[4], 'date': r[5], 'snippet': r[6]}
+            for r in rows
+        ]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'documents': self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0],
+                'max_documents': self.max_docs,
+            }
+
+
+# account name -> TextIndex
+_indexes = {}
+_index_lock = threading.Lock()
+
+
+def get_text_index():
+    """
+    Return the current account's text index, or None if GMAIL_TEXT_INDEX or GMAIL_CACHE is 0.
+    """
+    if not TEXT_INDEX_ENABLED:
+        return None
+    account = current_account()
+    index = _indexes.get(account)
+    if index is None:
+        with _index_lock:
+            index = _indexes.get(account)
+            if index is None:
+                index = _indexes[account] = TextIndex(
+                    os.path.join(account_dir(CACHE_DIR, account), 'text_index.sqlite3'))
+    return index
@@ -0,0 +1,115 @@
+import re
+import hashlib
+
+# Paragraphs shorter than this ("Thanks,", "Yes") are never treated as repeats.
+MIN_REPEAT_CHARS = 40
+
+# "On Mon, 1 Jan 2024 at 10:00, Swiggy <noreply@swiggy.in> wrote:" (often wrapped)
+ATTRIBUTION = re.compile(r'^\s*On\b.{0,300}\bwrote:\s*$', re.I | re.S)
+ORIGINAL_MESSAGE = re.compile(r'^\s*-{2,}\s*Original Message\s*-{2,}\s*$', re.I)
+FORWARDED = re.compile(r'^\s*-{2,}\s*Forwarded message\s*-{2,}\s*$', re.I)
+# Outlook-style reply header: "From: ..." followed shortly by "Sent: ..." or "Date: ..."
+HEADER_FROM = re.compile(r'^\s*\*?From:\*?\s', re.I)
+HEADER_SENT = re.compile(r'^\s*\*?(Sent|Date):\*?\s', re.I)
+SEPARATOR = re.compile(r'^\s*_{8,}\s*$')
+
+
+def strip_quoted(text: str) -> tuple:
+    """
+    Remove the quoted earlier messages from a reply: '>' lines, and
+    everything from an attribution line ("On ... wrote:", "-----Original
+    Message-----", an Outlook From:/Sent: block) onwards. Forwarded
+    messages are kept, since their content is new to the thread.
+
+    Returns (text, whether anything was removed).
+    """
+    lines = text.splitlines()
+    kept = []
+    stripped = False
+    forwarded = False
+    for i, line in enumerate(lines):
+        if FORWARDED.match(line):
+            forwarded = True
+        if not forwarded and _starts_quote(lines, i):
+            stripped = True
+            break
+        if line.lstrip().startswith('>'):
+            stripped = True
+            continue
+        kept.append(line)
+    while kept and not kept[-1].strip():
+        kept.pop()
+    return '\n'.join(kept), stripped
+
+
+def _starts_quote(lines: list, i: int) -> bool:
+    line = lines[i]
+    if ORIGINAL_MESSAGE.match(line):
+        return True
+    if ATTRIBUTION.match(line) or (i + 1 < len(lines) and line.lstrip().startswith('On ')
+                                   and ATTRIBUTION.match(f"{line} {lines[i + 1]}")):
+        return True
+    if HEADER_FROM.match(line) and any(HEADER_SENT.match(l) for l in lines[i + 1:i + 4]):
+        # Outlook puts a rule or a blank line above the header block
+        return i == 0 or not lines[i - 1].strip() or SEPARATOR.match(lines[i - 1]) is not None
+    return False
+
+
+class RepeatFilter:
+    """
+    Drops paragraphs already seen earlier in a thread (signatures, legal
+    footers, order summaries repeated in every update), so a thread's
+    output grows with new content rather than with its length.
+    """
+
+    def __init__(self, min_chars: int = MIN_REPEAT_CHARS):
+        self.min_chars = min_chars
+        self._seen = set()
+
+    @staticmethod
+    def _key(text: str) -> tuple:
+        normalized = ' '.join(text.split()).lower()
+        return normalized, hashlib.blake2b(normalized.encode('utf-8'), digest_size=16).digest()
+
+    def filter(self, text: str, by_line: bool = False) -> tuple:
+        """
+        Returns (text without repeated paragraphs, number dropped).
+
+        Text converted from HTML has one block per line and no blank lines
+        between paragraphs, so with `by_line` a paragraph is any run of
+        consecutive lines that all appeared in earlier messages: a repeated
+        order table or footer goes, a lone repeated "Thanks" stays.
+        """
+        if by_line:
+            return self._filter_lines(text)
+        kept = []
+        dropped = 0
+        for paragraph in re.split(r'\n\s*\n', text):
+            normalized, key = self._key(paragraph)
+            if len(normalized) >= self.min_chars:
+                if key in self._seen:
+                    dropped += 1
+                    continue
+                self._seen.add(key)
+            if paragraph.strip():
+                kept.append(paragraph.strip('\n'))
+        return '\n\n'.join(kept), dropped
+
+    def _filter_lines(self, text: str) -> tuple:
+        lines = [line for line in text.splitlines() if line.strip()]
+        keys = [self._key(line) for line in lines]
+        repeated = [key in self._seen for _, key in keys]
+        self._seen.update(key for _, key in keys)
+        kept = []
+        dropped = 0
+        i = 0
+        while i < len(lines):
+            j = i
+            while j < len(lines) and repeated[j]:
+                j += 1
+            if j > i and sum(len(normalized) for normalized, _ in keys[i:j]) >= self.min_chars:
+                dropped += 1
+            else:
+                kept.extend(lines[i:max(j, i + 1)])
+            i = max(j, i + 1)
+        return '\n'.join(kept), dropped
@@ -0,0 +1,178 @@
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+
+# Cheap Gmail-bound tools share the default pool; attachment downloads and PDF
+# extraction get their own smaller pool so they cannot starve searches.
+DEFAULT_WORKERS = int(os.environ.get("TOOL_WORKERS", 8))
+DEFAULT_QUEUE_DEPTH = int(os.environ.get("TOOL_QUEUE_DEPTH", 32))
+ATTACHMENT_WORKERS = int(os.environ.get("ATTACHMENT_WORKERS", 2))
+ATTACHMENT_QUEUE_DEPTH = int(os.environ.get("ATTACHMENT_QUEUE_DEPTH", 4))
+TOOL_TIMEOUT_SECONDS = float(os.environ.get("TOOL_TIMEOUT", 120))
+# Bulk tools (year-end receipt runs, exports) take minutes, so they get one slot of
+# their own and a longer timeout.
+BULK_WORKERS = int(os.environ.get("BULK_WORKERS", 1))
+BULK_QUEUE_DEPTH = int(os.environ.get("BULK_QUEUE_DEPTH", 1))
+BULK_TIMEOUT_SECONDS = float(os.environ.get("BULK_TOOL_TIMEOUT", 1800))
+
+TOOL_POOLS = {
+    'get_email_attachment': 'attachments',
+    'extract_receipts': 'bulk',
+    'export_emails': 'bulk',
+}
+TOOL_TIMEOUTS = {
+    'extract_receipts': BULK_TIMEOUT_SECONDS,
+    'export_emails': BULK_TIMEOUT_SECONDS,
+}
+
+
+class ToolBusyError(Exception):
+    """Raised when a tool's pool already has as much work as it may queue."""
+
+
+class ToolPool:
+    """
+    A thread pool with a hard cap on queued + running calls.
+    """
+
+    def __init__(self, name: str, workers: int, queue_depth: int):
+        self.name = name
+        self.workers = workers
+        self.max_pending = workers + queue_depth
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"tool-{name}")
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise ToolBusyError(f"{self.name} pool is busy ({self._pending} calls in flight)")
+            self._pending += 1
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ToolRunner:
+    """
+    Runs synchronous tool functions off the event loop on bounded pools.
+    """
+
+    def __init__(self):
+        self.pools = {
+            'default': ToolPool('default', DEFAULT_WORKERS, DEFAULT_QUEUE_DEPTH),
+            'attachments': ToolPool('attachments', ATTACHMENT_WORKERS, ATTACHMENT_QUEUE_DEPTH),
+            'bulk': ToolPool('bulk', BULK_WORKERS, BULK_QUEUE_DEPTH),
+        }
+
+    def pool_for(self, tool_name: str) -> ToolPool:
+        return self.pools[TOOL_POOLS.get(tool_name, 'default')]
+
+    async def run(self, tool_name: str, fn, arguments: dict, timeout: float = None):
+        """
+        Run fn(**arguments) on the tool's pool and await the result.
+
+        Raises ToolBusyError if the pool is full and asyncio.TimeoutError if the
+        call does not finish in time (by default TOOL_TIMEOUT, or the tool's
+        entry in TOOL_TIMEOUTS). A call that times out while still queued is
+        cancelled; one that is already running finishes in the background.
+        """
+        timeout = timeout or TOOL_TIMEOUTS.get(tool_name, TOOL_TIMEOUT_SECONDS)
+        start = time.perf_counter()
+        status = 'error'
+        metrics.TOOLS_IN_FLIGHT.inc(tool=tool_name)
+        try:
+            future = self.pool_for(tool_name).submit(metrics.traced(tool_name, fn), **arguments)
+            result = await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+            status = 'ok'
+            return result
+        except ToolBusyError:
+            status = 'busy'
+            raise
+        except asyncio.TimeoutError:
+            status = 'timeout'
+            raise
+        finally:
+            metrics.TOOLS_IN_FLIGHT.dec(tool=tool_name)
+            metrics.TOOL_DURATION.observe(time.perf_counter() - start, tool=tool_name, status=status)
+
+    async def stream(self, tool_name: str, gen_fn, arguments: dict, timeout: float = None):
+        """
+        Run the generator function gen_fn(**arguments) on the tool's pool and
+        yield its items on the event loop as they are produced.
+
+        `timeout` bounds the wait for each item. If the consumer stops early
+        (e.g. the client disconnected) the producer stops at its next item.
+        """
+        timeout = timeout or TOOL_TIMEOUTS.get(tool_name, TOOL_TIMEOUT_SECONDS)
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        stop = threading.Event()
+        done = object()
+        gen_fn = metrics.traced_generator(tool_name, gen_fn)
+
+        def produce():
+            try:
+                for item in gen_fn(**arguments):
+                    if stop.is_set():
+                        return
+                    loop.call_soon_threadsafe(queue.put_nowait, (item, None))
+            except BaseException as e:
+                loop.call_soon_threadsafe(queue.put_nowait, (done, e))
+            else:
+                loop.call_soon_threadsafe(queue.put_nowait, (done, None))
+
+        start = time.perf_counter()
+        status = 'error'
+        metrics.TOOLS_IN_FLIGHT.inc(tool=tool_name)
+        try:
+            future = self.pool_for(tool_name).submit(produce)
+            try:
+                while True:
+                    item, error = await asyncio.wait_for(queue.get(), timeout)
+                    if error is not None:
+                        raise error
+                    if item is done:
+                        status = 'ok'
+                        return
+                    yield item
+            finally:
+                stop.set()
+                future.cancel()
+        except ToolBusyError:
+            status = 'busy'
+            raise
+        except asyncio.TimeoutError:
+            status = 'timeout'
+            raise
+        finally:
+            metrics.TOOLS_IN_FLIGHT.dec(tool=tool_name)
+            metrics.TOOL_DURATION.observe(time.perf_counter() - start, tool=tool_name, status=status)
+
+    def stats(self) -> dict:
+        return {
+            name: {'workers': pool.workers, 'max_pending': pool.max_pending, 'pending': pool.pending}
+            for name, pool in self.pools.items()
+        }
+
+    def shutdown(self):
+        for pool in self.pools.values():
+            pool.shutdown()